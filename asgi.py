@@ -0,0 +1,111 @@
+import json
+import time
+import nicehash
+from config import *
+from snapshot import async_rig_snapshot, names_from_body, control_from_body, merge_results
+from metrics import service_metrics, CONTENT_TYPE
+
+#plain ASGI app with the same routes as main.py, served by uvicorn (SERVER=asgi)
+private_api = None
+snapshot = None
+metrics = None
+
+async def startup():
+  global private_api, snapshot, metrics
+  transport = None
+  if CASSETTE and CASSETTE_MODE == "record":
+    raise Exception("CASSETTE_MODE=record is only supported with SERVER=flask")
+  elif CASSETTE:
+    transport = nicehash.async_replay_transport(CASSETTE, latency=REPLAY_LATENCY, error_rate=REPLAY_ERROR_RATE)
+  private_api = nicehash.async_private_api(NICEHASH_URL, organisation_id, key, secret, pool_size=POOL_SIZE,
+    breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET, latency_budget=LATENCY_BUDGET, transport=transport)
+  snapshot = async_rig_snapshot(private_api, REFRESH_INTERVAL).start()
+  metrics = service_metrics(private_api, snapshot)
+
+async def shutdown():
+  snapshot.stop()
+  await private_api.close()
+
+async def lifespan(receive, send):
+  while True:
+    message = await receive()
+    if message["type"] == "lifespan.startup":
+      await startup()
+      await send({"type": "lifespan.startup.complete"})
+    elif message["type"] == "lifespan.shutdown":
+      await shutdown()
+      await send({"type": "lifespan.shutdown.complete"})
+      return
+
+async def read_body(receive):
+  body = b""
+  more = True
+  while more:
+    message = await receive()
+    body += message.get("body", b"")
+    more = message.get("more_body", False)
+  return body
+
+async def respond(send, status, value):
+  headers = [(b"content-type", b"application/json")]
+  age = snapshot.age()
+  if age is not None:
+    headers.append((b"x-snapshot-age", "{:.3f}".format(age).encode()))
+  if snapshot.stale():
+    headers.append((b"x-snapshot-stale", b"true"))
+  await send({"type": "http.response.start", "status": status, "headers": headers})
+  await send({"type": "http.response.body", "body": json.dumps(value).encode()})
+
+def route_of(path):
+  if path in ("/", "/bulk/control", "/metrics"):
+    return path
+  return "/<name>" if "/" not in path[1:] else "unmatched"
+
+async def app(scope, receive, send):
+  if scope["type"] == "lifespan":
+    return await lifespan(receive, send)
+
+  start = time.perf_counter()
+  statuses = []
+  async def send_observed(message):
+    if message["type"] == "http.response.start":
+      statuses.append(message["status"])
+    await send(message)
+  try:
+    await handle(scope, receive, send_observed)
+  finally:
+    metrics.observe(route_of(scope["path"]), statuses[0] if statuses else 500, time.perf_counter() - start)
+
+async def handle(scope, receive, send):
+  path = scope["path"]
+  if path == "/metrics" and scope["method"] == "GET":
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", CONTENT_TYPE.encode())]})
+    return await send({"type": "http.response.body", "body": metrics.render().encode()})
+
+  if scope["method"] != "POST":
+    return await respond(send, 405, {"error": "method not allowed"})
+
+  if path == "/bulk/control":
+    try:
+      targets, collapse = control_from_body(json.loads(await read_body(receive) or b"null"))
+    except ValueError as e:
+      return await respond(send, 400, {"error": str(e)})
+    await snapshot.wait(STARTUP_WAIT)
+    resolved, indexes = snapshot.resolve(targets)
+    results = await private_api.bulk_update_status(resolved, max_workers=CONTROL_WORKERS, collapse=collapse)
+    return await respond(send, 200, merge_results(targets, indexes, results))
+
+  if path == "/":
+    try:
+      body = json.loads(await read_body(receive) or b"null")
+      names = names_from_body(body)
+    except ValueError as e: #also covers malformed json
+      return await respond(send, 400, {"error": str(e)})
+    await snapshot.wait(STARTUP_WAIT)
+    return await respond(send, 200, snapshot.get_many(names))
+
+  name = path[1:]
+  if "/" in name:
+    return await respond(send, 404, {"error": "not found"})
+  await snapshot.wait(STARTUP_WAIT)
+  await respond(send, 200, snapshot.get(name))
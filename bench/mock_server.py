@@ -0,0 +1,493 @@
+# Local NiceHash stand-in for load tests: python -m bench.mock_server [--rigs N] [--port P] ...
+# Serves the endpoints this project uses for a synthetic fleet, checks X-Auth signatures like the real api and
+# feeds a websocket with a simulated exchange market. Point NICEHASH_URL at http://localhost:<port> with the same
+# KEY/SECRET/ORG_ID (signatures are only checked when all three are set) and main.py runs against it unchanged.
+import asyncio
+import hmac
+import json
+import optparse
+import random
+import threading
+import time
+import uuid
+
+from aiohttp import web, WSMsgType
+
+from nicehash import hmac_signer, ALGORITHMS, ALGORITHM_INDEX, RIG_ACTIONS
+
+MINER_STATUSES = [ ("MINING", 70), ("STOPPED", 10), ("OFFLINE", 10), ("BENCHMARKING", 4), ("ERROR", 3), ("PENDING", 3) ]
+RIG_ALGORITHMS = [ "DAGGERHASHIMOTO", "KAWPOW", "OCTOPUS", "ZHASH", "BEAMV3", "RANDOMXMONERO" ]
+MAX_TIME_DRIFT = 300000 # ms; signed requests further off the server clock are rejected
+TRADE_HISTORY = 5000 # trades kept for the history endpoints
+CANDLE_HISTORY = 1440 # closed 1 minute candles kept
+
+def enum(value):
+    return {"enumName": value, "description": value.title()}
+
+def error(status, code, message):
+    body = {"error_id": str(uuid.uuid4()), "errors": [{"code": code, "message": message}]}
+    return web.json_response(body, status=status)
+
+# Synthetic rigs2/groups data for a fleet of the given size; the same seed always builds the same fleet.
+# Only the state rigs/status2 can change is kept per rig; the rest of each rig is rebuilt from the seed when served,
+# so a 100k rig fleet stays small and quick to create.
+class fleet:
+
+    def __init__(self, size, group_size=20, seed=0):
+        rng = random.Random(seed)
+        statuses, weights = zip(*MINER_STATUSES)
+        now = int(time.time() * 1000)
+        self.size = size
+        self.group_size = group_size
+        self.seed = seed
+        self.created = now
+        self.ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(size)]
+        self.statuses = rng.choices(statuses, weights, k=size)
+        self.power_modes = ["MEDIUM"] * size
+        self.status_times = [now - rng.randrange(86400000) for _ in range(size)]
+        self.by_id = {rig_id: i for i, rig_id in enumerate(self.ids)}
+        self.counts = {}
+        for status in self.statuses:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def name(self, i):
+        return "rig-{:06d}".format(i)
+
+    def group(self, i):
+        return "group-{:04d}".format(i // self.group_size)
+
+    # Like the real api, an empty group name means every rig.
+    def group_indexes(self, name):
+        if not name:
+            return range(self.size)
+        try:
+            g = int(name.rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            return range(0)
+        return range(g * self.group_size, min((g + 1) * self.group_size, self.size)) if name == "group-{:04d}".format(g) else range(0)
+
+    def rig(self, i):
+        rng = random.Random(self.seed << 32 | i)
+        profitability = round(rng.uniform(0.00001, 0.0005), 8)
+        devices = [{
+            "id": "{}-{}".format(self.ids[i], d),
+            "name": "GPU " + str(d),
+            "deviceType": enum(rng.choice(["NVIDIA", "AMD"])),
+            "status": enum("MINING"),
+            "temperature": rng.randint(45, 80),
+            "load": rng.randint(80, 100),
+            "powerUsage": rng.randint(90, 300),
+            "powerMode": enum(self.power_modes[i]),
+        } for d in range(rng.randint(1, 8))]
+        return {
+            "rigId": self.ids[i],
+            "type": "MANAGED",
+            "name": self.name(i),
+            "statusTime": self.status_times[i],
+            "joinTime": self.created // 1000 - rng.randrange(86400 * 365),
+            "minerStatus": self.statuses[i],
+            "groupName": self.group(i),
+            "unpaidAmount": "{:.8f}".format(rng.uniform(0, 0.01)),
+            "notifications": [],
+            "devices": devices,
+            "stats": [{
+                "statsTime": self.created,
+                "market": rng.choice(["EU", "USA"]),
+                "algorithm": enum(rng.choice(RIG_ALGORITHMS)),
+                "unpaidAmount": "{:.8f}".format(rng.uniform(0, 0.001)),
+                "speedAccepted": round(rng.uniform(10, 500), 2),
+                "speedRejectedTotal": round(rng.uniform(0, 2), 2),
+                "profitability": profitability,
+            }],
+            "profitability": profitability,
+            "localProfitability": profitability,
+            "rigPowerMode": enum(self.power_modes[i]),
+        }
+
+    def rigs2(self, size, page, status=""):
+        indexes = [i for i in range(self.size) if self.statuses[i] == status] if status else range(self.size)
+        pages = max(1, -(-len(indexes) // size))
+        return {
+            "minerStatuses": dict(self.counts),
+            "rigTypes": {"MANAGED": self.size},
+            "totalRigs": self.size,
+            "path": "",
+            "miningRigGroups": [],
+            "miningRigs": [self.rig(i) for i in indexes[page * size:(page + 1) * size]],
+            "pagination": {"size": size, "page": page, "totalPageCount": pages},
+        }
+
+    def groups_list(self):
+        groups = {}
+        for start in range(0, self.size, self.group_size):
+            name = self.group(start)
+            groups[name] = {
+                "id": name,
+                "name": name,
+                "groups": {},
+                "rigs": [{"rigId": self.ids[i], "name": self.name(i), "status": self.statuses[i], "powerMode": self.power_modes[i], "notifications": []}
+                         for i in range(start, min(start + self.group_size, self.size))],
+            }
+        return {"groups": groups}
+
+    def algo_stats(self, i, after, before):
+        stat = self.rig(i)["stats"][0]
+        code = ALGORITHM_INDEX.get(stat["algorithm"]["enumName"], 0)
+        before = before if before > 0 else int(time.time() * 1000)
+        after = after if after > 0 else before - 86400000
+        rows = [[ts, code, stat["unpaidAmount"], stat["profitability"], stat["speedAccepted"], stat["speedRejectedTotal"]]
+                for ts in range(after - after % 300000, before, 300000)]
+        return {"columns": ["time", "algorithm", "unpaidAmount", "profitability", "speedAccepted", "speedRejected"], "data": rows[-288:]}
+
+    # rigs/status2: START -> MINING, STOP -> STOPPED, POWER_MODE sets the power mode; a group target hits all its rigs
+    def update_status(self, body):
+        if body.get("rigId"):
+            i = self.by_id.get(body["rigId"])
+            indexes = [i] if i is not None else []
+        else:
+            indexes = self.group_indexes(body.get("group") or "")
+        now = int(time.time() * 1000)
+        for i in indexes:
+            status = {"START": "MINING", "STOP": "STOPPED"}.get(body["action"])
+            if status is not None:
+                self.counts[self.statuses[i]] -= 1
+                self.counts[status] = self.counts.get(status, 0) + 1
+                self.statuses[i] = status
+            elif body.get("options"):
+                self.power_modes[i] = body["options"][0]
+            self.status_times[i] = now
+        return len(indexes)
+
+def buy_info():
+    algorithms = []
+    for name in ALGORITHMS:
+        algorithms.append({
+            "name": name, "algo": ALGORITHM_INDEX[name], "down_step": "-0.0001", "min_diff_working": "0.1",
+            "min_limit": "0.01", "max_limit": "10000", "speed_text": "TH", "min_diff_initial": "1", "multi": "1",
+            "min_price": "0.0001", "max_price": "100", "min_amount": "0.001",
+        })
+    return {"miningAlgorithms": algorithms}
+
+# Simulated exchange market for the websocket feed. Every tick changes some order book levels, prints a few trades
+# and updates the current candle; each stream numbers its messages with "s" so clients can spot gaps.
+class market:
+
+    def __init__(self, seed=0, levels=50):
+        self.rng = random.Random(seed)
+        self.mid = 100.0
+        self.bids = {}
+        self.asks = {}
+        for i in range(1, levels + 1):
+            self.bids[round(self.mid - i * 0.01, 2)] = round(self.rng.uniform(0.1, 5), 4)
+            self.asks[round(self.mid + i * 0.01, 2)] = round(self.rng.uniform(0.1, 5), 4)
+        self.trades = [] # last trades, oldest first
+        self.trade_id = 0
+        self.candle = None
+        self.candles = [] # closed candles, oldest first
+        self.seq = {"ob": 0, "m": 0, "mt": 0, "c": 0}
+
+    def book(self):
+        return {"b": sorted(self.bids.items(), reverse=True), "a": sorted(self.asks.items())}
+
+    # A volume of 0 clears the level.
+    def tick(self):
+        self.mid = max(1.0, self.mid + self.rng.gauss(0, 0.02))
+        bids, asks = [], []
+        for _ in range(self.rng.randint(1, 5)):
+            bid = self.rng.random() < 0.5
+            side, changes, sign = (self.bids, bids, -1) if bid else (self.asks, asks, 1)
+            price = round(self.mid + sign * self.rng.randint(1, 50) * 0.01, 2)
+            volume = 0 if price in side and self.rng.random() < 0.3 else round(self.rng.uniform(0.1, 5), 4)
+            if volume:
+                side[price] = volume
+                # keep the book uncrossed as the mid price drifts
+                other, cleared = (self.asks, asks) if bid else (self.bids, bids)
+                for level in [level for level in other if (level <= price if bid else level >= price)]:
+                    del other[level]
+                    cleared.append([level, 0])
+            else:
+                side.pop(price, None)
+            changes.append([price, volume])
+        messages = [self.message("ob", "ob.u", b=bids, a=asks)]
+
+        now = int(time.time() * 1000)
+        trades = []
+        for _ in range(self.rng.randint(0, 3)):
+            self.trade_id += 1
+            trades.append({"id": str(self.trade_id), "p": round(self.mid, 2), "q": round(self.rng.uniform(0.01, 1), 4), "sd": self.rng.choice(["BUY", "SELL"]), "t": now, "mine": self.rng.random() < 0.1})
+        self.trades = (self.trades + trades)[-TRADE_HISTORY:]
+        if trades:
+            messages.append(self.message("m", "m.u", t=trades))
+            mine = [trade for trade in trades if trade["mine"]]
+            if mine:
+                messages.append(self.message("mt", "mt.u", t=mine))
+
+        start = now // 60000 * 60
+        price = round(self.mid, 2)
+        volume = sum(trade["q"] for trade in trades)
+        if self.candle is None or self.candle["t"] != start:
+            if self.candle is not None:
+                self.candles = (self.candles + [self.candle])[-CANDLE_HISTORY:]
+            self.candle = {"t": start, "o": price, "h": price, "l": price, "c": price, "v": volume}
+        else:
+            self.candle.update(h=max(self.candle["h"], price), l=min(self.candle["l"], price), c=price, v=round(self.candle["v"] + volume, 4))
+        messages.append(self.message("c", "c.u", r=1, c=dict(self.candle)))
+        return messages
+
+    def message(self, stream, method, **fields):
+        self.seq[stream] += 1
+        return dict(m=method, s=self.seq[stream], **fields)
+
+    # Trades older than before (µs) in the REST format, newest first.
+    def trade_history(self, before, limit, mine=False):
+        history = []
+        for trade in reversed(self.trades):
+            if len(history) >= limit:
+                break
+            if trade["t"] * 1000 >= before or (mine and not trade["mine"]):
+                continue
+            history.append({"id": trade["id"], "dir": trade["sd"], "price": trade["p"], "qty": trade["q"],
+                            "sndQty": round(trade["p"] * trade["q"], 8), "time": trade["t"] * 1000})
+        return history
+
+    # 1 minute candles starting between from_s and to_s in the REST format, oldest first.
+    def candle_history(self, from_s, to_s):
+        candles = self.candles + ([self.candle] if self.candle else [])
+        return [{"time": candle["t"], "open": candle["o"], "high": candle["h"], "low": candle["l"], "close": candle["c"], "volume": candle["v"]}
+                for candle in candles if from_s <= candle["t"] <= to_s]
+
+    # first message of a subscription, carrying the current state and the stream's current sequence number
+    def snapshot(self, channel):
+        if channel == "orderbook":
+            return dict(m="ob.s", s=self.seq["ob"], **self.book())
+        if channel == "trades":
+            return {"m": "m.s", "s": self.seq["m"], "t": self.trades[-50:]}
+        if channel == "mytrades":
+            return {"m": "mt.s", "s": self.seq["mt"], "t": [trade for trade in self.trades if trade["mine"]][-50:]}
+        if channel == "candlesticks":
+            return {"m": "c.s", "s": self.seq["c"], "r": 1, "c": [dict(self.candle)] if self.candle else []}
+        if channel == "orders":
+            return {"m": "o.s", "o": []}
+
+PRIVATE_CHANNELS = [ "mytrades", "orders" ]
+STREAMS = {"ob": "orderbook", "m": "trades", "mt": "mytrades", "c": "candlesticks"}
+
+class mock_server:
+
+    def __init__(self, fleet, key=None, secret=None, organisation_id=None, latency=0.0, jitter=0.0, failure_rate=0.0, ws_interval=1.0, ws_drop_rate=0.0, seed=0):
+        self.fleet = fleet
+        self.signer = hmac_signer(key, secret, organisation_id) if key and secret and organisation_id else None
+        self.organisation_id = organisation_id
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.ws_interval = ws_interval
+        self.ws_drop_rate = ws_drop_rate
+        self.rng = random.Random(seed)
+        self.market = market(seed)
+        self.sockets = {} # websocket -> set of subscribed channels
+        self.ticker = None
+
+    def app(self):
+        app = web.Application(middlewares=[self.simulate])
+        app.router.add_get("/api/v2/time", self.time)
+        app.router.add_get("/main/api/v2/mining/rigs2", self.rigs2)
+        app.router.add_get("/main/api/v2/mining/groups/list", self.groups)
+        app.router.add_get("/main/api/v2/mining/rig2/{rig_id}", self.rig)
+        app.router.add_get("/main/api/v2/mining/rig/stats/algo", self.algo_stats)
+        app.router.add_post("/main/api/v2/mining/rigs/status2", self.update_status)
+        app.router.add_get("/main/api/v2/public/buy/info", self.buy_info)
+        app.router.add_get("/exchange/api/v2/info/trades", self.trades)
+        app.router.add_get("/exchange/api/v2/info/myTrades", self.trades)
+        app.router.add_get("/exchange/api/v2/candlesticks", self.candlesticks)
+        app.router.add_get("/ws", self.websocket)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+    # Latency, injected failures and signature checks, in the order the real api would hit them.
+    @web.middleware
+    async def simulate(self, request, handler):
+        if request.path == "/ws":
+            return await handler(request)
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            return error(503, 5000, "Service temporarily unavailable")
+        if request.path.startswith("/main/api/v2/mining/") or request.path == "/exchange/api/v2/info/myTrades":
+            denied = await self.check_auth(request)
+            if denied is not None:
+                return denied
+        return await handler(request)
+
+    async def check_auth(self, request, method=None, path=None, query=None, body=None):
+        if self.signer is None:
+            return None
+        headers = request.headers
+        if "X-Auth" not in headers or "X-Time" not in headers or "X-Nonce" not in headers:
+            return error(401, 2000, "Missing authentication headers")
+        if headers.get("X-Organization-Id") != self.organisation_id:
+            return error(403, 2000, "Invalid organization")
+        try:
+            xtime = int(headers["X-Time"])
+        except ValueError:
+            return error(403, 2000, "Invalid X-Time")
+        if abs(xtime - time.time() * 1000) > MAX_TIME_DRIFT:
+            return error(403, 2000, "X-Time too far from server time")
+        if method is None:
+            text = await request.text()
+            method, path, query, body = request.method, request.path, request.query_string, text or None
+        expected = self.signer.sign(headers["X-Time"], headers["X-Nonce"], method, path, query, body)
+        if not hmac.compare_digest(expected, headers["X-Auth"]):
+            return error(403, 2000, "Invalid signature")
+        return None
+
+    async def time(self, request):
+        return web.json_response({"serverTime": int(time.time() * 1000)})
+
+    async def rigs2(self, request):
+        size = int(request.query.get("size") or 25)
+        page = int(request.query.get("page") or 0)
+        return web.json_response(self.fleet.rigs2(size, page, request.query.get("status", "")))
+
+    async def groups(self, request):
+        return web.json_response(self.fleet.groups_list())
+
+    async def rig(self, request):
+        i = self.fleet.by_id.get(request.match_info["rig_id"])
+        if i is None:
+            return error(404, 3001, "Rig not found")
+        return web.json_response(self.fleet.rig(i))
+
+    async def algo_stats(self, request):
+        i = self.fleet.by_id.get(request.query.get("rigId"))
+        if i is None:
+            return error(404, 3001, "Rig not found")
+        after = int(request.query.get("afterTimestamp") or -1)
+        before = int(request.query.get("beforeTimestamp") or -1)
+        return web.json_response(self.fleet.algo_stats(i, after, before))
+
+    async def update_status(self, request):
+        body = await request.json()
+        if body.get("action") not in RIG_ACTIONS:
+            return error(400, 1000, "Invalid action")
+        if not self.fleet.update_status(body):
+            return error(404, 3001, "Rig or group not found")
+        return web.json_response({"success": True, "successType": "SUCCESS", "message": "OK"})
+
+    async def buy_info(self, request):
+        return web.json_response(buy_info())
+
+    # Exchange history, for backfilling the websocket feed. There is a single market, whatever the market parameter.
+    async def trades(self, request):
+        limit = int(request.query.get("limit") or 25)
+        before = int(request.query.get("timestamp") or time.time() * 1000000)
+        return web.json_response(self.market.trade_history(before, limit, mine=request.path.endswith("myTrades")))
+
+    async def candlesticks(self, request):
+        if request.query.get("resolution", "1") != "1":
+            return error(400, 1000, "Only resolution 1 is simulated")
+        from_s = int(request.query.get("from") or 0)
+        to_s = int(request.query.get("to") or time.time())
+        return web.json_response(self.market.candle_history(from_s, to_s))
+
+    # Exchange feed: {"m": "subscribe.<channel>"} / {"m": "unsubscribe.<channel>"}. Private channels need the
+    # upgrade request signed the way websockets_api signs it (method "wss", path "my", empty query).
+    async def websocket(self, request):
+        authorized = "X-Auth" in request.headers and self.signer is not None and await self.check_auth(request, "wss", "my", "") is None
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self.sockets[ws] = set()
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    method = json.loads(message.data).get("m", "")
+                except ValueError:
+                    await ws.send_json({"m": "error", "e": "invalid json"})
+                    continue
+                action, _, channel = method.partition(".")
+                if channel not in ("orderbook", "trades", "mytrades", "candlesticks", "orders") or action not in ("subscribe", "unsubscribe"):
+                    await ws.send_json({"m": "error", "e": "unknown method " + method})
+                elif action == "unsubscribe":
+                    self.sockets[ws].discard(channel)
+                elif channel in PRIVATE_CHANNELS and not (authorized or self.signer is None):
+                    await ws.send_json({"m": "error", "e": "unauthorized"})
+                else:
+                    self.sockets[ws].add(channel)
+                    await ws.send_json(self.market.snapshot(channel))
+        finally:
+            del self.sockets[ws]
+        return ws
+
+    async def tick(self):
+        while True:
+            await asyncio.sleep(self.ws_interval)
+            messages = self.market.tick()
+            for ws, channels in list(self.sockets.items()):
+                for message in messages:
+                    if STREAMS.get(message["m"].split(".")[0]) not in channels:
+                        continue
+                    # a dropped message leaves a sequence gap, like a flaky connection would
+                    if self.ws_drop_rate and self.rng.random() < self.ws_drop_rate:
+                        continue
+                    try:
+                        await ws.send_json(message)
+                    except ConnectionResetError:
+                        break
+
+    async def start(self, app):
+        self.ticker = asyncio.ensure_future(self.tick())
+
+    async def stop(self, app):
+        self.ticker.cancel()
+
+# Run the server on its own event loop thread, e.g. from a benchmark; returns (base url, stop function).
+def serve_in_background(server, host="127.0.0.1", port=0):
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(server.app())
+
+    async def start():
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        return runner.addresses[0][1]
+
+    thread = threading.Thread(target=loop.run_forever, name="mock-server", daemon=True)
+    thread.start()
+    port = asyncio.run_coroutine_threadsafe(start(), loop).result()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return "http://{}:{}".format(host, port), stop
+
+def main():
+    from config import key, secret, organisation_id
+
+    parser = optparse.OptionParser()
+    parser.add_option('--host', dest="host", help="Interface to listen on", default="127.0.0.1")
+    parser.add_option('-p', '--port', dest="port", type="int", help="Port to listen on", default=8080)
+    parser.add_option('-r', '--rigs', dest="rigs", type="int", help="Fleet size (10 to 100k)", default=1000)
+    parser.add_option('-g', '--group-size', dest="group_size", type="int", help="Rigs per group", default=20)
+    parser.add_option('-l', '--latency', dest="latency", type="float", help="Seconds added to every response", default=0.0)
+    parser.add_option('-j', '--jitter', dest="jitter", type="float", help="Extra random latency, up to this many seconds", default=0.0)
+    parser.add_option('-f', '--failure-rate', dest="failure_rate", type="float", help="Share of requests answered with 503", default=0.0)
+    parser.add_option('--ws-interval', dest="ws_interval", type="float", help="Seconds between market updates on the websocket", default=1.0)
+    parser.add_option('--ws-drop-rate', dest="ws_drop_rate", type="float", help="Share of websocket updates dropped per connection", default=0.0)
+    parser.add_option('--seed', dest="seed", type="int", help="Random seed for the fleet and the simulation", default=0)
+    options, args = parser.parse_args()
+
+    server = mock_server(fleet(options.rigs, options.group_size, options.seed), key, secret, organisation_id,
+        latency=options.latency, jitter=options.jitter, failure_rate=options.failure_rate,
+        ws_interval=options.ws_interval, ws_drop_rate=options.ws_drop_rate, seed=options.seed)
+    if server.signer is None:
+        print("KEY, SECRET or ORG_ID not set, signatures are not checked")
+    web.run_app(server.app(), host=options.host, port=options.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Signing micro-benchmark: python -m bench.signing [-n calls]
+# Checks that hmac_signer produces byte-identical signatures to the original bytearray-built implementation,
+# then measures calls/sec for both.
+import hmac
+import json
+import optparse
+import random
+import time
+import uuid
+from hashlib import sha256
+
+from nicehash import hmac_signer
+
+KEY = "4ebd366d-76f4-4400-a3b6-e51515d054d6"
+SECRET = "fd8a1652-728b-42fe-82b8-f623e56da8850750f5bf-ce66-4ca7-8b84-93651abc723b"
+ORG_ID = "da41b3bc-3d0b-4226-b7ea-aee73f94a518"
+
+# private_api.request's signing code before hmac_signer
+def legacy_sign(key, secret, organisation_id, xtime, xnonce, method, path, query, body_json=None):
+    message = bytearray(key, 'utf-8')
+    message += bytearray('\x00', 'utf-8')
+    message += bytearray(str(xtime), 'utf-8')
+    message += bytearray('\x00', 'utf-8')
+    message += bytearray(xnonce, 'utf-8')
+    message += bytearray('\x00', 'utf-8')
+    message += bytearray('\x00', 'utf-8')
+    message += bytearray(organisation_id, 'utf-8')
+    message += bytearray('\x00', 'utf-8')
+    message += bytearray('\x00', 'utf-8')
+    message += bytearray(method, 'utf-8')
+    message += bytearray('\x00', 'utf-8')
+    message += bytearray(path, 'utf-8')
+    message += bytearray('\x00', 'utf-8')
+    message += bytearray(query, 'utf-8')
+
+    if body_json is not None:
+        message += bytearray('\x00', 'utf-8')
+        message += bytearray(body_json, 'utf-8')
+
+    digest = hmac.new(bytearray(secret, 'utf-8'), message, sha256).hexdigest()
+    return key + ":" + digest
+
+def sample_requests(n):
+    rng = random.Random(0)
+    samples = []
+    for i in range(n):
+        xtime = 1647000000000 + rng.randrange(10 ** 9)
+        xnonce = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        if i % 3 == 0:
+            body = json.dumps({"group": "", "rigId": "rig-" + str(i), "deviceId": "", "action": "STOP", "options": None})
+            samples.append((xtime, xnonce, "POST", "/main/api/v2/mining/rigs/status2", "", body))
+        else:
+            query = "size=100&page={}&path=&sort=NAME&system=&status=".format(i)
+            samples.append((xtime, xnonce, "GET", "/main/api/v2/mining/rigs2", query, None))
+    return samples
+
+def check(samples):
+    signer = hmac_signer(KEY, SECRET, ORG_ID)
+    for sample in samples:
+        if signer.sign(*sample) != legacy_sign(KEY, SECRET, ORG_ID, *sample):
+            raise Exception("signature mismatch for {}".format(sample))
+    # websockets_api signs method "wss", path "my" and no query
+    sample = (1647000000000, str(uuid.uuid4()), "wss", "my", "")
+    if signer.sign(*sample) != legacy_sign(KEY, SECRET, ORG_ID, *sample):
+        raise Exception("websocket signature mismatch")
+
+def rate(fn, samples):
+    start = time.perf_counter()
+    for sample in samples:
+        fn(*sample)
+    return len(samples) / (time.perf_counter() - start)
+
+def run(n=100000):
+    samples = sample_requests(n)
+    check(samples)
+    signer = hmac_signer(KEY, SECRET, ORG_ID)
+    legacy = rate(lambda *sample: legacy_sign(KEY, SECRET, ORG_ID, *sample), samples)
+    fast = rate(signer.sign, samples)
+    return {"calls": n, "legacy_calls_per_sec": legacy, "signer_calls_per_sec": fast, "speedup": fast / legacy}
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--calls', dest="calls", type="int", help="Signatures per implementation", default=100000)
+    options, args = parser.parse_args()
+
+    result = run(options.calls)
+    print("signatures identical for {} requests".format(result["calls"]))
+    print("legacy: {:>10.0f} calls/sec".format(result["legacy_calls_per_sec"]))
+    print("signer: {:>10.0f} calls/sec ({:.2f}x)".format(result["signer_calls_per_sec"], result["speedup"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# Benchmark suite: python -m bench.suite [-s 10,1000,100000] [-o bench-results.json] [-c baseline.json]
+# Runs the service and the client hot paths against bench.mock_server on this machine and writes every result with
+# its p50/p95/p99 (seconds) to a JSON file, so runs on two commits can be compared with --compare.
+# The mock is local, so the client's token buckets are switched off; they would otherwise set the pace.
+import asyncio
+import json
+import logging
+import optparse
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import nicehash
+from bench.signing import KEY, SECRET, ORG_ID
+from bench.mock_server import fleet, mock_server, serve_in_background
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+def summarize(name, samples, wall=None, **params):
+    samples = sorted(samples)
+    result = {
+        "name": name,
+        "params": params,
+        "n": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+    }
+    if wall is not None:
+        result["wall"] = wall
+        result["per_sec"] = len(samples) / wall
+    return result
+
+# Seconds per call of fn, sampled n times; calls that are too quick to time alone are timed in batches and averaged.
+def timed(fn, n, batch=1):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        for _ in range(batch):
+            fn()
+        samples.append((time.perf_counter() - start) / batch)
+    return samples
+
+def bench_signing(n):
+    api = nicehash.private_api("http://127.0.0.1", ORG_ID, KEY, SECRET, clock_sync=False)
+    query = "size=100&page=0&path=&sort=NAME&system=&status="
+    body = json.dumps({"group": "", "rigId": "rig", "deviceId": "", "action": "STOP", "options": None})
+    return [
+        summarize("sign", timed(lambda: api.sign("GET", "/main/api/v2/mining/rigs2", query, None), n, batch=100), method="GET"),
+        summarize("sign", timed(lambda: api.sign("POST", "/main/api/v2/mining/rigs/status2", "", body), n, batch=100), method="POST"),
+    ]
+
+def bench_decode(n):
+    payload = json.dumps(fleet(100).rigs2(100, 0)).encode("utf-8")
+    return [summarize("decode_rigs_page", timed(lambda: decode(payload), n, batch=10), decoder=name, rigs=100, bytes=len(payload))
+            for name, decode in nicehash.DECODERS.items()]
+
+# rig_snapshot.update: the name -> rig index built from a whole get_all_rigs response
+def bench_index(size, n):
+    from snapshot import rig_snapshot
+    rigs = fleet(size).rigs2(size, 0)["miningRigs"]
+    snapshot = rig_snapshot(None)
+    return [summarize("snapshot_index", timed(lambda: snapshot.update(rigs), n), rigs=size)]
+
+# POST /<name> through the Flask app, served on a local port, with the snapshot filled from the mock fleet
+def bench_service(service, server, size, n, clients):
+    main, url = service
+    server.fleet = fleet(size)
+    start = time.perf_counter()
+    main.snapshot.refresh()
+    refresh = time.perf_counter() - start
+
+    names = [server.fleet.name(i) for i in range(size)]
+    sessions = threading.local()
+    def post(i):
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        name = names[(i * 7919) % size]
+        start = time.perf_counter()
+        response = sessions.session.post(url + "/" + name)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200 or response.json() is None:
+            raise Exception("bad status response for " + name + ": " + response.text)
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        samples = list(pool.map(post, range(n)))
+    wall = time.perf_counter() - start
+    return [
+        summarize("snapshot_refresh", [refresh], rigs=size),
+        summarize("post_status", samples, wall, rigs=size, clients=clients),
+    ]
+
+def start_service(base):
+    os.environ.update(NICEHASH_URL=base, KEY=KEY, SECRET=SECRET, ORG_ID=ORG_ID)
+    from werkzeug.serving import make_server
+    import main
+    main.private_api.rate_limit = False
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    http = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=http.serve_forever, name="bench-service", daemon=True).start()
+    return (main, "http://127.0.0.1:{}".format(http.server_port)), http.shutdown
+
+# get_rig_algo_stats for many rigs at once, on threads with private_api and on the loop with async_private_api
+def bench_fanout(base, server, calls, workers):
+    rig_ids = [server.fleet.ids[i % server.fleet.size] for i in range(calls)]
+
+    api = nicehash.private_api(base, ORG_ID, KEY, SECRET, rate_limit=False, pool_size=workers)
+    api.sync_clock()
+    def fetch(rig_id):
+        start = time.perf_counter()
+        api.get_rig_algo_stats(rig_id)
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        samples = list(pool.map(fetch, rig_ids))
+    results = [summarize("algo_stats_fanout", samples, time.perf_counter() - start, client="threads", calls=calls, workers=workers)]
+    api.close()
+
+    async def run():
+        api = nicehash.async_private_api(base, ORG_ID, KEY, SECRET, rate_limit=False, pool_size=workers)
+        limit = asyncio.Semaphore(workers)
+        async def fetch(rig_id):
+            async with limit:
+                start = time.perf_counter()
+                await api.get_rig_algo_stats(rig_id)
+                return time.perf_counter() - start
+        try:
+            start = time.perf_counter()
+            samples = await asyncio.gather(*[fetch(rig_id) for rig_id in rig_ids])
+            return summarize("algo_stats_fanout", samples, time.perf_counter() - start, client="async", calls=calls, workers=workers)
+        finally:
+            await api.close()
+    results.append(asyncio.run(run()))
+    return results
+
+def metadata():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(), "time": int(time.time())}
+
+def run(sizes, n=1000, clients=16, fanout=200):
+    results = bench_signing(n) + bench_decode(n // 10)
+    for size in sizes:
+        results += bench_index(size, 5)
+
+    server = mock_server(fleet(10), KEY, SECRET, ORG_ID)
+    base, stop_server = serve_in_background(server)
+    service, stop_service = start_service(base)
+    try:
+        for size in sizes:
+            results += bench_service(service, server, size, n, clients)
+        results += bench_fanout(base, server, fanout, clients)
+    finally:
+        stop_service()
+        stop_server()
+    return {"meta": metadata(), "results": results}
+
+def key(result):
+    return result["name"] + " " + json.dumps(result["params"], sort_keys=True)
+
+def compare(old, new):
+    baseline = {key(result): result for result in old["results"]}
+    for result in new["results"]:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        print("{:<70} p50 {:>6.2f}x  p99 {:>6.2f}x".format(key(result), result["p50"] / before["p50"], result["p99"] / before["p99"]))
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-s', '--sizes', dest="sizes", help="Comma separated fleet sizes", default="10,1000,100000")
+    parser.add_option('-n', '--requests', dest="requests", type="int", help="Samples per benchmark", default=1000)
+    parser.add_option('--clients', dest="clients", type="int", help="Concurrent clients/workers", default=16)
+    parser.add_option('--fanout', dest="fanout", type="int", help="get_rig_algo_stats calls in the fan-out benchmark", default=200)
+    parser.add_option('-o', '--output', dest="output", help="Results file", default="bench-results.json")
+    parser.add_option('-c', '--compare', dest="compare", help="Earlier results file to compare against")
+    options, args = parser.parse_args()
+
+    random.seed(0)
+    report = run([int(size) for size in options.sizes.split(",")], options.requests, options.clients, options.fanout)
+    with open(options.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    for result in report["results"]:
+        print("{:<70} p50 {:.6f}  p95 {:.6f}  p99 {:.6f}".format(key(result), result["p50"], result["p95"], result["p99"]))
+    print("written to " + options.output)
+    if options.compare:
+        with open(options.compare) as file:
+            compare(json.load(file), report)
+
+if __name__ == "__main__":
+    main()
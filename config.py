@@ -0,0 +1,21 @@
+import os
+
+NICEHASH_URL = os.environ.get("NICEHASH_URL", "https://api2.nicehash.com")
+key = os.environ.get("KEY")
+secret = os.environ.get("SECRET")
+organisation_id = os.environ.get("ORG_ID")
+PORT = int(os.environ.get("PORT", 80))
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", 30))
+STARTUP_WAIT = float(os.environ.get("STARTUP_WAIT", 10))
+SERVER = os.environ.get("SERVER", "flask") #flask or asgi
+WORKERS = int(os.environ.get("WORKERS", 1))
+POOL_SIZE = int(os.environ.get("POOL_SIZE", 100))
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.environ.get("BREAKER_RESET", 30))
+LATENCY_BUDGET = float(os.environ["LATENCY_BUDGET"]) if os.environ.get("LATENCY_BUDGET") else None
+CONTROL_WORKERS = int(os.environ.get("CONTROL_WORKERS", 16))
+CASSETTE = os.environ.get("CASSETTE") #record/replay file, unset talks to NICEHASH_URL
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "replay") #replay or record
+REPLAY_LATENCY = os.environ.get("REPLAY_LATENCY") #seconds or "recorded"
+REPLAY_LATENCY = REPLAY_LATENCY if REPLAY_LATENCY in (None, "recorded") else float(REPLAY_LATENCY)
+REPLAY_ERROR_RATE = float(os.environ.get("REPLAY_ERROR_RATE", 0))
@@ -1,28 +1,79 @@
-import os
+import time
 import nicehash
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request
+from config import *
+from snapshot import rig_snapshot, names_from_body, control_from_body, merge_results
+from metrics import service_metrics, CONTENT_TYPE
 
-NICEHASH_URL = "https://api2.nicehash.com"
-key = os.environ.get("KEY")
-secret = os.environ.get("SECRET")
-organisation_id = os.environ.get("ORG_ID")
-PORT = int(os.environ.get("PORT", 80))
+transport = None
+if CASSETTE and CASSETTE_MODE == "record":
+  transport = nicehash.recording_transport(CASSETTE, nicehash.make_session(POOL_SIZE))
+elif CASSETTE:
+  transport = nicehash.replay_transport(CASSETTE, latency=REPLAY_LATENCY, error_rate=REPLAY_ERROR_RATE)
 
-private_api = nicehash.private_api(NICEHASH_URL, organisation_id, key, secret)
+private_api = nicehash.private_api(NICEHASH_URL, organisation_id, key, secret, pool_size=POOL_SIZE,
+  breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET, latency_budget=LATENCY_BUDGET, transport=transport)
+snapshot = rig_snapshot(private_api, REFRESH_INTERVAL)
+metrics = service_metrics(private_api, snapshot)
 
 app = Flask(__name__)
 
+@app.before_request
+def start_timer():
+  g.start = time.perf_counter()
+
+@app.after_request
+def observe(response):
+  route = request.url_rule.rule if request.url_rule else "unmatched"
+  metrics.observe(route, response.status_code, time.perf_counter() - g.start)
+  return response
+
+#GET only, a rig called "metrics" is still answered by POST /metrics
+@app.route('/metrics', methods=["GET"])
+def get_metrics():
+  return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+def with_age(response):
+  age = snapshot.age()
+  if age is not None:
+    response.headers["X-Snapshot-Age"] = "{:.3f}".format(age)
+  if snapshot.stale():
+    response.headers["X-Snapshot-Stale"] = "true"
+  return response
+
 @app.route('/<name>', methods=["POST"])
 def get_status(name):
-  rigs = private_api.get_rigs()
-  rigs = rigs["miningRigs"]
-  rigs = {r["name"]: r for r in rigs} #map to name:rig
+  snapshot.wait(STARTUP_WAIT)
+  return with_age(jsonify(snapshot.get(name)))
+
+@app.route('/', methods=["POST"])
+def get_statuses():
+  try:
+    names = names_from_body(request.get_json(force=True, silent=True))
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
 
-  response = None
+  snapshot.wait(STARTUP_WAIT)
+  return with_age(jsonify(snapshot.get_many(names)))
 
-  if name in rigs:
-    response = rigs[name]["minerStatus"]
+#start/stop/set power mode for many rigs at once, see README
+@app.route('/bulk/control', methods=["POST"])
+def bulk_control():
+  try:
+    targets, collapse = control_from_body(request.get_json(force=True, silent=True))
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
 
-  return jsonify(response)
+  snapshot.wait(STARTUP_WAIT)
+  resolved, indexes = snapshot.resolve(targets)
+  results = private_api.bulk_update_status(resolved, max_workers=CONTROL_WORKERS, collapse=collapse)
+  return jsonify(merge_results(targets, indexes, results))
 
-app.run(host="0.0.0.0", port=PORT)
+if __name__ == "__main__":
+  if SERVER == "asgi":
+    #each worker runs asgi.app with its own async client and snapshot
+    import uvicorn
+    uvicorn.run("asgi:app", host="0.0.0.0", port=PORT, workers=WORKERS)
+  else:
+    snapshot.start()
+    app.run(host="0.0.0.0", port=PORT)
@@ -0,0 +1,108 @@
+import bisect
+import threading
+from nicehash import timing_histogram
+
+#Prometheus text format for GET /metrics. Request observations only hold a lock for a couple of list updates, the
+#fleet gauges are counted once per snapshot refresh, so a scrape costs O(series), not O(rigs or requests).
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+def label_value(value):
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def labels(**values):
+  return "{" + ",".join('{}="{}"'.format(name, label_value(value)) for name, value in values.items()) + "}"
+
+def number(value):
+  return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+#per label tuple: [count per bucket..., count above the last bucket, sum]
+class histogram:
+
+  def __init__(self, buckets=LATENCY_BUCKETS):
+    self.buckets = list(buckets)
+    self.lock = threading.Lock()
+    self.series = {}
+
+  def observe(self, key, value):
+    i = bisect.bisect_left(self.buckets, value)
+    with self.lock:
+      series = self.series.get(key)
+      if series is None:
+        series = self.series[key] = [0] * (len(self.buckets) + 2)
+      series[i] += 1
+      series[-1] += value
+
+  def collect(self):
+    with self.lock:
+      return {key: list(series) for key, series in self.series.items()}
+
+def render_histogram(lines, name, help, bucket_bounds, series, label_names):
+  lines.append("# HELP {} {}".format(name, help))
+  lines.append("# TYPE {} histogram".format(name))
+  for key, counts in sorted(series.items(), key=lambda item: str(item[0])):
+    base = dict(zip(label_names, key))
+    total = 0
+    for le, count in zip(bucket_bounds + [float("inf")], counts):
+      total += count
+      lines.append("{}_bucket{} {}".format(name, labels(**dict(base, le=number(le))), total))
+    lines.append("{}_sum{} {}".format(name, labels(**base), number(counts[-1])))
+    lines.append("{}_count{} {}".format(name, labels(**base), total))
+
+def render_metric(lines, name, kind, help, samples):
+  lines.append("# HELP {} {}".format(name, help))
+  lines.append("# TYPE {} {}".format(name, kind))
+  for sample_labels, value in samples:
+    lines.append("{}{} {}".format(name, labels(**sample_labels) if sample_labels else "", number(value)))
+
+class service_metrics:
+
+  def __init__(self, api, snapshot):
+    self.api = api
+    self.snapshot = snapshot
+    self.requests = histogram()
+    self.upstream = api.add_observer(timing_histogram())
+
+  #route is the route template, e.g. "/<name>", so rig names don't become label values
+  def observe(self, route, status, seconds):
+    self.requests.observe((route, status), seconds)
+
+  def render(self):
+    lines = []
+    render_histogram(lines, "rig_status_request_seconds", "Time to answer requests to this service.",
+      self.requests.buckets, self.requests.collect(), ("route", "status"))
+
+    upstream, outcomes = self.upstream.snapshot()
+    lines.append("# HELP nicehash_request_seconds Time spent per Nicehash request attempt, by phase.")
+    lines.append("# TYPE nicehash_request_seconds histogram")
+    for (method, endpoint, phase), series in sorted(upstream.items()):
+      base = {"method": method, "endpoint": endpoint, "phase": phase}
+      for le, count in series["buckets"]:
+        lines.append("nicehash_request_seconds_bucket{} {}".format(labels(**dict(base, le=number(le))), count))
+      lines.append("nicehash_request_seconds_sum{} {}".format(labels(**base), number(series["sum"])))
+      lines.append("nicehash_request_seconds_count{} {}".format(labels(**base), series["count"]))
+    render_metric(lines, "nicehash_responses_total", "counter", "Nicehash request attempts by response status or exception.",
+      [({"method": method, "endpoint": endpoint, "status": status}, count) for (method, endpoint, status), count in sorted(outcomes.items(), key=str)])
+
+    counters = dict(self.api.counters)
+    render_metric(lines, "nicehash_in_flight", "gauge", "Nicehash request attempts currently on the wire.", [(None, counters["in_flight"])])
+    render_metric(lines, "nicehash_retries_total", "counter", "Nicehash requests retried after a 429, 5xx or connection error.", [(None, counters["retries"])])
+    render_metric(lines, "nicehash_throttled_total", "counter", "Nicehash responses with status 429.", [(None, counters["throttled"])])
+
+    cache = self.api.cache.stats()
+    lookups = cache["hits"] + cache["stale_hits"] + cache["misses"]
+    render_metric(lines, "nicehash_cache_lookups_total", "counter", "Response cache lookups by result.",
+      [({"result": "hit"}, cache["hits"]), ({"result": "stale_hit"}, cache["stale_hits"]), ({"result": "miss"}, cache["misses"])])
+    render_metric(lines, "nicehash_cache_hit_ratio", "gauge", "Share of cache lookups answered from the cache, stale included.",
+      [(None, (cache["hits"] + cache["stale_hits"]) / float(lookups) if lookups else 0.0)])
+    render_metric(lines, "nicehash_cache_entries", "gauge", "Responses held in the cache.", [(None, cache["size"])])
+    if self.api.breaker:
+      render_metric(lines, "nicehash_breaker_open", "gauge", "1 while the circuit breaker fails Nicehash requests fast.",
+        [(None, 0 if self.api.breaker.state == "closed" else 1)])
+
+    age = self.snapshot.age()
+    render_metric(lines, "rig_snapshot_age_seconds", "gauge", "Seconds since the rig snapshot was last refreshed.", [(None, age if age is not None else -1)])
+    render_metric(lines, "rig_snapshot_stale", "gauge", "1 when the last snapshot refresh failed.", [(None, 1 if self.snapshot.stale() else 0)])
+    render_metric(lines, "rig_snapshot_rigs", "gauge", "Rigs in the snapshot by minerStatus.",
+      [({"status": status}, count) for status, count in sorted(self.snapshot.status_counts.items(), key=str)])
+    return "\n".join(lines) + "\n"
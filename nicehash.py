@@ -1,29 +1,53 @@
 # This file (c) 2022 skeetzo https://github.com/skeetzo
-from datetime import datetime
-from time import mktime
 import uuid
 import hmac
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 import json
 from hashlib import sha256
 import optparse
 import sys
 import re
+import threading
+import time
+import random
+import weakref
+import math
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import gzip
+import io
 
 import asyncio
 import pathlib
 import ssl
+try:
+    import aiohttp
+except ImportError: # only needed by the async_* clients
+    aiohttp = None
+try:
+    import orjson
+except ImportError: # optional, faster decoding
+    orjson = None
+try:
+    import ijson
+except ImportError: # optional, only needed by stream_items
+    ijson = None
+try:
+    from sortedcontainers import SortedDict
+except ImportError: # optional, only needed by order_book
+    SortedDict = None
 # import websockets
 
 
 # OPTIONS
 ACTIVITY_TYPES = [ "DEPOSIT", "WITHDRAWAL", "HASHPOWER", "MINING", "EXCHANGE", "UNPAID_MINING", "OTHER" ]
 ALGORITHMS = [ "SCRYPT", "SHA256", "SCRYPTNF", "X11", "X13", "KECCAK", "X15", "NIST5", "NEOSCRYPT", "LYRA2RE", "WHIRLPOOLX", "QUBIT", "QUARK", "AXIOM", "LYRA2REV2", "SCRYPTJANENF16", "BLAKE256R8", "BLAKE256R14", "BLAKE256R8VNL", "HODL", "DAGGERHASHIMOTO", "DECRED", "CRYPTONIGHT", "LBRY", "EQUIHASH", "PASCAL", "X11GOST", "SIA", "BLAKE2S", "SKUNK", "CRYPTONIGHTV7", "CRYPTONIGHTHEAVY", "LYRA2Z", "X16R", "CRYPTONIGHTV8", "SHA256ASICBOOST", "ZHASH", "BEAM", "GRINCUCKAROO29", "GRINCUCKATOO31", "LYRA2REV3", "CRYPTONIGHTR", "CUCKOOCYCLE", "GRINCUCKAROOD29", "BEAMV2", "X16RV2", "RANDOMXMONERO", "EAGLESONG", "CUCKAROOM", "GRINCUCKATOO32", "HANDSHAKE", "KAWPOW", "CUCKAROO29BFC", "BEAMV3", "CUCKAROOZ29", "OCTOPUS" ]
-ALGORITHM_CODES = []
-i = 0
-for a in ALGORITHMS:
-    ALGORITHM_CODES.append(i)
-    i+=1
+ALGORITHM_CODES = list(range(len(ALGORITHMS)))
+ALGORITHM_INDEX = { name: code for code, name in enumerate(ALGORITHMS) }
 MARKETS = [ "EU", "USA", "EU_N", "USA_E" ]
 MARKETS_LONG = [ "EUROPE", "USA", "EUROPE_NORTH", "USA_EAST" ]
 OPS = [ "GT", "GE", "LT", "LE" ]
@@ -43,27 +67,1157 @@ WALLET_TYPES = [ "BITGO", "BLOCKCHAIN", "LIGHTNING", "MULTISIG" ]
 RESOLUTIONS = [ 1, 60, 1440 ]
 
 # cache
-CACHE = dict({})
-TIMEOUT = 1000 * 60 * 3 # 3 minutes
+# Per-endpoint response cache settings for GET requests: path -> (ttl, stale) in seconds.
+# Within ttl a cached response is returned as-is. For a further `stale` seconds it is still returned, while one
+# background request refreshes it. After that the next caller waits on a fresh request.
+# Private endpoints such as '/main/api/v2/mining/rigs2' or '/main/api/v2/mining/groups/list' can be opted in through
+# the cache_ttls constructor argument.
+CACHE_TTLS = {
+    '/main/api/v2/public/buy/info': (180, 600),
+    '/main/api/v2/mining/algorithms': (3600, 86400),
+    '/main/api/v2/public/currencies': (3600, 86400),
+    '/main/api/v2/public/service/fee/info': (3600, 86400),
+    '/main/api/v2/public/simplemultialgo/info': (30, 60),
+}
+CACHE_SIZE = 256
+
+# connection defaults
+POOL_SIZE = 10
+REQUEST_TIMEOUT = (10, 60) # (connect, read) in seconds, None waits forever
+
+# Session with a connection pool sized for pool_size concurrent threads.
+# pool_block makes extra threads wait for a free connection instead of opening throwaway ones.
+# Auth headers are never stored on the session, so one session can be shared by any number of threads.
+def make_session(pool_size=POOL_SIZE, pool_block=False, keep_alive=True):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+# Record/replay transports
+# A client's transport is whatever it sends requests through; by default the pooled session above. recording_transport
+# wraps a session and appends every exchange to a cassette: one JSON object per line, gzipped if the path ends in .gz,
+# with the auth headers redacted. replay_transport answers from a cassette without touching the network, optionally
+# adding latency and errors, so the client and the status service can be measured offline with repeatable numbers.
+REDACTED_HEADERS = [ 'X-Auth', 'X-Organization-Id', 'X-Nonce', 'X-Time', 'X-Request-Id', 'Authorization', 'Cookie' ]
+RECORDED_HEADERS = [ 'Content-Type', 'Retry-After' ]
+VOLATILE_PARAMS = [ 'timestamp' ] # query params that change on every call and are left out when matching
+
+def open_cassette(path, mode):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+# (method, path, query, body) a request is recorded and looked up under
+def cassette_key(method, url, body, volatile_params=VOLATILE_PARAMS):
+    parts = urlsplit(url)
+    query = '&'.join(param for param in parts.query.split('&') if param and param.split('=', 1)[0] not in volatile_params)
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    return (method.upper(), parts.path, query, body or None)
+
+class recording_transport:
+
+    def __init__(self, path, session=None, volatile_params=VOLATILE_PARAMS):
+        self.session = session if session is not None else make_session()
+        self.volatile_params = volatile_params
+        self.lock = threading.Lock()
+        self.file = open_cassette(path, 'a')
+
+    def request(self, method, url, **kwargs):
+        stream = kwargs.pop('stream', False)
+        start = time.monotonic()
+        response = self.session.request(method, url, **kwargs)
+        content = response.content
+        elapsed = time.monotonic() - start
+
+        headers = dict(kwargs.get('headers') or {})
+        for name in REDACTED_HEADERS:
+            if name in headers:
+                headers[name] = 'REDACTED'
+        method, path, query, body = cassette_key(method, url, kwargs.get('data'), self.volatile_params)
+        entry = {
+            'method': method, 'path': path, 'query': query, 'body': body, 'headers': headers,
+            'status': response.status_code, 'reason': response.reason, 'elapsed': round(elapsed, 6),
+            'responseHeaders': { name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers },
+            'content': content.decode('utf-8', 'replace'),
+        }
+        with self.lock:
+            self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self.file.flush()
+        # the body has been read to record it, so a streamed caller gets it back from memory
+        return replay_response(response.status_code, response.reason, content, response.headers) if stream else response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        self.file.close()
+        self.session.close()
+
+class replay_response:
+
+    def __init__(self, status_code, reason, content, headers=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.raw = io.BytesIO(content)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Requests with the same key are answered with their recordings in order, starting over once all were used.
+# latency: None, seconds, a (min, max) range or 'recorded'. error_rate: share of requests answered with a random
+# status from error_statuses instead. Both draw from a seeded random, so a replay is the same on every run.
+class replay_transport:
+
+    def __init__(self, path, latency=None, error_rate=0.0, error_statuses=(503,), seed=0, volatile_params=VOLATILE_PARAMS):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.volatile_params = volatile_params
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.cursors = {}
+        self.closed = False
+        with open_cassette(path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    key = (entry['method'], entry['path'], entry['query'], entry['body'])
+                    self.entries.setdefault(key, []).append(entry)
+
+    # Picks the recording and the injected outcome: (status, reason, content, headers, delay).
+    def respond(self, method, url, body):
+        key = cassette_key(method, url, body, self.volatile_params)
+        entries = self.entries.get(key)
+        if not entries:
+            raise Exception('no recorded response for ' + key[0] + ' ' + key[1] + ('?' + key[2] if key[2] else ''))
+        with self.lock:
+            i = self.cursors.get(key, 0)
+            self.cursors[key] = i + 1
+            entry = entries[i % len(entries)]
+            if self.latency == 'recorded':
+                delay = entry.get('elapsed', 0)
+            elif isinstance(self.latency, (tuple, list)):
+                delay = self.random.uniform(*self.latency)
+            else:
+                delay = self.latency or 0
+            fail = self.error_rate and self.random.random() < self.error_rate
+            status = self.random.choice(self.error_statuses) if fail else None
+        if status is not None:
+            headers = { 'Retry-After': '1' } if status == 429 else {}
+            return status, 'Injected Error', b'{"error":"injected"}', headers, delay
+        return entry['status'], entry['reason'], entry['content'].encode('utf-8'), entry.get('responseHeaders'), delay
+
+    def request(self, method, url, data=None, **kwargs):
+        status, reason, content, headers, delay = self.respond(method, url, data)
+        if delay:
+            time.sleep(delay)
+        return replay_response(status, reason, content, headers)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        self.closed = True
+
+# replay_transport for the async clients; answers the aiohttp calls they make and sleeps on the loop.
+class async_replay_transport(replay_transport):
+
+    class reader:
+        def __init__(self, content):
+            self.buffer = io.BytesIO(content)
+
+        async def read(self, n=-1):
+            return self.buffer.read(n)
+
+    class response:
+        def __init__(self, status, reason, content, headers):
+            self.status = status
+            self.reason = reason
+            self.body = content
+            self.headers = CaseInsensitiveDict(headers or {})
+            self.content = async_replay_transport.reader(content)
+
+        async def read(self):
+            return self.body
+
+        def release(self):
+            pass
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            pass
+
+    # Like aiohttp's request context: can be awaited or used with "async with".
+    class call:
+        def __init__(self, transport, method, url, data):
+            self.transport = transport
+            self.method = method
+            self.url = url
+            self.data = data
+
+        async def send(self):
+            status, reason, content, headers, delay = self.transport.respond(self.method, self.url, self.data)
+            if delay:
+                await asyncio.sleep(delay)
+            return async_replay_transport.response(status, reason, content, headers)
+
+        def __await__(self):
+            return self.send().__await__()
+
+        async def __aenter__(self):
+            return await self.send()
+
+        async def __aexit__(self, *exc):
+            pass
+
+    def request(self, method, url, data=None, **kwargs):
+        return async_replay_transport.call(self, method, url, data)
+
+    async def close(self):
+        self.closed = True
+
+# Single-flight request coalescing
+# Concurrent callers asking for the same key share one in-flight call and all receive its result (or exception).
+# The result object is shared between callers, so treat it as read-only.
+class single_flight:
+
+    class call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = single_flight.call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+# Copy of a decoded JSON response (dicts, lists and immutable scalars), cheaper than copy.deepcopy.
+def copy_json(value):
+    if isinstance(value, dict):
+        return { key: copy_json(item) for key, item in value.items() }
+    if isinstance(value, list):
+        return [ copy_json(item) for item in value ]
+    return value
+
+# Bounded LRU cache of responses keyed on (path, query), with per-entry expiry.
+# get() returns (value, state) where state is "fresh", "stale" or None for a miss.
+# Entries are stored and handed out as copies, so a caller changing its response can't change it for everyone else.
+class response_cache:
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key -> (value, fresh_until, stale_until)
+        self.refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now >= entry[2]:
+                self.misses += 1
+                return None, None
+            self.entries.move_to_end(key)
+            if now < entry[1]:
+                self.hits += 1
+                state = "fresh"
+            else:
+                self.stale_hits += 1
+                state = "stale"
+        return copy_json(entry[0]), state
+
+    def put(self, key, value, ttl, stale=0):
+        value = copy_json(value)
+        now = time.monotonic()
+        with self.lock:
+            self.entries[key] = (value, now + ttl, now + ttl + stale)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # True if the caller should refresh key; only one refresh per key runs at a time
+    def begin_refresh(self, key):
+        with self.lock:
+            if key in self.refreshing:
+                return False
+            self.refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self.lock:
+            self.refreshing.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries)
+            }
+
+# HMAC-SHA256 request signer.
+# The signed message is key \0 time \0 nonce \0 \0 org \0 \0 method \0 path \0 query [\0 body]. The constant
+# key and org parts are encoded once, and the secret is keyed into an HMAC template that is copy()'d for every request
+# instead of re-keying from scratch. Signatures are byte-identical to the original bytearray-built ones.
+class hmac_signer:
+
+    # Missing credentials (e.g. unset env vars) sign as empty strings and get rejected upstream, not at construction.
+    def __init__(self, key, secret, organisation_id):
+        key, secret, organisation_id = key or '', secret or '', organisation_id or ''
+        self.key = key
+        self.prefix = (key + '\x00').encode('utf-8')
+        self.org = ('\x00\x00' + organisation_id + '\x00\x00').encode('utf-8')
+        self.template = hmac.new(secret.encode('utf-8'), digestmod=sha256)
+
+    # returns the X-Auth header value
+    def sign(self, xtime, xnonce, method, path, query, body_json=None):
+        mac = self.template.copy()
+        mac.update(self.prefix)
+        mac.update((str(xtime) + '\x00' + xnonce).encode('utf-8'))
+        mac.update(self.org)
+        if body_json is None:
+            mac.update((method + '\x00' + path + '\x00' + query).encode('utf-8'))
+        else:
+            mac.update((method + '\x00' + path + '\x00' + query + '\x00' + body_json).encode('utf-8'))
+        return self.key + ":" + mac.hexdigest()
+
+# rate limiting and retries
+# Token buckets are shared by every client in the process, one per endpoint class: name -> (requests per second, burst).
+RATE_LIMITS = {
+    'exchange': (10, 20),
+    'hashpower': (10, 20),
+    'mining': (20, 40),
+    'accounting': (10, 20),
+    'default': (20, 40),
+}
+# path prefix -> endpoint class, first match wins
+RATE_LIMIT_CLASSES = [
+    ('/exchange/', 'exchange'),
+    ('/main/api/v2/hashpower/', 'hashpower'),
+    ('/main/api/v2/mining/', 'mining'),
+    ('/main/api/v2/accounting/', 'accounting'),
+]
+RETRIES = 3
+BACKOFF = 0.5 # seconds, doubled per attempt
+BACKOFF_MAX = 30
+# 429 means the request was rejected unprocessed, so it is retried for any method.
+# Server errors and connection failures are only retried for GET, a POST may already have been applied.
+RETRY_STATUSES = [ 500, 502, 503, 504 ]
+
+# Raised for any non-200 response. Subclasses Exception with the same message as before, so existing handlers still work.
+class api_error(Exception):
+
+    def __init__(self, status_code, message, retry_after=None):
+        Exception.__init__(self, message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+# Retry-After is either delay-seconds or an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Exponential backoff with full jitter; a server-provided Retry-After wins, up to cap.
+def backoff_delay(attempt, retry_after=None, base=BACKOFF, cap=BACKOFF_MAX):
+    if retry_after is not None:
+        return min(retry_after, cap)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# A token bucket refilled at `rate` tokens per second, holding up to `burst`.
+# reserve() always takes a token, letting the balance go negative, and returns how long the caller must wait before
+# using it. Callers are served in arrival order, and the sync and async clients can share one bucket.
+class token_bucket:
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+
+# circuit breaker
+BREAKER_FAILURES = 5 # consecutive failures before opening, 0 disables the breaker
+BREAKER_RESET = 30 # seconds to stay open before letting one probe request through
+LATENCY_BUDGET = None # seconds; slower successful responses count as failures
+
+# Raised without touching the network while the breaker is open.
+class circuit_open_error(api_error):
+
+    def __init__(self, retry_after):
+        api_error.__init__(self, None, "circuit open: upstream failing, retry in " + str(round(retry_after, 1)) + "s", retry_after)
+
+# Opens after failure_threshold consecutive failures (server errors, 429s, connection errors, timeouts or responses
+# slower than latency_budget). While open every call fails fast with circuit_open_error. After reset_timeout one probe
+# is let through (half open): success closes the breaker, failure opens it again.
+class circuit_breaker:
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET, latency_budget=LATENCY_BUDGET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_budget = latency_budget
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0.0
+
+    # call before each upstream attempt
+    def before(self):
+        with self.lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            remaining = self.opened + self.reset_timeout - now
+            if remaining <= 0:
+                # this caller is the probe; if it never reports back another one is allowed after reset_timeout
+                self.state = "half_open"
+                self.opened = now
+                return
+            raise circuit_open_error(remaining)
+
+    def success(self, latency):
+        if self.latency_budget is not None and latency > self.latency_budget:
+            return self.failure()
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened = time.monotonic()
+
+    # a response that proves the upstream is alive (e.g. a 404) without counting as a success for latency purposes
+    def alive(self):
+        with self.lock:
+            if self.state == "half_open":
+                self.state = "closed"
+            self.failures = 0
+
+def endpoint_class(path):
+    for prefix, name in RATE_LIMIT_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return 'default'
+
+def rate_limiter(path):
+    name = endpoint_class(path)
+    limiter = RATE_LIMITERS.get(name)
+    if limiter is None:
+        with RATE_LIMITERS_LOCK:
+            limiter = RATE_LIMITERS.get(name)
+            if limiter is None:
+                limiter = RATE_LIMITERS[name] = token_bucket(*RATE_LIMITS.get(name, RATE_LIMITS['default']))
+    return limiter
+
+# clock
+CLOCK_RESYNC = 300 # seconds between server time re-syncs
+CLOCK_RETRY = 30 # seconds before retrying a failed sync
+
+# Epoch milliseconds from a monotonic clock plus a measured offset to the NiceHash server clock.
+# The wall clock is read once, at construction; after that time only advances monotonically, so host clock steps
+# can't move X-Time. update() takes a server timestamp and the monotonic times the request was sent and answered, and
+# assumes the server read its clock halfway through the round trip.
+class server_clock:
+
+    def __init__(self, resync_interval=CLOCK_RESYNC):
+        self.resync_interval = resync_interval
+        self.wall = time.time()
+        self.mono = time.monotonic()
+        self.offset = 0.0 # ms to add to local time to get server time
+        self.rtt = None # ms, of the last successful sync
+        self.synced = None # monotonic time of the last sync attempt
+        self.syncing = False
+        self.lock = threading.Lock()
+        self.settled = threading.Condition(self.lock) # notified when a sync attempt ends
+
+    def now_ms(self):
+        return int((self.wall + time.monotonic() - self.mono) * 1000 + self.offset)
+
+    # True if a sync is due and no other caller is already doing it; the caller must then call update() or failed()
+    def begin_sync(self):
+        with self.lock:
+            if self.syncing:
+                return False
+            if self.synced is not None and time.monotonic() - self.synced < self.resync_interval:
+                return False
+            self.syncing = True
+            return True
+
+    def update(self, server_ms, sent, received):
+        local_ms = (self.wall + (sent + received) / 2 - self.mono) * 1000
+        with self.lock:
+            self.offset = server_ms - local_ms
+            self.rtt = (received - sent) * 1000
+            self.synced = received
+            self.syncing = False
+            self.settled.notify_all()
+
+    def failed(self):
+        with self.lock:
+            self.synced = time.monotonic() - self.resync_interval + CLOCK_RETRY
+            self.syncing = False
+            self.settled.notify_all()
+
+    # Blocks while the first sync is in flight, so concurrent callers don't sign with the unsynced local clock.
+    def wait_first_sync(self, timeout=None):
+        with self.lock:
+            self.settled.wait_for(lambda: not (self.syncing and self.rtt is None), timeout)
+
+# Request timing
+# Observers attached with add_observer are called with a request_timing for every request attempt that goes out
+# (cache hits and coalesced waiters don't send anything). Times are in seconds, None where the transport can't tell:
+# the requests session doesn't expose DNS/connect times, only whether the pool had to open a new connection.
+# Without observers send() takes its plain path, so the instrumentation costs one attribute check.
+TIMING_FIELDS = [ 'sign', 'dns', 'connect', 'ttfb', 'read', 'decode', 'total' ]
+ID_SEGMENT = re.compile(r'^(?=.*[0-9])[0-9A-Za-z_-]{8,}$')
+ENDPOINT_TEMPLATES = {}
+
+# /main/api/v2/mining/rig2/3f2e...c1 -> /main/api/v2/mining/rig2/{id}, so timings group by endpoint, not by id
+def endpoint_template(path):
+    template = ENDPOINT_TEMPLATES.get(path)
+    if template is None:
+        template = '/'.join('{id}' if ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+        if len(ENDPOINT_TEMPLATES) < 10000:
+            ENDPOINT_TEMPLATES[path] = template
+    return template
+
+class request_timing:
+    __slots__ = ('method', 'endpoint', 'status', 'bytes', 'new_connection', 'error', 'sign', 'dns', 'connect', 'ttfb', 'read', 'decode', 'total')
+
+    def __init__(self, method, endpoint):
+        self.method = method
+        self.endpoint = endpoint
+        self.status = None
+        self.bytes = None
+        self.new_connection = None
+        self.error = None # exception class name when the attempt failed before a response
+        self.sign = None
+        self.dns = None
+        self.connect = None
+        self.ttfb = None # from sending the request to the response headers, including any connect
+        self.read = None
+        self.decode = None
+        self.total = None
+
+    def as_dict(self):
+        return { name: getattr(self, name) for name in self.__slots__ }
+
+TIMING_BUCKETS = [ 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30 ]
+
+# Built-in observer: cumulative histograms per (method, endpoint, field) and response counts per status.
+class timing_histogram:
+
+    def __init__(self, buckets=TIMING_BUCKETS):
+        self.buckets = list(buckets)
+        self.lock = threading.Lock()
+        self.series = {} # (method, endpoint, field) -> [bucket counts..., +Inf count, sum]
+        self.statuses = {} # (method, endpoint, status or error) -> count
+
+    def __call__(self, timing):
+        with self.lock:
+            for field in TIMING_FIELDS:
+                value = getattr(timing, field)
+                if value is None:
+                    continue
+                key = (timing.method, timing.endpoint, field)
+                series = self.series.get(key)
+                if series is None:
+                    series = self.series[key] = [0] * (len(self.buckets) + 2)
+                i = 0
+                while i < len(self.buckets) and value > self.buckets[i]:
+                    i += 1
+                series[i] += 1
+                series[-1] += value
+            outcome = (timing.method, timing.endpoint, timing.status if timing.status is not None else timing.error)
+            self.statuses[outcome] = self.statuses.get(outcome, 0) + 1
+
+    # {(method, endpoint, field): {"buckets": [(le, cumulative count), ...], "count", "sum"}}
+    def snapshot(self):
+        with self.lock:
+            series = { key: list(counts) for key, counts in self.series.items() }
+            statuses = dict(self.statuses)
+        result = {}
+        for key, counts in series.items():
+            cumulative = []
+            total = 0
+            for le, count in zip(self.buckets + [float('inf')], counts):
+                total += count
+                cumulative.append((le, total))
+            result[key] = { 'buckets': cumulative, 'count': total, 'sum': counts[-1] }
+        return result, statuses
+
+    # Upper bucket bound the given percentile falls in, or None without samples.
+    def percentile(self, endpoint, field='total', p=50, method='GET'):
+        snapshot, statuses = self.snapshot()
+        series = snapshot.get((method, endpoint, field))
+        if not series or not series['count']:
+            return None
+        rank = series['count'] * p / 100.0
+        for le, cumulative in series['buckets']:
+            if cumulative >= rank:
+                return le
+
+    def reset(self):
+        with self.lock:
+            self.series = {}
+            self.statuses = {}
+
+# JSON decoding
+# Response bodies are decoded by the client's decoder: a name from DECODERS or any callable taking bytes.
+# The default is the fastest one installed.
+DECODERS = { 'json': json.loads }
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+DEFAULT_DECODER = 'orjson' if orjson is not None else 'json'
+
+def get_decoder(decoder=None):
+    if decoder is None:
+        decoder = DEFAULT_DECODER
+    if callable(decoder):
+        return decoder
+    if decoder not in DECODERS:
+        raise Exception("unknown decoder " + str(decoder) + ", available: " + ", ".join(DECODERS))
+    return DECODERS[decoder]
+
+# Reference data
+# The algorithm, buy info, currency and fee payloads change rarely; reference_registry loads them once, indexes them
+# by name and code, and refreshes them in the background once they are older than the TTL. With a path the payloads
+# are also saved to disk, so a restarted client can answer lookups before its first request.
+REGISTRY_TTL = 3600 # seconds
+
+class reference_registry:
+
+    def __init__(self, api, ttl=REGISTRY_TTL, path=None):
+        self.api = api
+        self.ttl = ttl
+        self.path = pathlib.Path(path) if path else None
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock() # held during the first load, so cold callers wait for it instead of fetching too
+        self.refreshing = False
+        self.loaded = None # wall clock time the payloads were fetched, so a saved copy keeps its age
+        self.index = None
+        self.payloads = None
+        if self.path is not None:
+            self.load_file()
+
+    def fetch(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = {
+                'buy_info': pool.submit(self.api.buy_info),
+                'algorithms': pool.submit(self.api.get_algorithms),
+                'currencies': pool.submit(self.api.get_currencies),
+                'fee_rules': pool.submit(self.api.get_fee_rules),
+            }
+            return { name: future.result() for name, future in futures.items() }
+
+    def refresh(self):
+        self.update(self.fetch(), time.time())
+
+    # Build every index from the raw payloads and swap them in at once, so lookups never see a half-built registry.
+    def update(self, payloads, loaded):
+        algorithms = {}
+        codes = dict(ALGORITHM_INDEX)
+        for item in payloads['algorithms'].get('miningAlgorithms') or []:
+            algorithms[item['algorithm']] = item
+            if item.get('order') is not None:
+                codes[item['algorithm']] = item['order']
+        buy = {}
+        for item in payloads['buy_info'].get('miningAlgorithms') or []:
+            name = item.get('name') or item.get('algorithm')
+            buy[name] = item
+            if item.get('algo') is not None:
+                codes.setdefault(name, item['algo'])
+        self.index = {
+            'algorithms': algorithms,
+            'buy_info': buy,
+            'codes': codes,
+            'names': { code: name for name, code in codes.items() },
+            'currencies': { item['symbol']: item for item in payloads['currencies'].get('currencies') or [] },
+            'fee_rules': payloads['fee_rules'],
+        }
+        self.payloads = payloads
+        self.loaded = loaded
+        if self.path is not None:
+            self.save_file()
+
+    def load_file(self):
+        try:
+            saved = json.loads(self.path.read_text())
+            self.update(saved['payloads'], saved['loaded'])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            if self.api.verbose:
+                print('ignoring reference data in ' + str(self.path) + ': ' + str(e))
+
+    def save_file(self):
+        try:
+            tmp = self.path.with_name(self.path.name + '.tmp')
+            tmp.write_text(json.dumps({ 'loaded': self.loaded, 'payloads': self.payloads }))
+            tmp.replace(self.path)
+        except Exception as e:
+            if self.api.verbose:
+                print('could not save reference data to ' + str(self.path) + ': ' + str(e))
+
+    def expired(self):
+        return self.loaded is None or time.time() - self.loaded >= self.ttl
+
+    # The first lookup loads inline; after that, expired data is still served while one background refresh runs.
+    def current(self):
+        if self.index is None:
+            with self.load_lock:
+                if self.index is None:
+                    self.refresh()
+        elif self.expired() and self.begin_refresh():
+            threading.Thread(target=self.revalidate, daemon=True).start()
+        return self.index
+
+    def begin_refresh(self):
+        with self.lock:
+            if self.refreshing:
+                return False
+            self.refreshing = True
+            return True
+
+    def revalidate(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            if self.api.verbose:
+                print('reference data refresh failed: ' + str(e))
+        finally:
+            self.refreshing = False
+
+    # Entry of get_algorithms()['miningAlgorithms'] for the algorithm, e.g. for marketFactor/displayMarketFactor.
+    def algo_settings(self, algorithm):
+        setting = self.current()['algorithms'].get(algorithm)
+        if setting is None:
+            raise Exception('Settings for algorithm ' + str(algorithm) + ' not found')
+        return setting
+
+    # Entry of buy_info()['miningAlgorithms'] for the algorithm: price and limit bounds, down step, min amount.
+    def buy_settings(self, algorithm):
+        setting = self.current()['buy_info'].get(algorithm)
+        if setting is None:
+            raise Exception('Buy info for algorithm ' + str(algorithm) + ' not found')
+        return setting
+
+    def algo_code(self, algorithm):
+        return self.current()['codes'].get(algorithm)
+
+    def algo_name(self, code):
+        return self.current()['names'].get(int(code))
+
+    def currency(self, symbol):
+        return self.current()['currencies'].get(symbol)
+
+    # Number of decimals amounts in the currency are given with, or default when the currency doesn't say.
+    def currency_precision(self, symbol, default=8):
+        item = self.currency(symbol) or {}
+        return item.get('precision', default)
+
+    def fee_rules(self):
+        return self.current()['fee_rules']
+
+# Same registry for the async clients. Lookups stay synchronous: the first load has to be awaited with load()
+# (or come from the saved file), and expired data is refreshed by a task on the running loop.
+class async_reference_registry(reference_registry):
+
+    def __init__(self, api, ttl=REGISTRY_TTL, path=None):
+        reference_registry.__init__(self, api, ttl, path)
+        self.loading = None # task of the load() in progress, shared by concurrent callers
+
+    async def fetch(self):
+        names = [ 'buy_info', 'algorithms', 'currencies', 'fee_rules' ]
+        results = await asyncio.gather(self.api.buy_info(), self.api.get_algorithms(), self.api.get_currencies(), self.api.get_fee_rules())
+        return dict(zip(names, results))
+
+    async def refresh(self):
+        self.update(await self.fetch(), time.time())
+
+    async def load(self):
+        if self.index is None or self.expired():
+            if self.loading is None or self.loading.done():
+                self.loading = asyncio.ensure_future(self.refresh())
+            await asyncio.shield(self.loading)
+        return self
+
+    def current(self):
+        if self.index is None:
+            raise Exception('reference data not loaded yet, await registry.load() first')
+        if self.expired() and self.begin_refresh():
+            asyncio.ensure_future(self.revalidate())
+        return self.index
+
+    async def revalidate(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            if self.api.verbose:
+                print('reference data refresh failed: ' + str(e))
+        finally:
+            self.refreshing = False
+
+# Bulk rig control helpers for bulk_update_status
+
+# Yields (name, group) for every group in a get_groups response, nested groups included.
+def walk_groups(groups):
+    for name, group in (groups.get("groups") or {}).items():
+        yield name, group
+        for item in walk_groups(group):
+            yield item
+
+# Plan the update_status calls for a list of targets, e.g. {"rigId": ..., "action": "POWER_MODE", "options": ["LOW"]}.
+# A named group of two or more rigs that are all targeted with the same action and options, and which has no subgroups,
+# becomes one group-level call. Returns [(update_status kwargs, [indexes of the targets it covers])].
+# A target with neither a rigId nor a group raises ValueError before any call is planned: update_status would apply
+# it to every rig in the org.
+# A rig targeted more than once is never collapsed: a group call would go out alongside its other targets in no
+# particular order, e.g. a STOP and a START for the same rig.
+def collapse_targets(targets, groups=None):
+    for i, target in enumerate(targets):
+        if not target.get("rigId") and not target.get("group"):
+            raise ValueError("target " + str(i) + " has neither a rigId nor a group")
+    wanted = {} # rigId -> (index, action, options)
+    repeated = set()
+    for i, target in enumerate(targets):
+        if target.get("rigId") and not target.get("deviceId") and not target.get("group"):
+            if target["rigId"] in wanted:
+                repeated.add(target["rigId"])
+            wanted[target["rigId"]] = (i, target["action"], json.dumps(target.get("options"), sort_keys=True))
+    for rig in repeated:
+        del wanted[rig]
+
+    calls = []
+    covered = set()
+    for name, group in walk_groups(groups or {}):
+        rigs = [rig["rigId"] for rig in group.get("rigs") or []]
+        if not name or group.get("groups") or len(rigs) < 2 or any(rig not in wanted for rig in rigs):
+            continue
+        if len(set(wanted[rig][1:] for rig in rigs)) != 1:
+            continue
+        indexes = [wanted[rig][0] for rig in rigs]
+        first = targets[indexes[0]]
+        calls.append(({"group_name": name, "action": first["action"], "options": first.get("options")}, indexes))
+        covered.update(indexes)
+
+    for i, target in enumerate(targets):
+        if i not in covered:
+            calls.append(({"group_name": target.get("group", ""), "rig_id": target.get("rigId", ""), "device_id": target.get("deviceId", ""), "action": target["action"], "options": target.get("options")}, [i]))
+    return calls
+
+# Spread each call's outcome back over the targets it covered, in input order.
+def bulk_results(targets, calls, outcomes):
+    results = [None] * len(targets)
+    for (kwargs, indexes), outcome in zip(calls, outcomes):
+        for i in indexes:
+            result = dict(targets[i], **outcome)
+            if not kwargs.get("rig_id"):
+                result["viaGroup"] = kwargs["group_name"]
+            results[i] = result
+    return results
+
+# Paging helpers for iter_pages
+
+# Most paged responses carry {"list": [...], "pagination": {"size", "page", "totalPageCount"}}.
+def page_items(key):
+    return lambda response: response.get(key) or []
+
+def page_count(response):
+    return response.get("pagination", {}).get("totalPageCount")
+
+# Hashpower order book: orders are paged per market under stats.{market}; markets are folded into each order.
+def orderbook_items(response):
+    items = []
+    for market, stats in (response.get("stats") or {}).items():
+        items += [dict(order, market=market) for order in stats.get("orders") or []]
+    return items
+
+def orderbook_page_count(response):
+    counts = [stats.get("pagination", {}).get("totalPageCount") for stats in (response.get("stats") or {}).values()]
+    counts = [count for count in counts if count is not None]
+    return max(counts) if counts else None
 
 class public_api:
 
-    def __init__(self, host, verbose=False):
+    def __init__(self, host, verbose=False, pool_size=POOL_SIZE, pool_block=False, keep_alive=True, timeout=REQUEST_TIMEOUT, cache_ttls=None, cache_size=CACHE_SIZE, retries=RETRIES, rate_limit=True, breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET, latency_budget=LATENCY_BUDGET, decoder=None, registry_ttl=REGISTRY_TTL, registry_path=None, transport=None):
         self.host = host
         self.verbose = verbose
-        self.session = requests.Session()
+        self.decode = get_decoder(decoder)
+        self.timeout = timeout
+        self.retries = retries
+        self.rate_limit = rate_limit
+        self.breaker = circuit_breaker(breaker_failures, breaker_reset, latency_budget) if breaker_failures else None
+        self.session = transport if transport is not None else make_session(pool_size, pool_block, keep_alive)
+        self.flights = single_flight()
+        self.cache_ttls = dict(CACHE_TTLS, **(cache_ttls or {}))
+        self.cache = response_cache(cache_size)
+        self.clock = server_clock()
+        self.registry = reference_registry(self, registry_ttl, registry_path)
+        self.observers = []
+        self.connections = None # connections seen by send_observed
+        self.counters = { 'in_flight': 0, 'retries': 0, 'throttled': 0 }
+        self.counters_lock = threading.Lock()
 
     def close(self):
         self.session.close()
 
+    # GETs on endpoints listed in cache_ttls are served from the cache; other GETs are coalesced; writes always go out on their own.
     def request(self, method, path, query, body):
+        if method != 'GET':
+            return self.dispatch(method, path, query, body)
+
+        ttl = self.cache_ttls.get(path)
+        if ttl is None:
+            return self.fetch(path, query)
+
+        key = (path, query)
+        value, state = self.cache.get(key)
+        if state == "stale" and self.cache.begin_refresh(key):
+            threading.Thread(target=self.revalidate, args=(path, query, ttl), daemon=True).start()
+        if state is not None:
+            return value
+
+        value = self.fetch(path, query)
+        self.cache.put(key, value, *ttl)
+        return value
+
+    def fetch(self, path, query):
+        return self.flights.do((path, query), lambda: self.dispatch('GET', path, query, None))
+
+    def revalidate(self, path, query, ttl):
+        key = (path, query)
+        try:
+            self.cache.put(key, self.fetch(path, query), *ttl)
+        except Exception as e:
+            if self.verbose:
+                print('cache refresh failed for ' + path + ': ' + str(e))
+        finally:
+            self.cache.end_refresh(key)
+
+    # Send with circuit breaking, rate limiting and retries. Every attempt goes through send() again, so private
+    # requests are re-signed with a fresh X-Time/X-Nonce. An open breaker fails the call immediately, without retrying.
+    def dispatch(self, method, path, query, body):
+        attempt = 0
+        while True:
+            if self.breaker:
+                self.breaker.before()
+            if self.rate_limit:
+                rate_limiter(path).acquire()
+            start = time.monotonic()
+            self.count('in_flight')
+            try:
+                response = self.send(method, path, query, body)
+                if self.breaker:
+                    self.breaker.success(time.monotonic() - start)
+                return response
+            except api_error as e:
+                self.record_failure(e.status_code)
+                if e.status_code == 429:
+                    self.count('throttled')
+                if attempt >= self.retries or not (e.status_code == 429 or (method == 'GET' and e.status_code in RETRY_STATUSES)):
+                    raise
+                if e.retry_after is not None and e.retry_after > BACKOFF_MAX:
+                    raise # asked to wait longer than we'd ever back off; the caller sees retry_after on the error
+                delay = backoff_delay(attempt, e.retry_after)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record_failure(None)
+                if attempt >= self.retries or method != 'GET':
+                    raise
+                delay = backoff_delay(attempt)
+            finally:
+                self.count('in_flight', -1)
+            self.count('retries')
+            if self.verbose:
+                print('retrying ' + method + ' ' + path + ' in ' + str(round(delay, 2)) + 's')
+            time.sleep(delay)
+            attempt += 1
+
+    # Request layer counters for monitoring: in_flight (attempts on the wire), retries and throttled (429 responses).
+    def count(self, name, delta=1):
+        with self.counters_lock:
+            self.counters[name] += delta
+
+    # Server errors, 429s and connection failures (status None) count against the breaker; other 4xx mean the upstream is up.
+    def record_failure(self, status_code):
+        if not self.breaker:
+            return
+        if status_code is None or status_code == 429 or status_code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.alive()
+
+    def headers(self, method, path, query, body_json):
+        return {
+            'Content-Type': 'application/json'
+        }
+
+    def url(self, path, query):
         url = self.host + path
         if query:
             # TODO
             # why doesn't this work here instead of forcing the check for empty [] at every function???
             # query = query.replace("[]", "") # clean arrays into empty strings
             url += '?' + query
+        return url
 
+    def send(self, method, path, query, body):
+        if self.observers:
+            return self.send_observed(method, path, query, body)
+        body_json = json.dumps(body) if body else None
+        headers = self.headers(method, path, query, body_json)
+        url = self.url(path, query)
+        self.print_request(method, url, query, body)
+
+        # headers go on the request, not the shared session, so concurrent calls can't swap signatures
+        response = self.session.request(method, url, headers=headers, data=body_json, timeout=self.timeout)
+
+        if response.status_code == 200:
+            return self.decode(response.content)
+        raise self.error(response.status_code, response.reason, response.content, response.headers)
+
+    # send() with every step timed into a request_timing for the observers.
+    def send_observed(self, method, path, query, body):
+        timing = request_timing(method, endpoint_template(path))
+        start = time.perf_counter()
+        try:
+            body_json = json.dumps(body) if body else None
+            headers = self.headers(method, path, query, body_json)
+            url = self.url(path, query)
+            signed = time.perf_counter()
+            timing.sign = signed - start
+            self.print_request(method, url, query, body)
+
+            response = self.session.request(method, url, headers=headers, data=body_json, timeout=self.timeout, stream=True)
+            received = time.perf_counter()
+            timing.ttfb = received - signed
+            timing.new_connection = self.first_use(response)
+            content = response.content
+            read = time.perf_counter()
+            timing.read = read - received
+            timing.status = response.status_code
+            timing.bytes = len(content)
+
+            if response.status_code == 200:
+                value = self.decode(content)
+                timing.decode = time.perf_counter() - read
+                return value
+            raise self.error(response.status_code, response.reason, content, response.headers)
+        except Exception as e:
+            if timing.status is None:
+                timing.error = type(e).__name__
+            raise
+        finally:
+            timing.total = time.perf_counter() - start
+            self.notify(timing)
+
+    # Whether the pooled connection that carried the response hasn't been seen before, i.e. was opened for it.
+    # Connections opened before the first observer was attached count as new the first time they are seen.
+    def first_use(self, response):
+        connection = getattr(getattr(response, 'raw', None), 'connection', None)
+        if connection is None:
+            return None
+        if self.connections is None:
+            self.connections = weakref.WeakSet()
+        if connection in self.connections:
+            return False
+        self.connections.add(connection)
+        return True
+
+    def add_observer(self, observer):
+        self.observers = self.observers + [observer]
+        return observer
+
+    def remove_observer(self, observer):
+        self.observers = [o for o in self.observers if o is not observer]
+
+    # A failing observer is reported (when verbose) and never fails the request.
+    def notify(self, timing):
+        for observer in self.observers:
+            try:
+                observer(timing)
+            except Exception as e:
+                if self.verbose:
+                    print('request observer failed: ' + str(e))
+
+    def print_request(self, method, url, query, body):
         if self.verbose:
             print()
             print(method, url)
@@ -72,29 +1226,50 @@ class public_api:
             if body:
                 print('body: '+str(body))
 
-        headers = {
-            'Content-Type': 'application/json'
-        }
-
-        self.session.headers = headers
-
-        if body:
-            body_json = json.dumps(body)
-            response = self.session.request(method, url, data=body_json)
-        else:
-            response = self.session.request(method, url)
-
-        if response.status_code == 200:
-            return response.json()
-        elif response.content:
-            raise Exception(str(response.status_code) + ": " + response.reason + " " + str(response.content))
-        else:
-            raise Exception(str(response.status_code) + ": " + response.reason)
+    def error(self, status_code, reason, content, headers):
+        message = str(status_code) + ": " + str(reason)
+        if content:
+            message += ": " + str(content)
+        return api_error(status_code, message, parse_retry_after(headers.get('Retry-After')))
+
+    # Incremental decoding: yields the JSON items under prefix (ijson syntax, e.g. "miningRigs.item") as they are read
+    # off the socket, without buffering or building the whole document. Requires ijson. Only the request itself is
+    # rate limited and guarded by the breaker; a failure mid-stream is raised to the caller as is, without a retry.
+    def stream_items(self, path, query, prefix):
+        if ijson is None:
+            raise Exception("stream_items requires ijson (pip install ijson)")
+        if self.breaker:
+            self.breaker.before()
+        if self.rate_limit:
+            rate_limiter(path).acquire()
+
+        url = self.url(path, query)
+        if self.verbose:
+            print()
+            print('GET', url, '(stream)')
+
+        try:
+            response = self.session.get(url, headers=self.headers('GET', path, query, None), timeout=self.timeout, stream=True)
+        except (requests.ConnectionError, requests.Timeout):
+            self.record_failure(None)
+            raise
+        with response:
+            if response.status_code != 200:
+                self.record_failure(response.status_code)
+                raise self.error(response.status_code, response.reason, response.content, response.headers)
+            if self.breaker:
+                self.breaker.alive()
+            response.raw.decode_content = True
+            for item in ijson.items(response.raw, prefix, use_float=True):
+                yield item
+
+    # Whole price/speed history for the algorithm, one row at a time.
+    def stream_algo_history(self, algorithm):
+        query = 'algorithm={algorithm}'.format(algorithm=algorithm)
+        return self.stream_items('/main/api/v2/public/algo/history', query, 'item')
 
     def get_epoch_ms_from_now(self):
-        now = datetime.now()
-        now_ec_since_epoch = mktime(now.timetuple()) + now.microsecond / 1000000.0
-        return int(now_ec_since_epoch * 1000)
+        return self.clock.now_ms()
 
     # @staticmethod
     # def algo_to_number(algorithm):
@@ -224,14 +1399,9 @@ class public_api:
     # Information for each enabled algorithm needed for buying hashpower. Result contains minimum and maximum
     # values for price, limit, information about minimum pool difficulty and more that can be useful in
     # automated application like NicehashBot
+    # Cached according to CACHE_TTLS.
     def buy_info(self):
-        if "buy_info" in CACHE and int(CACHE["buy_info"]["timeout"]) < datetime.now():
-            pass
-        else:
-            CACHE["buy_info"] = dict({})
-            CACHE["buy_info"]["timeout"] = int(datetime.timestamp(datetime.now())) + int(TIMEOUT)
-            CACHE["buy_info"]["value"] = self.request('GET', '/main/api/v2/public/buy/info', '', None)
-        return CACHE["buy_info"]["value"]
+        return self.request('GET', '/main/api/v2/public/buy/info', '', None)
 
     # Get all hashpower orders. Request parameter work as filter to fine tune the result. The result is paged, when needed.
     # algorithm   string  Algorithm
@@ -349,6 +1519,51 @@ class public_api:
 
     #############################################################################################
 
+    # Paginating iterators
+
+    # Generic lazy pager: yields items one at a time, fetching page 0, 1, ... through fetch(page).
+    # While the current page is being consumed the next one is already being fetched on a background thread (prefetch).
+    # Stops at pagination.totalPageCount (via pages(response)) or, when the response has none, at a short or empty page.
+    def iter_pages(self, fetch, items, size, pages=page_count, prefetch=True):
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = 0
+            response = fetch(page)
+            while True:
+                batch = items(response)
+                total = pages(response)
+                more = page + 1 < total if total is not None else size > 0 and len(batch) >= size
+                upcoming = pool.submit(fetch, page + 1) if more and pool else None
+
+                for item in batch:
+                    yield item
+
+                if not more:
+                    return
+                page += 1
+                response = upcoming.result() if upcoming else fetch(page)
+        finally:
+            if pool:
+                pool.shutdown(wait=False)
+
+    # Iterate over get_orders. The timestamp is pinned on the first page so later pages don't shift.
+    def iter_orders(self, algorithm="", market="", op="LT", timestamp=None, size=100, prefetch=True):
+        if not timestamp: timestamp = self.get_epoch_ms_from_now()
+        fetch = lambda page: self.get_orders(algorithm=algorithm, market=market, op=op, timestamp=timestamp, page=page, size=size)
+        return self.iter_pages(fetch, page_items("list"), size, prefetch=prefetch)
+
+    # Iterate over every market's orders in get_hashpower_orderbook; each order gets a "market" key.
+    def iter_hashpower_orderbook(self, algorithm, size=100, prefetch=True):
+        fetch = lambda page: self.get_hashpower_orderbook(algorithm, size=size, page=page)
+        return self.iter_pages(fetch, orderbook_items, size, pages=orderbook_page_count, prefetch=prefetch)
+
+    # On a private_api btcAddress may be None for the organization's own workers, see private_api.get_active_workers.
+    def iter_active_workers(self, btcAddress, size=100, sortParameter="RIG_NAME", sortDirection="ASC", prefetch=True):
+        fetch = lambda page: self.get_active_workers(btcAddress, size=size, page=page, sortParameter=sortParameter, sortDirection=sortDirection)
+        return self.iter_pages(fetch, page_items("workers"), size, prefetch=prefetch)
+
+    #############################################################################################
+
     ###########
     # Removed #
     ###########
@@ -367,47 +1582,51 @@ class public_api:
 
 class private_api(public_api):
 
-    def __init__(self, host, organisation_id, key, secret, verbose=False):
+    def __init__(self, host, organisation_id, key, secret, verbose=False, pool_size=POOL_SIZE, pool_block=False, keep_alive=True, timeout=REQUEST_TIMEOUT, cache_ttls=None, cache_size=CACHE_SIZE, retries=RETRIES, rate_limit=True, breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET, latency_budget=LATENCY_BUDGET, clock_sync=True, decoder=None, registry_ttl=REGISTRY_TTL, registry_path=None, transport=None):
+        public_api.__init__(self, host, verbose=verbose, pool_size=pool_size, pool_block=pool_block, keep_alive=keep_alive, timeout=timeout, cache_ttls=cache_ttls, cache_size=cache_size, retries=retries, rate_limit=rate_limit, breaker_failures=breaker_failures, breaker_reset=breaker_reset, latency_budget=latency_budget, decoder=decoder, registry_ttl=registry_ttl, registry_path=registry_path, transport=transport)
         self.key = key
         self.secret = secret
         self.organisation_id = organisation_id
-        self.host = host
-        self.verbose = verbose
-        self.session = requests.Session()
+        self.signer = hmac_signer(key, secret, organisation_id)
+        self.clock_sync = clock_sync
 
     def close(self):
         self.session.close()
 
-    def request(self, method, path, query, body):
+    # Measure the offset to the server clock with an unsigned /api/v2/time request, so X-Time isn't rejected for drift.
+    # The first sync blocks the request that triggers it; later re-syncs run in the background.
+    def sync_clock(self):
+        try:
+            sent = time.monotonic()
+            response = self.session.get(self.url('/api/v2/time', ''), timeout=self.timeout)
+            received = time.monotonic()
+            if response.status_code != 200:
+                raise self.error(response.status_code, response.reason, response.content, response.headers)
+            self.clock.update(self.decode(response.content)['serverTime'], sent, received)
+        except Exception as e:
+            self.clock.failed()
+            if self.verbose:
+                print('clock sync failed: ' + str(e))
+
+    def maybe_sync_clock(self):
+        if not self.clock_sync:
+            return
+        if self.clock.begin_sync():
+            if self.clock.rtt is None:
+                self.sync_clock()
+            else:
+                threading.Thread(target=self.sync_clock, daemon=True).start()
+        elif self.clock.rtt is None:
+            self.clock.wait_first_sync() # another thread is doing the first sync
+
+    # Build the signed auth headers for one request. body_json is the exact serialized body that will be sent (or None).
+    def sign(self, method, path, query, body_json):
 
         xtime = self.get_epoch_ms_from_now()
         xnonce = str(uuid.uuid4())
+        xauth = self.signer.sign(xtime, xnonce, method, path, query, body_json)
 
-        message = bytearray(self.key, 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(str(xtime), 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(xnonce, 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(self.organisation_id, 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(method, 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(path, 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(query, 'utf-8')
-
-        if body:
-            body_json = json.dumps(body)
-            message += bytearray('\x00', 'utf-8')
-            message += bytearray(body_json, 'utf-8')
-
-        digest = hmac.new(bytearray(self.secret, 'utf-8'), message, sha256).hexdigest()
-        xauth = self.key + ":" + digest
-
-        headers = {
+        return {
             'X-Time': str(xtime),
             'X-Nonce': xnonce,
             'X-Organization-Id': self.organisation_id,
@@ -416,32 +1635,9 @@ class private_api(public_api):
             'Content-Type': 'application/json'
         }
 
-        self.session.headers = headers
-
-        url = self.host + path
-        if query:
-            # query = query.replace("[]", "") # clean arrays into empty strings
-            url += '?' + query
-
-        if self.verbose:
-            print()
-            print(method, url)
-            if query != "":
-                print('query: '+str(query))
-            if body:
-                print('body: '+str(body))
-
-        if body:
-            response = self.session.request(method, url, data=body_json)
-        else:
-            response = self.session.request(method, url)
-
-        if response.status_code == 200:
-            return response.json()
-        elif response.content:
-            raise Exception(str(response.status_code) + ": " + response.reason + ": " + str(response.content))
-        else:
-            raise Exception(str(response.status_code) + ": " + response.reason)
+    def headers(self, method, path, query, body_json):
+        self.maybe_sync_clock()
+        return self.sign(method, path, query, body_json)
 
     #############################################################################################
 
@@ -625,8 +1821,7 @@ class private_api(public_api):
     # When creating STANDARD order, speed limit, price, amount and pool id has to be specified, along with
     # market factor and display market factor from /main/api/v2/public/buy/info endpoint for the same algorithm.
     def create_standard_hashpower_order(self, market, algorithm, price, limit, amount, pool_id):
-        algo_response = self.get_algorithms()
-        algo_setting = public_api.algo_settings_from_response(algo_response, algorithm)
+        algo_setting = self.registry.algo_settings(algorithm)
         order_data = {
             "market": market,
             "algorithm": algorithm,
@@ -647,8 +1842,7 @@ class private_api(public_api):
 
     # When creating FIXED order request, limit and price should not be different from fixedPrice response.
     def create_fixed_hashpower_order(self, market, algorithm, price, limit, amount, pool_id):
-        algo_response = self.get_algorithms()
-        algo_setting = public_api.algo_settings_from_response(algo_response, algorithm)
+        algo_setting = self.registry.algo_settings(algorithm)
         fixed_price = self.fixed_price_request(algorithm, market, limit)
         order_data = {
             "market": market,
@@ -704,8 +1898,7 @@ class private_api(public_api):
     # displayMarketFactor     string  Used display market factor
     # marketFactor    number  Used display market factor (numeric)
     def set_price_hashpower_order(self, order_id, price, algorithm):
-        algo_response = self.get_algorithms()
-        algo_setting = public_api.algo_settings_from_response(algo_response, algorithm)
+        algo_setting = self.registry.algo_settings(algorithm)
         price_data = {
             "price": price,
             "marketFactor": algo_setting['marketFactor'],
@@ -715,8 +1908,7 @@ class private_api(public_api):
 
     # At any time order speed limit and price can be altered when hashpower order is active. Changes must be withing limits defined for each algoritm separately. These limits can be fetched using /main/api/v2/public/buy/info endpoint. Order price can be decrease once in 10 minutes and the value of change must not be greater than more than down_step parameter from buy info endpoing.
     def set_limit_hashpower_order(self, order_id, limit, algorithm):
-        algo_response = self.get_algorithms()
-        algo_setting = public_api.algo_settings_from_response(algo_response, algorithm)
+        algo_setting = self.registry.algo_settings(algorithm)
         limit_data = {
             "limit": limit,
             "marketFactor": algo_setting['marketFactor'],
@@ -726,8 +1918,7 @@ class private_api(public_api):
 
     # At any time order speed limit and price can be altered when hashpower order is active. Changes must be withing limits defined for each algoritm separately. These limits can be fetched using /main/api/v2/public/buy/info endpoint. Order price can be decrease once in 10 minutes and the value of change must not be greater than more than down_step parameter from buy info endpoing.
     def set_price_and_limit_hashpower_order(self, order_id, price, limit, algorithm):
-        algo_response = self.get_algorithms()
-        algo_setting = public_api.algo_settings_from_response(algo_response, algorithm)
+        algo_setting = self.registry.algo_settings(algorithm)
         price_data = {
             "price": price,
             "limit": limit,
@@ -746,8 +1937,7 @@ class private_api(public_api):
     # displayMarketFactor     string  Unit of market factor
     # marketFactor    number  Market factor
     def estimate_order_duration(self, algorithm, order_type, price, limit, amount, decreaseFee=False):
-        algo_response = self.get_algorithms()
-        algo_setting = public_api.algo_settings_from_response(algo_response, algorithm)
+        algo_setting = self.registry.algo_settings(algorithm)
         estimate_data = {
             "type": order_type,
             "price": price,
@@ -838,13 +2028,17 @@ class private_api(public_api):
         return self.request('GET', '/main/api/v2/mining/rig2/{id}'.format(id=rig_id), '', None)
 
     # Get a list of active worker.
-    # btcAddress *    string  Btc address
+    # btcAddress      string  Btc address; without one the organization's own workers are listed, with one the
+    #                         workers mining to that external address (same as public_api.get_active_workers)
     # size    integer     Number of elements per page      100
     # page    integer     Page number      0
     # sortParameter   string  Sort parameter        RIG_NAME            [ "RIG_NAME", "TIME", "MARKET", "ALGORITHM", "UNPAID_AMOUNT", "DIFFICULTY", "SPEED_ACCEPTED", "SPEED_REJECTED", "PROFITABILITY" ]
     # sortDirection   string  Sort direction      ASC                   [ "ASC", "DESC" ]
-    def get_active_workers(self, btcAddress, size=100, page=0, sortParameter="RIG_NAME", sortDirection="ASC"):
-        return self.request('GET', '/main/api/v2/mining/rigs/activeWorkers', '', None)
+    def get_active_workers(self, btcAddress=None, size=100, page=0, sortParameter="RIG_NAME", sortDirection="ASC"):
+        if btcAddress:
+            return public_api.get_active_workers(self, btcAddress, size=size, page=page, sortParameter=sortParameter, sortDirection=sortDirection)
+        query = "size={size}&page={page}&sortParameter={sortParameter}&sortDirection={sortDirection}".format(size=size, page=page, sortParameter=sortParameter, sortDirection=sortDirection)
+        return self.request('GET', '/main/api/v2/mining/rigs/activeWorkers', query, None)
 
     # Get list of payouts.
     # beforeTimestamp     integer     Before timestamp in milliseconds from 1.1.1970 (default: from now)
@@ -903,6 +2097,36 @@ class private_api(public_api):
         }
         return self.request('POST', '/main/api/v2/mining/rigs/status2', '', status_data)
 
+    # Groups for collapse_targets. Collapsing is only an optimisation, so when the groups can't be listed (429, 5xx,
+    # open breaker) every target is sent on its own instead of failing the whole bulk call.
+    def groups_for_collapse(self):
+        try:
+            return self.get_groups()
+        except Exception as e:
+            if self.verbose:
+                print('not collapsing, groups unavailable: ' + str(e))
+            return None
+
+    # Run update_status for many targets at once, e.g. power-curtailing a whole fleet.
+    # targets     array   [{"rigId", "action", "options", "deviceId" (optional), "group" (optional)}]
+    # max_workers     integer     Concurrent update_status calls (the shared rate limiter still applies)     16
+    # collapse    boolean     Replace fully-targeted groups with one group-level call (costs one get_groups call)
+    # Returns one result per target, in order: the target plus "ok" and "result" or "error" (and "viaGroup" if collapsed).
+    def bulk_update_status(self, targets, max_workers=16, collapse=True):
+        calls = collapse_targets(targets, self.groups_for_collapse() if collapse else None)
+
+        def run(call):
+            try:
+                return {"ok": True, "result": self.update_status(**call[0])}
+            except Exception as e:
+                return {"ok": False, "error": str(e)}
+
+        if not calls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as pool:
+            outcomes = list(pool.map(run, calls))
+        return bulk_results(targets, calls, outcomes)
+
     # List rigs and their statuses. Path parameter filters rigs by group. When path is empty, rigs from root group are returned. Rigs can be sorted according to sort parameter.
     # size    integer     Size           25
     # page    integer     Page           0
@@ -911,7 +2135,35 @@ class private_api(public_api):
     # system  string  System              example: NHM,NHOS,NHQM
     # status  string  Status                example: Mining,Offline
     def get_rigs(self, size=25, page=0, path="", sort="NAME", system="", status=""):
-        return self.request('GET', '/main/api/v2/mining/rigs2', '', None)
+        query = "size={size}&page={page}&path={path}&sort={sort}&system={system}&status={status}".format(size=size, page=page, path=path, sort=sort, system=system, status=status)
+        return self.request('GET', '/main/api/v2/mining/rigs2', query, None)
+
+    # Fetch every page of get_rigs and merge them into one response. The first page tells us pagination.totalPageCount,
+    # the remaining pages are then fetched concurrently on up to max_workers threads.
+    # Takes the same filters as get_rigs plus:
+    # max_workers     integer     Concurrent page requests       8
+    def get_all_rigs(self, size=100, path="", sort="NAME", system="", status="", max_workers=8):
+        first = self.get_rigs(size=size, page=0, path=path, sort=sort, system=system, status=status)
+        pages = first.get("pagination", {}).get("totalPageCount", 1)
+
+        # copy, the first page may be shared with other callers through single_flight
+        merged = dict(first)
+        merged["miningRigs"] = list(first.get("miningRigs", []))
+        if pages <= 1:
+            return merged
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, pages - 1)) as pool:
+            rest = pool.map(lambda page: self.get_rigs(size=size, page=page, path=path, sort=sort, system=system, status=status), range(1, pages))
+            for response in rest:
+                merged["miningRigs"] += response.get("miningRigs", [])
+
+        merged["pagination"] = dict(first["pagination"], size=len(merged["miningRigs"]), page=0, totalPageCount=1)
+        return merged
+
+    # Same query as get_rigs, but yields each miningRigs item as soon as it has been read off the socket (see stream_items).
+    def stream_rigs(self, size=25, page=0, path="", sort="NAME", system="", status=""):
+        query = "size={size}&page={page}&path={path}&sort={sort}&system={system}&status={status}".format(size=size, page=page, path=path, sort=sort, system=system, status=status)
+        return self.stream_items('/main/api/v2/mining/rigs2', query, 'miningRigs.item')
 
     #############################################################################################
 
@@ -1079,6 +2331,33 @@ class private_api(public_api):
 
     #############################################################################################
 
+    # Paginating iterators (see public_api.iter_pages)
+
+    def iter_deposits_for_currency(self, currency, statuses=[], op="LT", timestamp=None, size=100, prefetch=True):
+        if not timestamp: timestamp = self.get_epoch_ms_from_now()
+        fetch = lambda page: self.get_deposits_for_currency(currency, statuses=statuses, op=op, timestamp=timestamp, page=page, size=size)
+        return self.iter_pages(fetch, page_items("list"), size, prefetch=prefetch)
+
+    def iter_withdrawals_for_currency(self, currency, statuses=[], op="LT", timestamp=None, size=100, prefetch=True):
+        if not timestamp: timestamp = self.get_epoch_ms_from_now()
+        fetch = lambda page: self.get_withdrawals_for_currency(currency, statuses=statuses, op=op, timestamp=timestamp, page=page, size=size)
+        return self.iter_pages(fetch, page_items("list"), size, prefetch=prefetch)
+
+    def iter_transactions_for_currency(self, currency, tx_type="", purposes=[], op="", timestamp=None, size=100, prefetch=True):
+        if not timestamp: timestamp = self.get_epoch_ms_from_now()
+        fetch = lambda page: self.get_transactions_for_currency(currency, tx_type=tx_type, purposes=purposes, op=op, timestamp=timestamp, page=page, size=size)
+        return self.iter_pages(fetch, page_items("list"), size, prefetch=prefetch)
+
+    def iter_my_pools(self, algorithm="", size=100, prefetch=True):
+        fetch = lambda page: self.get_my_pools(algorithm=algorithm, size=size, page=page)
+        return self.iter_pages(fetch, page_items("list"), size, prefetch=prefetch)
+
+    def iter_withdrawal_addresses(self, currency, size=100, address_type="", prefetch=True):
+        fetch = lambda page: self.get_withdrawal_addresses(currency, size=size, page=page, address_type=address_type)
+        return self.iter_pages(fetch, page_items("list"), size, prefetch=prefetch)
+
+    #############################################################################################
+
     ###########
     # Removed #
     ###########
@@ -1092,113 +2371,1136 @@ class private_api(public_api):
     # def get_my_exchange_trades(self, market):
     #     return self.request('GET','/exchange/api/v2/myTrades', 'market=' + market, None)
 
-class websockets_api(public_api):
-
-    def __init__(self, host, organisation_id, key, secret, verbose=False):
-        self.key = key
-        self.secret = secret
-        self.organisation_id = organisation_id
+# Asyncio counterparts of public_api/private_api.
+# Every endpoint method is inherited unchanged: they all end in "return self.request(...)", and here request() is a
+# coroutine function, so they return awaitables, e.g. "rigs = await api.get_rigs()". Only the few methods that do more
+# than return a request are overridden below.
+# All calls share one aiohttp session with a pooled keep-alive connector, so hundreds of requests can be in flight on
+# one event loop. The session is created on first use, inside the running loop; call "await api.close()" when done.
+class async_public_api(public_api):
+
+    def __init__(self, host, verbose=False, pool_size=100, keepalive_timeout=30, timeout=REQUEST_TIMEOUT, cache_ttls=None, cache_size=CACHE_SIZE, retries=RETRIES, rate_limit=True, breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET, latency_budget=LATENCY_BUDGET, decoder=None, registry_ttl=REGISTRY_TTL, registry_path=None, transport=None):
+        if aiohttp is None:
+            raise Exception("async_public_api requires aiohttp (pip install aiohttp)")
         self.host = host
         self.verbose = verbose
-        self.websocket = None
-
-    def close(self):
-        self.websocket.close()
-
-
-# don't require permissions:
-# candlestick
-# order book stream
-# trade stream
-
-    def on_error(self, ws, e):
-        print(e)
+        self.decode = get_decoder(decoder)
+        self.retries = retries
+        self.rate_limit = rate_limit
+        self.breaker = circuit_breaker(breaker_failures, breaker_reset, latency_budget) if breaker_failures else None
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.transport = transport
+        self.session = None
+        self.flights = {}
+        self.cache_ttls = dict(CACHE_TTLS, **(cache_ttls or {}))
+        self.cache = response_cache(cache_size)
+        self.clock = server_clock()
+        self.registry = async_reference_registry(self, registry_ttl, registry_path)
+        self.observers = []
+        self.counters = { 'in_flight': 0, 'retries': 0, 'throttled': 0 }
+        self.counters_lock = threading.Lock()
+
+    def get_session(self):
+        if self.transport is not None:
+            return self.transport
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            # like requests: one number for both, or (connect, read); None waits forever
+            connect, read = self.timeout if isinstance(self.timeout, (tuple, list)) else (self.timeout, self.timeout)
+            timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+            traces = [self.trace_config()] if self.observers else []
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=traces)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        if self.transport is not None:
+            await self.transport.close()
+
+    # Same cache and single-flight rules as the sync client, with stale entries revalidated by a task on the loop.
+    async def request(self, method, path, query, body):
+        if method != 'GET':
+            return await self.dispatch(method, path, query, body)
+
+        ttl = self.cache_ttls.get(path)
+        if ttl is None:
+            return await self.fetch(path, query)
+
+        key = (path, query)
+        value, state = self.cache.get(key)
+        if state == "stale" and self.cache.begin_refresh(key):
+            asyncio.ensure_future(self.revalidate(path, query, ttl))
+        if state is not None:
+            return value
+
+        value = await self.fetch(path, query)
+        self.cache.put(key, value, *ttl)
+        return value
+
+    # Concurrent identical GETs await one shared task.
+    # The task is shielded so one cancelled caller doesn't cancel it for everyone else.
+    async def fetch(self, path, query):
+        key = (path, query)
+        task = self.flights.get(key)
+        if task is None:
+            task = self.flights[key] = asyncio.ensure_future(self.dispatch('GET', path, query, None))
+            task.add_done_callback(lambda _: self.flights.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def revalidate(self, path, query, ttl):
+        key = (path, query)
+        try:
+            self.cache.put(key, await self.fetch(path, query), *ttl)
+        except Exception as e:
+            if self.verbose:
+                print('cache refresh failed for ' + path + ': ' + str(e))
+        finally:
+            self.cache.end_refresh(key)
+
+    def headers(self, method, path, query, body_json):
+        return {
+            'Content-Type': 'application/json'
+        }
 
-    def on_message(self, ws, message):
-        print(message)
+    # Same rules as public_api.dispatch; waits for rate limit tokens and backoff without blocking the loop.
+    async def dispatch(self, method, path, query, body):
+        attempt = 0
+        while True:
+            if self.breaker:
+                self.breaker.before()
+            if self.rate_limit:
+                delay = rate_limiter(path).reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            start = time.monotonic()
+            self.count('in_flight')
+            try:
+                response = await self.send(method, path, query, body)
+                if self.breaker:
+                    self.breaker.success(time.monotonic() - start)
+                return response
+            except api_error as e:
+                self.record_failure(e.status_code)
+                if e.status_code == 429:
+                    self.count('throttled')
+                if attempt >= self.retries or not (e.status_code == 429 or (method == 'GET' and e.status_code in RETRY_STATUSES)):
+                    raise
+                if e.retry_after is not None and e.retry_after > BACKOFF_MAX:
+                    raise # asked to wait longer than we'd ever back off; the caller sees retry_after on the error
+                delay = backoff_delay(attempt, e.retry_after)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.record_failure(None)
+                if attempt >= self.retries or method != 'GET':
+                    raise
+                delay = backoff_delay(attempt)
+            finally:
+                self.count('in_flight', -1)
+            self.count('retries')
+            if self.verbose:
+                print('retrying ' + method + ' ' + path + ' in ' + str(round(delay, 2)) + 's')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def send(self, method, path, query, body):
+        if self.observers:
+            return await self.send_observed(method, path, query, body)
+        body_json = json.dumps(body) if body else None
+        headers = self.headers(method, path, query, body_json)
+        url = self.url(path, query)
+        self.print_request(method, url, query, body)
+
+        async with self.get_session().request(method, url, headers=headers, data=body_json) as response:
+            content = await response.read()
+            if response.status == 200:
+                return self.decode(content)
+            raise self.error(response.status, response.reason, content, response.headers)
+
+    # Same as public_api.send_observed. DNS and connect times come from the session's trace hooks, which are only
+    # installed on sessions created while an observer is attached.
+    async def send_observed(self, method, path, query, body):
+        timing = request_timing(method, endpoint_template(path))
+        start = time.perf_counter()
+        try:
+            body_json = json.dumps(body) if body else None
+            headers = self.headers(method, path, query, body_json)
+            url = self.url(path, query)
+            signed = time.perf_counter()
+            timing.sign = signed - start
+            self.print_request(method, url, query, body)
+
+            async with self.get_session().request(method, url, headers=headers, data=body_json, trace_request_ctx=timing) as response:
+                received = time.perf_counter()
+                timing.ttfb = received - signed
+                content = await response.read()
+                read = time.perf_counter()
+                timing.read = read - received
+                timing.status = response.status
+                timing.bytes = len(content)
+                if response.status == 200:
+                    value = self.decode(content)
+                    timing.decode = time.perf_counter() - read
+                    return value
+                raise self.error(response.status, response.reason, content, response.headers)
+        except Exception as e:
+            if timing.status is None:
+                timing.error = type(e).__name__
+            raise
+        finally:
+            timing.total = time.perf_counter() - start
+            self.notify(timing)
+
+    # aiohttp trace hooks filling in the request_timing passed as trace_request_ctx
+    def trace_config(self):
+        trace = aiohttp.TraceConfig()
+        def started(name):
+            async def hook(session, context, params):
+                setattr(context, name, time.perf_counter())
+            return hook
+        def ended(name, field):
+            async def hook(session, context, params):
+                timing = context.trace_request_ctx
+                if isinstance(timing, request_timing) and hasattr(context, name):
+                    setattr(timing, field, time.perf_counter() - getattr(context, name))
+                    if field == 'connect':
+                        timing.new_connection = True
+            return hook
+        async def reused(session, context, params):
+            if isinstance(context.trace_request_ctx, request_timing):
+                context.trace_request_ctx.new_connection = False
+        trace.on_dns_resolvehost_start.append(started('dns_start'))
+        trace.on_dns_resolvehost_end.append(ended('dns_start', 'dns'))
+        trace.on_connection_create_start.append(started('connect_start'))
+        trace.on_connection_create_end.append(ended('connect_start', 'connect'))
+        trace.on_connection_reuseconn.append(reused)
+        return trace
+
+    # Async generator version of public_api.stream_items, parsing the response as chunks arrive on the loop.
+    async def stream_items(self, path, query, prefix):
+        if ijson is None:
+            raise Exception("stream_items requires ijson (pip install ijson)")
+        if self.breaker:
+            self.breaker.before()
+        if self.rate_limit:
+            delay = rate_limiter(path).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        url = self.url(path, query)
+        if self.verbose:
+            print()
+            print('GET', url, '(stream)')
+
+        try:
+            response = await self.get_session().get(url, headers=self.headers('GET', path, query, None))
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            self.record_failure(None)
+            raise
+        async with response:
+            if response.status != 200:
+                self.record_failure(response.status)
+                raise self.error(response.status, response.reason, await response.read(), response.headers)
+            if self.breaker:
+                self.breaker.alive()
+            async for item in ijson.items(response.content, prefix, use_float=True):
+                yield item
+
+    # Async generator version of public_api.iter_pages, so every iter_* method works with "async for".
+    # The next page is prefetched as a task on the loop.
+    async def iter_pages(self, fetch, items, size, pages=page_count, prefetch=True):
+        page = 0
+        response = await fetch(page)
+        while True:
+            batch = items(response)
+            total = pages(response)
+            more = page + 1 < total if total is not None else size > 0 and len(batch) >= size
+            upcoming = asyncio.ensure_future(fetch(page + 1)) if more and prefetch else None
+            try:
+                for item in batch:
+                    yield item
+            except GeneratorExit:
+                if upcoming:
+                    upcoming.cancel()
+                raise
+
+            if not more:
+                return
+            page += 1
+            response = await upcoming if upcoming else await fetch(page)
+
+    async def print_api_flags(self):
+        for flag in (await self.get_api_flags())["list"]:
+            print("{}: {}".format(flag["flagName"], flag["flagValue"]))
 
-    def on_close(self, ws):
-        print("websocket closed")
+class async_private_api(async_public_api, private_api):
 
-    def on_open(self, ws):
-        # print("open: ".format(e))
-        pass
+    def __init__(self, host, organisation_id, key, secret, verbose=False, pool_size=100, keepalive_timeout=30, timeout=REQUEST_TIMEOUT, cache_ttls=None, cache_size=CACHE_SIZE, retries=RETRIES, rate_limit=True, breaker_failures=BREAKER_FAILURES, breaker_reset=BREAKER_RESET, latency_budget=LATENCY_BUDGET, clock_sync=True, decoder=None, registry_ttl=REGISTRY_TTL, registry_path=None, transport=None):
+        async_public_api.__init__(self, host, verbose=verbose, pool_size=pool_size, keepalive_timeout=keepalive_timeout, timeout=timeout, cache_ttls=cache_ttls, cache_size=cache_size, retries=retries, rate_limit=rate_limit, breaker_failures=breaker_failures, breaker_reset=breaker_reset, latency_budget=latency_budget, decoder=decoder, registry_ttl=registry_ttl, registry_path=registry_path, transport=transport)
+        self.key = key
+        self.secret = secret
+        self.organisation_id = organisation_id
+        self.signer = hmac_signer(key, secret, organisation_id)
+        self.clock_sync = clock_sync
+        self.first_sync = None # task of the first clock sync, awaited by every request until it is done
+
+    def headers(self, method, path, query, body_json):
+        return self.sign(method, path, query, body_json)
+
+    async def sync_clock(self):
+        try:
+            sent = time.monotonic()
+            async with self.get_session().get(self.host + '/api/v2/time') as response:
+                server_ms = self.decode(await response.read())['serverTime']
+            self.clock.update(server_ms, sent, time.monotonic())
+        except Exception as e:
+            self.clock.failed()
+            if self.verbose:
+                print('clock sync failed: ' + str(e))
+
+    # Same as private_api.maybe_sync_clock: the first clock sync is awaited, by every caller that arrives while it
+    # runs; re-syncs run as a task.
+    async def maybe_sync_clock(self):
+        if self.clock_sync and self.clock.begin_sync():
+            if self.clock.rtt is None:
+                self.first_sync = asyncio.ensure_future(self.sync_clock())
+            else:
+                asyncio.ensure_future(self.sync_clock())
+        if self.first_sync is not None and not self.first_sync.done():
+            await asyncio.shield(self.first_sync)
+
+    async def send(self, method, path, query, body):
+        await self.maybe_sync_clock()
+        return await async_public_api.send(self, method, path, query, body)
+
+    async def stream_items(self, path, query, prefix):
+        await self.maybe_sync_clock()
+        async for item in async_public_api.stream_items(self, path, query, prefix):
+            yield item
+
+    # Same as private_api.get_all_rigs, with the remaining pages gathered on the event loop instead of a thread pool.
+    async def get_all_rigs(self, size=100, path="", sort="NAME", system="", status="", max_workers=8):
+        first = await self.get_rigs(size=size, page=0, path=path, sort=sort, system=system, status=status)
+        pages = first.get("pagination", {}).get("totalPageCount", 1)
+
+        merged = dict(first)
+        merged["miningRigs"] = list(first.get("miningRigs", []))
+        if pages <= 1:
+            return merged
+
+        limit = asyncio.Semaphore(max_workers)
+        async def fetch(page):
+            async with limit:
+                return await self.get_rigs(size=size, page=page, path=path, sort=sort, system=system, status=status)
+
+        for response in await asyncio.gather(*[fetch(page) for page in range(1, pages)]):
+            merged["miningRigs"] += response.get("miningRigs", [])
+
+        merged["pagination"] = dict(first["pagination"], size=len(merged["miningRigs"]), page=0, totalPageCount=1)
+        return merged
+
+    async def groups_for_collapse(self):
+        try:
+            return await self.get_groups()
+        except Exception as e:
+            if self.verbose:
+                print('not collapsing, groups unavailable: ' + str(e))
+            return None
+
+    # Same as private_api.bulk_update_status, with the calls gathered on the event loop.
+    async def bulk_update_status(self, targets, max_workers=16, collapse=True):
+        calls = collapse_targets(targets, (await self.groups_for_collapse()) if collapse else None)
+
+        limit = asyncio.Semaphore(max_workers)
+        async def run(call):
+            async with limit:
+                try:
+                    return {"ok": True, "result": await self.update_status(**call[0])}
+                except Exception as e:
+                    return {"ok": False, "error": str(e)}
+
+        outcomes = await asyncio.gather(*[run(call) for call in calls])
+        return bulk_results(targets, calls, outcomes)
+
+    # Order methods read the reference data (and create_fixed_hashpower_order the fixed price) before sending, so
+    # unlike the other endpoints they can't be inherited as they are: the registry is loaded and responses awaited here.
+    async def load_registry(self):
+        if self.registry.index is None:
+            await self.registry.load() # once loaded, expired data is refreshed in the background by the registry
+
+    async def create_standard_hashpower_order(self, market, algorithm, price, limit, amount, pool_id):
+        await self.load_registry()
+        return await private_api.create_standard_hashpower_order(self, market, algorithm, price, limit, amount, pool_id)
+
+    async def create_fixed_hashpower_order(self, market, algorithm, price, limit, amount, pool_id):
+        await self.load_registry()
+        algo_setting = self.registry.algo_settings(algorithm)
+        fixed_price = await self.fixed_price_request(algorithm, market, limit)
+        order_data = {
+            "market": market,
+            "algorithm": algorithm,
+            "amount": amount,
+            "price": fixed_price["fixedPrice"],
+            "limit": limit,
+            "poolId": pool_id,
+            "type": "FIXED",
+            "marketFactor": algo_setting['marketFactor'],
+            "displayMarketFactor": algo_setting['displayMarketFactor']
+        }
+        return await self.request('POST', '/main/api/v2/hashpower/order/', '', order_data)
+
+    async def set_price_hashpower_order(self, order_id, price, algorithm):
+        await self.load_registry()
+        return await private_api.set_price_hashpower_order(self, order_id, price, algorithm)
+
+    async def set_limit_hashpower_order(self, order_id, limit, algorithm):
+        await self.load_registry()
+        return await private_api.set_limit_hashpower_order(self, order_id, limit, algorithm)
+
+    async def set_price_and_limit_hashpower_order(self, order_id, price, limit, algorithm):
+        await self.load_registry()
+        return await private_api.set_price_and_limit_hashpower_order(self, order_id, price, limit, algorithm)
+
+    async def estimate_order_duration(self, algorithm, order_type, price, limit, amount, decreaseFee=False):
+        await self.load_registry()
+        return await private_api.estimate_order_duration(self, algorithm, order_type, price, limit, amount, decreaseFee)
+
+# Websocket session
+# One authenticated connection carries every subscription of a websockets_api. Each subscription is an async
+# iterator over its channel's messages with its own bounded queue. When a queue is full the reader either drops that
+# queue's oldest message ('drop', the default) or waits for the consumer ('block'). Waiting holds up the reader and so
+# every channel and the heartbeat with it, so it gives up after WS_BLOCK_TIMEOUT and drops the new message instead.
+# Either way the drop is counted in subscription.dropped and shows up downstream as a sequence gap, which
+# order_book and gap_free_stream recover from. A lost connection is re-opened with backoff, freshly signed, and every
+# active channel is subscribed again; the server answers with a new snapshot (ob.s, m.s, ...).
+WS_QUEUE_SIZE = 1000
+WS_BLOCK_TIMEOUT = 1 # seconds a 'block' subscription may hold up the connection per message
+WS_CLOCK_HOST = "https://api2.nicehash.com" # REST host the server clock is synced from when no REST client is given
+WS_HEARTBEAT = 30 # seconds between pings
+WS_CALL_TIMEOUT = 10 # seconds to wait for the reply to an order message
+# message method prefix (e.g. "ob" of "ob.u") -> channel of "subscribe.<channel>"
+WS_CHANNELS = { 'ob': 'orderbook', 'm': 'trades', 'mt': 'mytrades', 'c': 'candlesticks', 'o': 'orders' }
+WS_CLOSED = object()
+
+class websocket_subscription:
+
+    def __init__(self, connection, channel, maxsize=WS_QUEUE_SIZE, overflow='drop', reconnects=False, block_timeout=WS_BLOCK_TIMEOUT):
+        if overflow not in ('block', 'drop'):
+            raise Exception("overflow must be 'block' or 'drop'")
+        self.connection = connection
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.reconnects = reconnects # also deliver {"m": "reconnect"} before the snapshot that follows a reconnect
+        self.dropped = 0
+        self.closed = False
+        self.putter = None # put waiting for room in a full 'block' queue
+
+    async def deliver(self, message):
+        if self.closed:
+            return
+        if self.overflow == 'drop':
+            if self.queue.full():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(message)
+            return
+        if not self.queue.full():
+            self.queue.put_nowait(message)
+            return
+        # waiting for the consumer holds up the connection's reader, so it is bounded and end() can call it off
+        self.putter = asyncio.ensure_future(self.queue.put(message))
+        try:
+            await asyncio.wait_for(self.putter, self.block_timeout)
+        except asyncio.TimeoutError:
+            self.dropped += 1
+        except asyncio.CancelledError:
+            if not self.closed:
+                raise
+        finally:
+            self.putter = None
+
+    def end(self):
+        self.closed = True
+        if self.putter is not None:
+            self.putter.cancel()
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(WS_CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.queue.get()
+        if message is WS_CLOSED:
+            raise StopAsyncIteration
+        return message
+
+    async def close(self):
+        await self.connection.unsubscribe(self)
+
+class websocket_connection:
+
+    def __init__(self, url, headers, decode=json.loads, verbose=False, heartbeat=WS_HEARTBEAT):
+        if aiohttp is None:
+            raise Exception("websockets_api requires aiohttp (pip install aiohttp)")
+        self.url = url
+        self.headers = headers # awaited for fresh signed headers on every connect
+        self.decode = decode
+        self.verbose = verbose
+        self.heartbeat = heartbeat
+        self.channels = {} # channel -> {"message": subscribe message, "subscriptions": [...]}
+        self.pending = {} # message id -> future for call()
+        self.ws = None
+        self.connected = asyncio.Event()
+        self.connections = 0
+        self.task = None
+        self.closed = False
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self
+
+    async def run(self):
+        attempt = 0
+        async with aiohttp.ClientSession() as http:
+            while not self.closed:
+                try:
+                    async with http.ws_connect(self.url, headers=await self.headers(), heartbeat=self.heartbeat) as ws:
+                        self.ws = ws
+                        self.connections += 1
+                        attempt = 0
+                        await self.resubscribe()
+                        self.connected.set()
+                        async for message in ws:
+                            if message.type == aiohttp.WSMsgType.TEXT:
+                                await self.route(self.decode(message.data))
+                            elif message.type == aiohttp.WSMsgType.ERROR:
+                                break
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                    if self.verbose:
+                        print('websocket error: ' + str(e))
+                finally:
+                    self.ws = None
+                    self.connected.clear()
+                    for future in self.pending.values():
+                        if not future.done():
+                            future.set_exception(ConnectionError('websocket closed before the reply'))
+                if self.closed:
+                    break
+                delay = backoff_delay(attempt)
+                attempt += 1
+                if self.verbose:
+                    print('websocket reconnecting in ' + str(round(delay, 2)) + 's')
+                await asyncio.sleep(delay)
+
+    async def resubscribe(self):
+        for entry in list(self.channels.values()):
+            if self.connections > 1:
+                for subscription in entry['subscriptions']:
+                    if subscription.reconnects:
+                        await subscription.deliver({ 'm': 'reconnect' })
+            await self.ws.send_json(entry['message'])
+
+    async def route(self, message):
+        future = self.pending.get(message.get('i')) if isinstance(message, dict) else None
+        if future is not None:
+            if not future.done():
+                future.set_result(message)
+            return
+        channel = WS_CHANNELS.get(str(message.get('m', '')).split('.')[0]) if isinstance(message, dict) else None
+        entry = self.channels.get(channel)
+        if entry is None:
+            if self.verbose:
+                print('websocket message without subscriber: ' + str(message))
+            return
+        for subscription in list(entry['subscriptions']):
+            await subscription.deliver(message)
+
+    # The first subscription to a channel sends the subscribe message; later ones share the stream and only see
+    # messages from then on. The api allows one subscription per channel, so a different message for a channel that
+    # is already subscribed (e.g. another candlestick resolution) is refused rather than switching everyone over.
+    async def subscribe(self, channel, message, maxsize=WS_QUEUE_SIZE, overflow='drop', reconnects=False, block_timeout=WS_BLOCK_TIMEOUT):
+        entry = self.channels.get(channel)
+        if entry is not None and entry['message'] != message:
+            raise Exception("already subscribed to " + channel + " with " + json.dumps(entry['message']) + ", unsubscribe first")
+        subscription = websocket_subscription(self, channel, maxsize, overflow, reconnects, block_timeout)
+        send = entry is None
+        if entry is None:
+            entry = self.channels[channel] = { 'message': message, 'subscriptions': [] }
+        entry['subscriptions'].append(subscription)
+        self.start()
+        if send and self.ws is not None:
+            await self.ws.send_json(message)
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        entry = self.channels.get(subscription.channel)
+        if entry is not None and subscription in entry['subscriptions']:
+            entry['subscriptions'].remove(subscription)
+            if not entry['subscriptions']:
+                await self.unsubscribe_channel(subscription.channel)
+        subscription.end()
+
+    # Ends every subscription to the channel and unsubscribes from it.
+    async def unsubscribe_channel(self, channel):
+        entry = self.channels.pop(channel, None)
+        for subscription in (entry or {}).get('subscriptions', []):
+            subscription.end()
+        if self.ws is not None:
+            await self.ws.send_json({ 'm': 'unsubscribe.' + channel })
+
+    async def send(self, message):
+        self.start()
+        await self.connected.wait()
+        await self.ws.send_json(message)
+
+    # Send a message carrying an id ("i") and wait for the reply with the same id.
+    async def call(self, message, timeout=WS_CALL_TIMEOUT):
+        message = dict(message)
+        if not message.get('i'):
+            message['i'] = str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message['i']] = future
+        try:
+            await self.send(message)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(message['i'], None)
+
+    async def close(self):
+        self.closed = True
+        for channel in list(self.channels):
+            for subscription in self.channels.pop(channel)['subscriptions']:
+                subscription.end()
+        if self.ws is not None:
+            await self.ws.close()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+# Order book
+# order_book keeps the exchange book from ob.s snapshots and ob.u deltas ({"b": [[price, volume], ...], "a": [...]};
+# a volume of 0 clears the level). Levels live in a SortedDict per side, so an update is O(log n); a sparse Fenwick
+# tree per side over price ticks (price / tick) holds the volumes for cumulative queries in O(log range). The tree
+# counts whole lots (volume / lot) so its sums stay exact however many updates it has seen.
+# Updates carry a sequence number "s": an update that doesn't follow the last one marks the book out of sync, and
+# deltas are ignored until the next snapshot. There is a single writer (the feed) and it never waits for readers:
+# readers on other threads retry if an update ran while they read, readers on the loop always see a whole update.
+ORDER_BOOK_TICK = 1e-8
+ORDER_BOOK_LOT = 1e-8 # volume unit
+ORDER_BOOK_BITS = 48 # ticks per side, 2^48 * 1e-8 covers prices up to ~2.8M
+
+class volume_tree:
+
+    def __init__(self, bits=ORDER_BOOK_BITS):
+        self.size = 1 << bits
+        self.tree = {}
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.size:
+            self.tree[i] = self.tree.get(i, 0) + delta
+            i += i & -i
+
+    # sum of lots at indexes 0..i
+    def prefix(self, i):
+        i = min(i + 1, self.size)
+        total = 0
+        while i > 0:
+            total += self.tree.get(i, 0)
+            i -= i & -i
+        return total
+
+    # smallest index whose prefix reaches lots, or None if the whole tree holds less
+    def search(self, lots):
+        i = 0
+        step = self.size
+        while step:
+            j = i + step
+            if j <= self.size and self.tree.get(j, 0) < lots:
+                i = j
+                lots -= self.tree.get(j, 0)
+            step >>= 1
+        return i if i < self.size else None
+
+    def clear(self):
+        self.tree = {}
+
+class order_book:
+
+    # sides as in SIDES: BUY are the bids, SELL the asks
+    def __init__(self, tick=ORDER_BOOK_TICK, on_gap=None, bits=ORDER_BOOK_BITS, lot=ORDER_BOOK_LOT):
+        if SortedDict is None:
+            raise Exception("order_book requires sortedcontainers (pip install sortedcontainers)")
+        self.tick = tick
+        self.digits = max(0, int(math.ceil(-math.log10(tick)))) # decimals of a tick, to round prices back from ticks
+        self.lot = lot
+        self.lot_digits = max(0, int(math.ceil(-math.log10(lot))))
+        self.on_gap = on_gap # called with the book when a sequence gap is found
+        self.bits = bits
+        self.levels = { 'BUY': SortedDict(), 'SELL': SortedDict() }
+        self.volumes = { 'BUY': volume_tree(bits), 'SELL': volume_tree(bits) }
+        self.totals = { 'BUY': 0, 'SELL': 0 } # lots
+        self.top = (None, None) # ((bid price, volume), (ask price, volume)), swapped whole after every update
+        self.seq = None
+        self.synced = False
+        self.gaps = 0
+        self.version = 0 # odd while an update is being written
+
+    # Fenwick index of a price: asks count up from the lowest price, bids down from the highest, so both sides
+    # accumulate from the best level outwards.
+    def index(self, side, price):
+        ticks = int(round(price / self.tick))
+        if not 0 <= ticks < (1 << self.bits):
+            raise Exception("price " + str(price) + " is outside the order book's tick range")
+        return ticks if side == 'SELL' else (1 << self.bits) - 1 - ticks
+
+    def price(self, side, index):
+        ticks = index if side == 'SELL' else (1 << self.bits) - 1 - index
+        return round(ticks * self.tick, self.digits)
+
+    def lots(self, volume):
+        return int(round(volume / self.lot))
+
+    def volume(self, lots):
+        return round(lots * self.lot, self.lot_digits)
+
+    def set_level(self, side, price, volume):
+        price = float(price)
+        volume = float(volume)
+        levels = self.levels[side]
+        delta = self.lots(volume) - self.lots(levels.get(price, 0.0))
+        if volume:
+            levels[price] = volume
+        else:
+            levels.pop(price, None)
+        if delta:
+            self.volumes[side].add(self.index(side, price), delta)
+            self.totals[side] += delta
+
+    def best(self, side):
+        levels = self.levels[side]
+        if not levels:
+            return None
+        return levels.peekitem(-1 if side == 'BUY' else 0)
+
+    # Returns True when the message changed the book.
+    def apply(self, message):
+        method = message.get('m')
+        seq = message.get('s')
+        if method == 'reconnect':
+            self.synced = False # the snapshot sent after resubscribing follows
+            return False
+        if method == 'ob.s':
+            self.version += 1
+            try:
+                for side in ('BUY', 'SELL'):
+                    self.levels[side].clear()
+                    self.volumes[side].clear()
+                    self.totals[side] = 0
+                for price, volume in message.get('b') or []:
+                    self.set_level('BUY', price, volume)
+                for price, volume in message.get('a') or []:
+                    self.set_level('SELL', price, volume)
+                self.top = (self.best('BUY'), self.best('SELL'))
+            finally:
+                self.version += 1
+            self.seq = seq
+            self.synced = True
+            return True
+        if method != 'ob.u' or not self.synced:
+            return False
+        if seq is not None and self.seq is not None:
+            if seq <= self.seq:
+                return False # already applied
+            if seq != self.seq + 1:
+                self.synced = False
+                self.gaps += 1
+                if self.on_gap is not None:
+                    self.on_gap(self)
+                return False
+        self.version += 1
+        try:
+            for price, volume in message.get('b') or []:
+                self.set_level('BUY', price, volume)
+            for price, volume in message.get('a') or []:
+                self.set_level('SELL', price, volume)
+            self.top = (self.best('BUY'), self.best('SELL'))
+        finally:
+            self.version += 1
+        self.seq = seq
+        return True
+
+    # Run a read that touches more than one structure without ever making the writer wait: retry if an update
+    # started or finished while it ran. An error is only put down to such an update when the version moved.
+    def read(self, fn):
+        while True:
+            version = self.version
+            if version % 2 == 0:
+                try:
+                    result = fn()
+                except (RuntimeError, KeyError, IndexError):
+                    if self.version == version:
+                        raise
+                else:
+                    if self.version == version:
+                        return result
+            time.sleep(0)
+
+    def best_bid(self):
+        return self.top[0]
+
+    def best_ask(self):
+        return self.top[1]
+
+    def spread(self):
+        bid, ask = self.top
+        return ask[0] - bid[0] if bid and ask else None
+
+    def mid(self):
+        bid, ask = self.top
+        return (ask[0] + bid[0]) / 2 if bid and ask else None
+
+    # Volume at exactly this price, 0 when there is no level.
+    def depth(self, side, price):
+        return self.levels[side].get(float(price), 0.0)
+
+    # Volume of the whole side.
+    def total(self, side):
+        return self.volume(self.totals[side])
+
+    # Volume from the best level through price, inclusive.
+    def volume_to(self, side, price):
+        return self.read(lambda: self.volume(self.volumes[side].prefix(self.index(side, float(price)))))
+
+    # Volume of the best n levels.
+    def volume_levels(self, side, n):
+        def cumulative():
+            levels = self.levels[side]
+            if n <= 0 or not levels:
+                return 0.0
+            n_levels = min(n, len(levels))
+            price = levels.peekitem(-n_levels if side == 'BUY' else n_levels - 1)[0]
+            return self.volume(self.volumes[side].prefix(self.index(side, price)))
+        return self.read(cumulative)
+
+    # Worst price reached when taking volume from the side, e.g. to price a market order; None if the book is too thin.
+    # Always the price of a level on the book.
+    def price_for_volume(self, side, volume):
+        def search():
+            lots = self.lots(volume)
+            levels = self.levels[side]
+            if not levels or lots > self.totals[side]:
+                return None
+            if lots <= 0:
+                return self.best(side)[0]
+            index = self.volumes[side].search(lots)
+            if index is None:
+                return None
+            price = self.price(side, index)
+            # the tree's index maps back to a level's price; snap to the level in case rounding put it a tick off
+            if side == 'SELL':
+                return levels.peekitem(min(levels.bisect_left(price), len(levels) - 1))[0]
+            return levels.peekitem(max(levels.bisect_right(price) - 1, 0))[0]
+        return self.read(search)
+
+    # The best n levels of a side as [(price, volume), ...], best first.
+    def levels_of(self, side, n):
+        def best_levels():
+            levels = self.levels[side]
+            items = levels.items()
+            return [items[-1 - i] for i in range(min(n, len(levels)))] if side == 'BUY' else list(items[:n])
+        return self.read(best_levels)
+
+# Gap-free streams
+# gap_free_stream turns a trades, mytrades or candlesticks subscription into one ordered feed of trades or candles
+# without holes. A reconnect, a sequence number that skips ahead or a candle that skips a period opens a gap: live
+# events are held back while the missed window (from the last released event to now) is fetched from the REST
+# history in a task of its own, so the backfills of all streams hit by a reconnect run at the same time. The history
+# is then spliced in front of the held events, whatever was already released is dropped, and the feed carries on.
+# Trades come out as {"id", "p", "q", "sd", "t" (ms)}, candles as {"t" (s), "o", "h", "l", "c", "v"}.
+BACKFILL_PAGE = 100 # trades per history request
+BACKFILL_PAGES = 50 # history requests per gap at most, anything older is given up on
+RESYNC_SEEN = 10000 # trade ids remembered for de-duplication
+
+def trade_from_rest(trade):
+    return { 'id': str(trade.get('id')), 'p': trade.get('price'), 'q': trade.get('qty'), 'sd': trade.get('dir'), 't': int(trade.get('time') or 0) // 1000 }
+
+def candle_from_rest(candle):
+    return { 't': candle.get('time'), 'o': candle.get('open'), 'h': candle.get('high'), 'l': candle.get('low'), 'c': candle.get('close'), 'v': candle.get('volume') }
+
+# the list in a history response, whether it's the response itself or wrapped in an object
+def history_items(response):
+    if isinstance(response, dict):
+        return next((value for value in response.values() if isinstance(value, list)), [])
+    return response or []
+
+class gap_free_stream:
+
+    # rest is a public_api (or private_api for mytrades), sync or async, used for the history. resolution is the
+    # candle length in minutes, required for candlesticks.
+    def __init__(self, subscription, rest, market, resolution=None, maxsize=WS_QUEUE_SIZE, verbose=False):
+        if subscription.channel == 'candlesticks' and not resolution:
+            raise Exception("candlesticks need a resolution")
+        self.subscription = subscription
+        self.channel = subscription.channel
+        self.rest = rest
+        self.market = market
+        self.resolution = resolution
+        self.verbose = verbose
+        self.queue = asyncio.Queue(maxsize)
+        self.seq = None
+        self.last = None # time of the last released event
+        self.seen = OrderedDict() # trade id -> None, or candle time -> candle, of released events
+        self.held = [] # live events waiting for a backfill
+        self.backfill = None
+        self.again = False # another gap opened while backfilling
+        self.gaps = 0
+        self.backfilled = 0
+        self.error = None # last failed backfill
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    async def run(self):
+        try:
+            async for message in self.subscription:
+                await self.handle(message)
+            if self.backfill is not None:
+                await self.backfill
+        finally:
+            await self.queue.put(WS_CLOSED)
+
+    async def handle(self, message):
+        method = str(message.get('m', ''))
+        if method == 'reconnect':
+            self.gap()
+            return
+        seq = message.get('s')
+        if method.endswith('.u') and seq is not None and self.seq is not None:
+            if seq <= self.seq:
+                return # already seen
+            if seq != self.seq + 1:
+                self.gap()
+        if seq is not None:
+            self.seq = seq
+        events = self.events(message)
+        if self.channel == 'candlesticks' and events and self.last is not None and self.backfill is None:
+            if min(event['t'] for event in events) > self.last + self.resolution * 60:
+                self.gap() # a whole candle is missing
+        if self.backfill is not None:
+            self.held += events
+        else:
+            await self.release(events)
+
+    def events(self, message):
+        if self.channel == 'candlesticks':
+            candles = message.get('c') or []
+            return [candles] if isinstance(candles, dict) else list(candles)
+        return list(message.get('t') or [])
+
+    def gap(self):
+        self.gaps += 1
+        if self.last is None:
+            return # nothing released yet, the next snapshot starts the feed
+        if self.backfill is not None:
+            self.again = True
+            return
+        self.backfill = asyncio.ensure_future(self.fill(self.last))
+
+    async def fill(self, since):
+        while True:
+            self.again = False
+            try:
+                history = await self.history(since)
+                self.backfilled += len(history)
+            except Exception as e:
+                # the window stays lost, but the live feed must go on
+                history = []
+                self.error = e
+                if self.verbose:
+                    print('backfill of ' + self.channel + ' failed: ' + str(e))
+            self.held = history + self.held
+            while self.held:
+                events, self.held = self.held, []
+                await self.release(events)
+            if not self.again:
+                break
+            since = self.last
+        self.backfill = None
+
+    async def call(self, fn, *args):
+        if isinstance(self.rest, async_public_api):
+            return await fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: fn(*args))
+
+    async def history(self, since):
+        now_ms = self.rest.get_epoch_ms_from_now()
+        if self.channel == 'candlesticks':
+            response = await self.call(self.rest.get_candlesticks, self.market, since, now_ms // 1000 + self.resolution * 60, self.resolution)
+            return [candle_from_rest(candle) for candle in history_items(response)]
+        fetch = self.rest.get_my_trades if self.channel == 'mytrades' else self.rest.get_trades
+        # pages of trades older than the cursor (in µs), newest first; the cursor stays 1µs past the oldest trade so
+        # trades sharing its timestamp on the next page aren't skipped, the ids weed out the repeats
+        cursor = (now_ms + 1) * 1000
+        trades = OrderedDict()
+        for _ in range(BACKFILL_PAGES):
+            page = history_items(await self.call(fetch, self.market, 'DESC', BACKFILL_PAGE, cursor))
+            new = 0
+            for trade in page:
+                trade = trade_from_rest(trade)
+                if trade['id'] not in trades:
+                    trades[trade['id']] = trade
+                    new += 1
+            if not new or len(page) < BACKFILL_PAGE:
+                break
+            oldest = min(int(trade.get('time') or 0) for trade in page)
+            if oldest // 1000 < since:
+                break
+            cursor = oldest + 1
+        return [trade for trade in reversed(trades.values()) if trade['t'] >= since] # oldest first, like the feed
+
+    # Release events in time order, skipping the ones already released and any older than the last one released.
+    async def release(self, events):
+        candles = self.channel == 'candlesticks'
+        for event in sorted(events, key=lambda event: event['t']):
+            if self.last is not None and event['t'] < self.last:
+                continue
+            key = event['t'] if candles else event['id']
+            if (self.seen.get(key) == event) if candles else (key in self.seen):
+                continue
+            self.seen[key] = event if candles else None
+            self.seen.move_to_end(key)
+            while len(self.seen) > RESYNC_SEEN:
+                self.seen.popitem(last=False)
+            self.last = event['t']
+            await self.queue.put(event)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.queue.get()
+        if event is WS_CLOSED:
+            raise StopAsyncIteration
+        return event
+
+    async def close(self):
+        if self.backfill is not None:
+            self.backfill.cancel()
+        await self.subscription.close()
 
+class websockets_api(public_api):
 
-    async def request(self, body, on_message=None):
+    # host is the websocket url. queue_size and overflow are the defaults for subscriptions, see websocket_subscription.
+    # rest is a private_api or async_private_api whose server clock signs the connection, synced before every connect
+    # the same way it is before a REST request; without one an async_private_api on WS_CLOCK_HOST is made for that.
+    def __init__(self, host, organisation_id, key, secret, verbose=False, queue_size=WS_QUEUE_SIZE, overflow='drop', decoder=None, rest=None):
+        if rest is not None and not isinstance(rest, private_api):
+            raise Exception("rest must be a private_api or async_private_api")
+        self.key = key
+        self.secret = secret
+        self.organisation_id = organisation_id
+        self.host = host
+        self.verbose = verbose
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.decode = get_decoder(decoder)
+        self.signer = hmac_signer(key, secret, organisation_id)
+        self.owns_rest = rest is None
+        self.rest = async_private_api(WS_CLOCK_HOST, organisation_id, key, secret, verbose=verbose, rate_limit=False) if rest is None else rest
+        self.clock = self.rest.clock
+        self.connection = None
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+        if self.owns_rest:
+            await self.rest.close()
+
+    # The shared connection, opened on first use; must be called from inside the event loop.
+    def connect(self):
+        if self.connection is None:
+            self.connection = websocket_connection(self.host, self.headers, self.decode, self.verbose)
+        return self.connection.start()
+
+    async def sync_clock(self):
+        if isinstance(self.rest, async_private_api):
+            await self.rest.maybe_sync_clock()
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.rest.maybe_sync_clock)
 
+    async def headers(self):
+        await self.sync_clock()
         xtime = self.get_epoch_ms_from_now()
         xnonce = str(uuid.uuid4())
-
-        message = bytearray(self.key, 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(str(xtime), 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(xnonce, 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray(self.organisation_id, 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray("wss", 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        message += bytearray("my", 'utf-8')
-        message += bytearray('\x00', 'utf-8')
-        # message += bytearray(query, 'utf-8')
-
-        digest = hmac.new(bytearray(self.secret, 'utf-8'), message, sha256).hexdigest()
-        xauth = self.key + ":" + digest
-
-        headers = {
+        return {
             'X-Time': str(xtime),
             'X-Nonce': xnonce,
-            'X-Organization-Id': self.organisation_id,
+            'X-Organization-Id': self.organisation_id or '',
             'X-Request-Id': str(uuid.uuid4()),
-            'X-Auth': xauth,
-            'Content-Type': 'application/json'
+            'X-Auth': self.signer.sign(xtime, xnonce, "wss", "my", ""),
         }
 
-        import websocket
-
-        websocket.enableTrace(True)
-
-        print(self.host)
-
-
-        # ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-        # localhost_pem = pathlib.Path(__file__).with_name("localhost.pem")
-        # ssl_context.load_verify_locations(localhost_pem)
-
-        # websocket.setdefaulttimeout(5)
-
-        if not on_message:
-            on_message = self.on_message
-
-        self.websocket = websocket.WebSocketApp(self.host,
-                            on_open = self.on_open,
-                            on_message = on_message,
-                            on_error = self.on_error,
-                            on_close = self.on_close,
-                            header = headers
-                        )
-
-        import ssl
-        # self.websocket.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-
-        self.websocket.run_forever(sslopt={"check_hostname": False})
-
-        return self.websocket
-
-
-        # while(True):
-        #     try:
-        #         message_str = await asyncio.wait_for(websocket.recv(), timeout=self._timeout)
-        #         if message_str[9:18] != "heartbeat":
-        #             # await self.queue.put(message_str)
-        #             self.queue.put_nowait(message_str)
-        #     except Exception as e:
-        #         raise Exception("no data in {} seconds, killing connection".format(self._timeout))
-
+    # Subscribe on the shared connection; returns a websocket_subscription to iterate with "async for".
+    # options: maxsize, overflow, reconnects, block_timeout (see websocket_subscription)
+    async def subscribe(self, channel, message, **options):
+        options.setdefault('maxsize', self.queue_size)
+        options.setdefault('overflow', self.overflow)
+        return await self.connect().subscribe(channel, message, **options)
+
+    async def unsubscribe(self, channel):
+        if self.connection is not None:
+            await self.connection.unsubscribe_channel(channel)
+
+    # Send a message on the shared connection without waiting for a reply.
+    async def request(self, body):
+        await self.connect().send(body)
+
+    # Subscribe to the order book stream and keep an order_book up to date from it in a task on the loop. After a
+    # sequence gap the stream is subscribed again, which makes the server send a fresh snapshot.
+    # Stop it with book.task.cancel() and unsubscribe_order_book_stream().
+    async def order_book(self, tick=ORDER_BOOK_TICK, **options):
+        subscribe = { "m": "subscribe.orderbook" }
+        book = order_book(tick, on_gap=lambda book: asyncio.ensure_future(self.request(subscribe)))
+        options['reconnects'] = True
+        subscription = await self.subscribe('orderbook', subscribe, **options)
+        async def follow():
+            async for message in subscription:
+                book.apply(message)
+        book.task = asyncio.ensure_future(follow())
+        return book
+
+    # One ordered trades, mytrades or candlesticks feed that backfills whatever a reconnect or a dropped message
+    # missed, see gap_free_stream. rest is the REST client used for the history (a private one for mytrades),
+    # r the candlestick resolution. Iterate it with "async for"; close() unsubscribes.
+    async def gap_free_stream(self, channel, rest, market, r=None, **options):
+        if channel not in ('trades', 'mytrades', 'candlesticks'):
+            raise Exception("gap_free_stream takes trades, mytrades or candlesticks")
+        subscribe = { "m": "subscribe." + channel }
+        if channel == 'candlesticks':
+            if not r:
+                raise Exception("candlesticks need a resolution r")
+            subscribe["r"] = r
+        options['reconnects'] = True
+        subscription = await self.subscribe(channel, subscribe, **options)
+        return gap_free_stream(subscription, rest, market, r, options.get('maxsize', self.queue_size), self.verbose).start()
+
+    # don't require permissions:
+    # candlestick
+    # order book stream
+    # trade stream
 
     # WSS
 
@@ -1210,43 +3512,37 @@ class websockets_api(public_api):
     # Subscribe to candlestick stream. When subscription is successful, last candlestick is returned in message with method c.s. Later updates are sent in messages with method c.u. Request must specify resolution parameter. Supported resolutions are: 1 (minute), 60 (hour), 1440 (day). Only one candlestick subscription is possible at the same time.
     # m   string  Method must be "subscribe.candlesticks"
     # r   number  Candlesticks resolution      [ 1, 60, 1440 ]
-    def subscribe_candlestick_stream(self, r):
+    async def subscribe_candlestick_stream(self, r, **options):
         data = {
             "m": "subscribe.candlesticks",
             "r": r
         }
-        return self.request(data)
+        return await self.subscribe('candlesticks', data, **options)
 
     # ws
     # Unsubscribe Candlestick Stream
     # Unsubscribe from candlesticks stream. No further messages from this stream should be received.
     # m   string  Method must be "unsubscribe.candlesticks"
-    def unsubscribe_candlestick_stream(self):
-        data = {
-            "m": "unsubscribe.candlesticks"
-        }
-        return self.request(data)
+    async def unsubscribe_candlestick_stream(self):
+        await self.unsubscribe('candlesticks')
 
     # MyTrade stream
     # ws
     # Subscribe My Trade Stream
     # Subscribe to my trade stream. When subscribed, list of last trades is received in message with method mt.s. New trades are received later in messages with method mt.u.
     # m   string  Method should be "subscribe.mytrades"
-    def subscribe_trade_stream(self):
+    async def subscribe_my_trade_stream(self, **options):
         data = {
             "m": "subscribe.mytrades"
         }
-        return self.request(data)
+        return await self.subscribe('mytrades', data, **options)
 
     # ws
     # Unsubscribe My Trade Stream
     # Unsubscribe from my trade stream. No further messages from this stream should be received.
     # m   string  Method should be "subscribe.mytrades" (typo in docs) -> "unsubscribe.mytrades"
-    def unsubscribe_trade_stream(self):
-        data = {
-            "m": "unsubscribe.mytrades"
-        }
-        return self.request(data)
+    async def unsubscribe_my_trade_stream(self):
+        await self.unsubscribe('mytrades')
 
     # Order Manipulation
 
@@ -1256,13 +3552,13 @@ class websockets_api(public_api):
     # m   string  Method must be "o.ca.all"
     # i   string  Message id - any string selected by client
     # s   string  Order side, if order side is not in the request, all orders are canceled        [ "BUY", "SELL" ]
-    def cancel_all_orders(self, message_id="", side=""):
+    async def cancel_all_orders(self, message_id="", side=""):
         data = {
             "m": "o.ca.all",
             "i": message_id,
             "s": side
         }
-        return self.request(data)
+        return await self.connect().call(data)
 
     # ws
     # Cancel Order
@@ -1270,13 +3566,13 @@ class websockets_api(public_api):
     # m   string  Method must be "o.ca"
     # i   string  Message id - any string selected by client
     # oid     string  Order id
-    def cancel_order(self, message_id="", order_id=""):
+    async def cancel_order(self, message_id="", order_id=""):
         data = {
             "m": "o.ca",
             "i": message_id,
             "oid": order_id
         }
-        return self.request(data)
+        return await self.connect().call(data)
 
     # ws
     # Create Order
@@ -1294,7 +3590,7 @@ class websockets_api(public_api):
     # sqt     string  Order secondary (quote) quantity for BUY MARKET order
     # mqt     string  Minimum order (base) quantity for BUY MARKET order (optional)
 
-    def create_limit_order(self, message_id, side, quantity, price):
+    async def create_limit_order(self, message_id, side, quantity, price):
         data = {
             "m": "o.cr",
             "i": message_id,
@@ -1303,9 +3599,9 @@ class websockets_api(public_api):
             "qt": quantity,
             "pr": price
         }
-        return self.request(data)
+        return await self.connect().call(data)
 
-    def create_buy_market_order(self, message_id, quantityQuote, quantityBase=""):
+    async def create_buy_market_order(self, message_id, quantityQuote, quantityBase=""):
         data = {
             "m": "o.cr",
             "i": message_id,
@@ -1314,9 +3610,9 @@ class websockets_api(public_api):
             "sqt": quantityQuote,
             "mqt": quantityBase
         }
-        return self.request(data)
+        return await self.connect().call(data)
 
-    def create_sell_market_order(self, message_id, quantity, minSecQuantity=""):
+    async def create_sell_market_order(self, message_id, quantity, minSecQuantity=""):
         data = {
             "m": "o.cr",
             "i": message_id,
@@ -1325,27 +3621,24 @@ class websockets_api(public_api):
             "qt": quantity,
             "msqt": minSecQuantity
         }
-        return self.request(data)
+        return await self.connect().call(data)
 
     # ws
     # Subscribe Order Stream
     # Subscribe to order stream where only my orders will be received. When subscribing, reponse message will be sent with method o.s. Later order updates will be sent in messages with method o.u.
     # m   string  Method must be "subscribe.orders"
-    def subscribe_order_stream(self):
+    async def subscribe_order_stream(self, **options):
         data = {
             "m": "subscribe.orders"
         }
-        return self.request(data)
+        return await self.subscribe('orders', data, **options)
 
     # ws
     # Unsubscribe Order Stream
     # Unsubscribe from orders stream. No further messages from this stream should be received.
     # m   string  Method must be "unsubscribe.orders"
-    def unsubscribe_order_stream(self):
-        data = {
-            "m": "unsubscribe.orders"
-        }
-        return self.request(data)
+    async def unsubscribe_order_stream(self):
+        await self.unsubscribe('orders')
 
     # Orderbook Stream
 
@@ -1353,21 +3646,18 @@ class websockets_api(public_api):
     # Subscribe Order Book Stream
     # Subscribe to order book stream. Order book state is returned after orderbook subscribe message with method ob.s. Later only the order book changes are notified with messages with method ob.u. When orderbook update contains price with value 0, entry is cleared from order book.
     # m   string  Method must be "subscribe.orderbook"
-    def subscribe_order_book_stream(self):
+    async def subscribe_order_book_stream(self, **options):
         data = {
             "m": "subscribe.orderbook"
         }
-        return self.request(data)
+        return await self.subscribe('orderbook', data, **options)
 
     # ws
     # Unsubscribe Order Book Stream
     # Unsubscribe from orderbook stream. No further messages from this stream should be received.
     # m   string  Method must be "unsubscribe.orderbook"
-    def unsubscribe_order_book_stream(self):
-        data = {
-            "m": "subscribe.orderbook"
-        }
-        return self.request(data)
+    async def unsubscribe_order_book_stream(self):
+        await self.unsubscribe('orderbook')
 
     # Trade Stream
 
@@ -1375,21 +3665,18 @@ class websockets_api(public_api):
     # Subscribe Trade Stream
     # Subscribe to trade stream. When subscribed, list of last trades is received in message with method m.s. New trades are received later in messages with method m.u.
     # m   string  Method must be "subscribe.trades"
-    def subscribe_trade_stream(self):
+    async def subscribe_trade_stream(self, **options):
         data = {
             "m": "subscribe.trades"
         }
-        return self.request(data)
+        return await self.subscribe('trades', data, **options)
 
     # ws
     # Unsubscribe Trade Stream
     # Unsubscribe from trades stream. No further messages from this stream should be received.
     # m   string  Method must be "unsubscribe.trades"
-    def unsubscribe_order_stream(self):
-        data = {
-            "m": "unsubscribe.trades"
-        }
-        return self.request(data)
+    async def unsubscribe_trade_stream(self):
+        await self.unsubscribe('trades')
 
 def main():
     parser = optparse.OptionParser()
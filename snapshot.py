@@ -0,0 +1,206 @@
+import asyncio
+import sys
+import threading
+import time
+from nicehash import RIG_ACTIONS
+
+#batch request body: ["rig1", ...], {"names": [...]} or {"all": true}
+#returns the list of names, or None for all rigs
+def names_from_body(body):
+  if isinstance(body, dict) and body.get("all"):
+    return None
+  names = body.get("names") if isinstance(body, dict) else body
+  if not isinstance(names, list):
+    raise ValueError("expected a list of rig names or {\"all\": true}")
+  return names
+
+#bulk control body: {"targets": [{"name", "rigId" or "group", "action", "options"}, ...], "collapse": true}
+#returns (targets, collapse)
+#name/rigId/deviceId/group must be non-empty strings when given: update_status with an empty rigId and group acts on
+#every rig in the org
+def control_from_body(body):
+  targets = body.get("targets") if isinstance(body, dict) else None
+  if not isinstance(targets, list):
+    raise ValueError("expected {\"targets\": [{\"name\": ..., \"action\": ...}, ...]}")
+  for target in targets:
+    if not isinstance(target, dict):
+      raise ValueError("each target must be an object")
+    for field in ("name", "rigId", "deviceId", "group"):
+      if field in target and not (isinstance(target[field], str) and target[field]):
+        raise ValueError(field + " must be a non-empty string")
+    if not (target.get("name") or target.get("rigId") or target.get("group")):
+      raise ValueError("each target needs a name, rigId or group")
+    if target.get("action") not in RIG_ACTIONS:
+      raise ValueError("action must be one of " + ", ".join(RIG_ACTIONS))
+  collapse = body.get("collapse", True)
+  if not isinstance(collapse, bool):
+    raise ValueError("collapse must be true or false")
+  return targets, collapse
+
+#put bulk_update_status results for the resolved targets back in request order; unresolved names fail
+def merge_results(targets, indexes, results):
+  merged = [dict(target, ok=False, error="unknown rig") for target in targets]
+  for i, result in zip(indexes, results):
+    merged[i] = result
+  return merged
+
+def intern(value):
+  return sys.intern(value) if isinstance(value, str) else value
+
+def enum_name(value):
+  #devices/stats wrap enums as {"enumName": ..., "description": ...}
+  return intern(value.get("enumName")) if isinstance(value, dict) else intern(value)
+
+#compact, fixed-layout copy of one miningRigs item holding only what the service reads
+#status/power mode/group/algorithm strings are interned so thousands of rigs share one copy of each
+class rig_record:
+  __slots__ = ("rig_id", "name", "status", "status_time", "group", "power_mode", "profitability", "devices", "algorithms")
+
+  def __init__(self, rig_id, name, status, status_time=None, group=None, power_mode=None, profitability=None, devices=0, algorithms=()):
+    self.rig_id = rig_id
+    self.name = name
+    self.status = status
+    self.status_time = status_time
+    self.group = group
+    self.power_mode = power_mode
+    self.profitability = profitability
+    self.devices = devices
+    self.algorithms = algorithms
+
+  @classmethod
+  def from_json(cls, rig):
+    stats = rig.get("stats") or []
+    return cls(
+      rig.get("rigId"),
+      rig["name"],
+      intern(rig.get("minerStatus")),
+      rig.get("statusTime"),
+      intern(rig.get("groupName")),
+      enum_name(rig.get("rigPowerMode")),
+      rig.get("profitability"),
+      len(rig.get("devices") or []),
+      tuple(enum_name(stat.get("algorithm")) for stat in stats)
+    )
+
+#in-memory name-indexed copy of miningRigs, refreshed by a background thread
+class rig_snapshot:
+
+  def __init__(self, api, interval=30):
+    self.api = api
+    self.interval = interval
+    self.rigs = {} #name -> rig_record
+    self.status_counts = {}
+    self.updated = None #monotonic time of last successful refresh
+    self.error = None
+    self.ready = threading.Event()
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def refresh(self):
+    self.update(self.api.get_all_rigs()["miningRigs"])
+
+  def update(self, rigs):
+    #swap in a whole new dict so readers never see a half-built index
+    records = {r["name"]: rig_record.from_json(r) for r in rigs}
+    counts = {}
+    for rig in records.values():
+      counts[rig.status] = counts.get(rig.status, 0) + 1
+    self.rigs = records
+    self.status_counts = counts #minerStatus -> rigs, for the fleet gauges
+    self.updated = time.monotonic()
+    self.error = None
+    self.ready.set()
+
+  def run(self):
+    while not self.stopped.is_set():
+      try:
+        self.refresh()
+      except Exception as e:
+        self.error = e
+        print("rig snapshot refresh failed:", e)
+      self.stopped.wait(self.interval)
+
+  def start(self):
+    self.thread = threading.Thread(target=self.run, name="rig-snapshot", daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.stopped.set()
+
+  #only blocks until the first refresh lands
+  def wait(self, timeout):
+    self.ready.wait(timeout)
+
+  #true when the last refresh failed and the rigs are the last known good ones
+  def stale(self):
+    return self.error is not None
+
+  def age(self):
+    if self.updated is None:
+      return None
+    return time.monotonic() - self.updated
+
+  def get(self, name):
+    rig = self.rigs.get(name)
+    return None if rig is None else rig.status
+
+  #fills in rigId for targets given by name; returns the resolved targets and their indexes in the input
+  def resolve(self, targets):
+    rigs = self.rigs
+    resolved = []
+    indexes = []
+    for i, target in enumerate(targets):
+      if target.get("name") and not target.get("rigId"):
+        rig = rigs.get(target["name"])
+        if rig is None:
+          continue
+        target = dict(target, rigId=rig.rig_id)
+      resolved.append(target)
+      indexes.append(i)
+    return resolved, indexes
+
+  #names=None returns every rig; all lookups are answered from the same snapshot
+  def get_many(self, names=None):
+    rigs = self.rigs
+    if names is None:
+      return {name: rig.status for name, rig in rigs.items()}
+    statuses = {}
+    for name in names:
+      rig = rigs.get(name)
+      statuses[name] = None if rig is None else rig.status
+    return statuses
+
+#same snapshot, refreshed by a task on the running event loop using an async_private_api
+class async_rig_snapshot(rig_snapshot):
+
+  def __init__(self, api, interval=30):
+    super().__init__(api, interval)
+    self.task = None
+
+  async def refresh(self):
+    self.update((await self.api.get_all_rigs())["miningRigs"])
+
+  async def run(self):
+    while True:
+      try:
+        await self.refresh()
+      except Exception as e:
+        self.error = e
+        print("rig snapshot refresh failed:", e)
+      await asyncio.sleep(self.interval)
+
+  #must be called from inside the event loop
+  def start(self):
+    self.ready = asyncio.Event()
+    self.task = asyncio.ensure_future(self.run())
+    return self
+
+  def stop(self):
+    self.task.cancel()
+
+  async def wait(self, timeout):
+    try:
+      await asyncio.wait_for(self.ready.wait(), timeout)
+    except asyncio.TimeoutError:
+      pass
@@ -0,0 +1,120 @@
+# async_private_api against a local aiohttp stub that checks X-Auth like the real api: python -m pytest tests
+import asyncio
+import json
+import time
+import unittest
+
+from aiohttp import web
+
+import nicehash
+
+KEY = "stub-key"
+SECRET = "stub-secret"
+ORG_ID = "stub-org"
+
+SERVER_AHEAD_MS = 3600 * 1000 # the stub's clock runs an hour ahead, so only a synced client signs with its time
+ALGORITHMS = {"miningAlgorithms": [{"algorithm": "SCRYPT", "order": 0, "marketFactor": "1000000000000", "displayMarketFactor": "TH"}]}
+
+def reply(payload):
+    async def handler(request):
+        return web.json_response(payload() if callable(payload) else payload)
+    return handler
+
+class stub:
+
+    def __init__(self):
+        self.signer = nicehash.hmac_signer(KEY, SECRET, ORG_ID)
+        self.orders = [] # bodies of the POSTed orders
+        self.times = [] # X-Time of every signed request and websocket connect
+
+    def app(self):
+        app = web.Application(middlewares=[self.auth])
+        app.router.add_get("/api/v2/time", reply(lambda: {"serverTime": int(time.time() * 1000) + SERVER_AHEAD_MS}))
+        app.router.add_get("/main/api/v2/mining/algorithms", reply(ALGORITHMS))
+        app.router.add_get("/main/api/v2/public/buy/info", reply({"miningAlgorithms": []}))
+        app.router.add_get("/main/api/v2/public/currencies", reply({"currencies": []}))
+        app.router.add_get("/main/api/v2/public/service/fee/info", reply({}))
+        app.router.add_post("/main/api/v2/hashpower/orders/fixedPrice", self.fixed_price)
+        app.router.add_post("/main/api/v2/hashpower/order/", self.order)
+        app.router.add_post("/main/api/v2/hashpower/order/{id}/updatePriceAndLimit/", self.order)
+        app.router.add_get("/main/api/v2/mining/rigs2", reply({"miningRigs": [{"rigId": "rig-1"}, {"rigId": "rig-2"}]}))
+        app.router.add_get("/ws", self.websocket)
+        return app
+
+    @web.middleware
+    async def auth(self, request, handler):
+        if request.path.startswith(("/main/api/v2/hashpower/", "/main/api/v2/mining/")):
+            body = await request.text()
+            headers = request.headers
+            expected = self.signer.sign(headers.get("X-Time"), headers.get("X-Nonce"), request.method, request.path, request.query_string, body or None)
+            if headers.get("X-Auth") != expected:
+                return web.json_response({"errors": [{"code": 2000, "message": "Invalid signature"}]}, status=403)
+            self.times.append(int(headers["X-Time"]))
+        return await handler(request)
+
+    async def websocket(self, request):
+        headers = request.headers
+        if headers.get("X-Auth") != self.signer.sign(headers.get("X-Time"), headers.get("X-Nonce"), "wss", "my", ""):
+            return web.json_response({"errors": [{"code": 2000, "message": "Invalid signature"}]}, status=403)
+        self.times.append(int(headers["X-Time"]))
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for message in ws:
+            await ws.send_json({"m": "m.s", "s": 1, "t": []})
+        return ws
+
+    async def fixed_price(self, request):
+        return web.json_response({"fixedMax": 10.0, "fixedPrice": 1.2345})
+
+    async def order(self, request):
+        body = json.loads(await request.text())
+        self.orders.append(body)
+        return web.json_response(dict(body, id="order-1"))
+
+class async_private_api_test(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.stub = stub()
+        self.runner = web.AppRunner(self.stub.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = "http://127.0.0.1:{}".format(port)
+        self.api = nicehash.async_private_api(self.base, ORG_ID, KEY, SECRET, rate_limit=False)
+
+    async def asyncTearDown(self):
+        await self.api.close()
+        await self.runner.cleanup()
+
+    async def test_create_fixed_hashpower_order_awaits_fixed_price(self):
+        order = await self.api.create_fixed_hashpower_order("EU", "SCRYPT", 1.0, 0.5, 0.01, "pool-1")
+        self.assertEqual(order["id"], "order-1")
+        self.assertEqual(order["price"], 1.2345)
+        self.assertEqual(order["type"], "FIXED")
+        self.assertEqual(order["displayMarketFactor"], "TH")
+
+    async def test_set_price_hashpower_order_loads_registry(self):
+        await self.api.set_price_hashpower_order("order-1", 1.5, "SCRYPT")
+        self.assertEqual(self.stub.orders, [{"price": 1.5, "marketFactor": "1000000000000", "displayMarketFactor": "TH"}])
+
+    def assertServerTime(self, xtime):
+        self.assertLess(abs(xtime - (time.time() * 1000 + SERVER_AHEAD_MS)), 60 * 1000)
+
+    async def test_stream_items_waits_for_the_first_clock_sync(self):
+        rigs = [rig async for rig in self.api.stream_rigs()]
+        self.assertEqual([rig["rigId"] for rig in rigs], ["rig-1", "rig-2"])
+        self.assertServerTime(self.stub.times[0])
+
+    async def test_websocket_signs_with_the_rest_clients_clock(self):
+        for rest in (self.api, nicehash.private_api(self.base, ORG_ID, KEY, SECRET, rate_limit=False)):
+            with self.subTest(rest=type(rest).__name__):
+                ws = nicehash.websockets_api(self.base.replace("http", "ws") + "/ws", ORG_ID, KEY, SECRET, rest=rest)
+                self.assertIs(ws.clock, rest.clock)
+                subscription = await ws.subscribe("trades", {"m": "subscribe.trades"})
+                self.assertEqual((await asyncio.wait_for(subscription.__anext__(), 5))["m"], "m.s")
+                self.assertServerTime(self.stub.times[-1])
+                await ws.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# collapse_targets / bulk_results: which update_status calls a bulk request turns into: python -m pytest tests
+import unittest
+
+from nicehash import collapse_targets, bulk_results
+
+def group(*rig_ids, **subgroups):
+    return {"rigs": [{"rigId": rig_id} for rig_id in rig_ids], "groups": subgroups}
+
+GROUPS = {"groups": {
+    "farm-a": group("a1", "a2", "a3"),
+    "farm-b": group("b1", "b2"),
+    "solo": group("s1"),
+    "": group("u1", "u2"),
+    "site": group("x1", "x2", hall=group("h1", "h2")),
+}}
+
+def stop(rig_id, **extra):
+    return dict({"rigId": rig_id, "action": "STOP"}, **extra)
+
+def per_rig(target):
+    return {"group_name": target.get("group", ""), "rig_id": target.get("rigId", ""), "device_id": target.get("deviceId", ""), "action": target["action"], "options": target.get("options")}
+
+def group_call(name, action="STOP", options=None):
+    return {"group_name": name, "action": action, "options": options}
+
+# (name, targets, groups, expected calls as [(kwargs, indexes)])
+CASES = [
+    ("whole group collapses", [stop("a1"), stop("a2"), stop("a3")], GROUPS,
+        [(group_call("farm-a"), [0, 1, 2])]),
+    ("group missing a rig stays per rig", [stop("a1"), stop("a2")], GROUPS,
+        [(per_rig(stop("a1")), [0]), (per_rig(stop("a2")), [1])]),
+    ("different actions stay per rig", [stop("b1"), {"rigId": "b2", "action": "START"}], GROUPS,
+        [(per_rig(stop("b1")), [0]), (per_rig({"rigId": "b2", "action": "START"}), [1])]),
+    ("different options stay per rig",
+        [{"rigId": "b1", "action": "POWER_MODE", "options": ["LOW"]}, {"rigId": "b2", "action": "POWER_MODE", "options": ["HIGH"]}], GROUPS,
+        [(per_rig({"rigId": "b1", "action": "POWER_MODE", "options": ["LOW"]}), [0]), (per_rig({"rigId": "b2", "action": "POWER_MODE", "options": ["HIGH"]}), [1])]),
+    ("same options collapse",
+        [{"rigId": "b1", "action": "POWER_MODE", "options": ["LOW"]}, {"rigId": "b2", "action": "POWER_MODE", "options": ["LOW"]}], GROUPS,
+        [(group_call("farm-b", "POWER_MODE", ["LOW"]), [0, 1])]),
+    ("single rig group stays per rig", [stop("s1")], GROUPS,
+        [(per_rig(stop("s1")), [0])]),
+    ("unnamed group never collapses", [stop("u1"), stop("u2")], GROUPS,
+        [(per_rig(stop("u1")), [0]), (per_rig(stop("u2")), [1])]),
+    ("group with subgroups is skipped, the subgroup collapses", [stop("x1"), stop("x2"), stop("h1"), stop("h2")], GROUPS,
+        [(group_call("hall"), [2, 3]), (per_rig(stop("x1")), [0]), (per_rig(stop("x2")), [1])]),
+    ("repeated rig keeps its group from collapsing", [stop("b1"), stop("b2"), {"rigId": "b1", "action": "START"}], GROUPS,
+        [(per_rig(stop("b1")), [0]), (per_rig(stop("b2")), [1]), (per_rig({"rigId": "b1", "action": "START"}), [2])]),
+    ("repeated identical target isn't collapsed either", [stop("b1"), stop("b2"), stop("b2")], GROUPS,
+        [(per_rig(stop("b1")), [0]), (per_rig(stop("b2")), [1]), (per_rig(stop("b2")), [2])]),
+    ("device targets stay per device", [stop("b1", deviceId="d1"), stop("b2")], GROUPS,
+        [(per_rig(stop("b1", deviceId="d1")), [0]), (per_rig(stop("b2")), [1])]),
+    ("group target passes through", [{"group": "farm-a", "action": "STOP"}], GROUPS,
+        [(per_rig({"group": "farm-a", "action": "STOP"}), [0])]),
+    ("no groups, no collapsing", [stop("a1"), stop("a2"), stop("a3")], None,
+        [(per_rig(stop("a1")), [0]), (per_rig(stop("a2")), [1]), (per_rig(stop("a3")), [2])]),
+    ("nothing to do", [], GROUPS, []),
+]
+
+class collapse_targets_test(unittest.TestCase):
+
+    def test_cases(self):
+        for name, targets, groups, expected in CASES:
+            with self.subTest(name):
+                self.assertEqual(collapse_targets(targets, groups), expected)
+
+    def test_every_target_is_covered_once(self):
+        for name, targets, groups, expected in CASES:
+            with self.subTest(name):
+                indexes = sorted(i for _, covered in collapse_targets(targets, groups) for i in covered)
+                self.assertEqual(indexes, list(range(len(targets))))
+
+    def test_org_wide_targets_raise(self):
+        for target in [{"action": "STOP"}, {"rigId": "", "action": "STOP"}, {"group": "", "rigId": "", "action": "STOP"}, {"name": "x", "action": "STOP"}]:
+            with self.subTest(target=target):
+                with self.assertRaises(ValueError):
+                    collapse_targets([stop("a1"), target], GROUPS)
+
+class bulk_results_test(unittest.TestCase):
+
+    def test_outcomes_spread_in_input_order(self):
+        targets = [stop("b1"), stop("a1"), stop("b2"), stop("a2"), stop("a3")]
+        calls = collapse_targets(targets, GROUPS)
+        outcomes = [{"ok": True, "result": kwargs.get("group_name") or kwargs["rig_id"]} for kwargs, _ in calls]
+        results = bulk_results(targets, calls, outcomes)
+        self.assertEqual([result["rigId"] for result in results], ["b1", "a1", "b2", "a2", "a3"])
+        self.assertEqual([result["result"] for result in results], ["farm-b", "farm-a", "farm-b", "farm-a", "farm-a"])
+        self.assertEqual([result["viaGroup"] for result in results], ["farm-b", "farm-a", "farm-b", "farm-a", "farm-a"])
+
+    def test_per_rig_calls_have_no_via_group(self):
+        targets = [stop("a1"), stop("s1")]
+        calls = collapse_targets(targets, GROUPS)
+        results = bulk_results(targets, calls, [{"ok": True, "result": None}, {"ok": False, "error": "boom"}])
+        self.assertEqual(results, [dict(stop("a1"), ok=True, result=None), dict(stop("s1"), ok=False, error="boom")])
+
+    def test_group_target_is_attributed_to_its_group(self):
+        targets = [{"group": "farm-a", "action": "STOP"}]
+        results = bulk_results(targets, collapse_targets(targets, GROUPS), [{"ok": True, "result": None}])
+        self.assertEqual(results[0]["viaGroup"], "farm-a")
+
+    def test_failed_group_call_fails_every_covered_target(self):
+        targets = [stop("a1"), stop("a2"), stop("a3"), stop("s1")]
+        calls = collapse_targets(targets, GROUPS)
+        outcomes = [{"ok": False, "error": "429"} if kwargs.get("group_name") else {"ok": True, "result": None} for kwargs, _ in calls]
+        results = bulk_results(targets, calls, outcomes)
+        self.assertEqual([result["ok"] for result in results], [False, False, False, True])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+# gap_free_stream on a scripted subscription and a fake REST history: python -m pytest tests
+import asyncio
+import threading
+import unittest
+
+import nicehash
+
+# trades 1..14, two of them sharing a millisecond, in the live (ms) and REST (µs) formats
+TRADES = [{"id": str(i), "p": 100 + i, "q": 0.5, "sd": "BUY", "t": 1000 + 10 * (i if i != 7 else 6)} for i in range(1, 15)]
+NOW_MS = 400000
+
+def live(*ids):
+    return [dict(TRADES[i - 1]) for i in ids]
+
+def candle(t, close=1.0):
+    return {"t": t, "o": 1.0, "h": 2.0, "l": 0.5, "c": close, "v": 3.0}
+
+CANDLES = [candle(t) for t in range(60, 421, 60)]
+
+class fake_subscription:
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.messages = asyncio.Queue()
+
+    def send(self, message):
+        self.messages.put_nowait(message)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.messages.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def close(self):
+        self.messages.put_nowait(None)
+
+# a sync REST client whose history calls wait for the gate, so the test decides what arrives during a backfill
+class fake_rest:
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.calls = []
+
+    def get_epoch_ms_from_now(self):
+        return NOW_MS
+
+    def get_trades(self, market, sortDirection='DESC', limit=25, timestamp=None):
+        self.gate.wait(5)
+        self.calls.append(("trades", timestamp))
+        older = [trade for trade in reversed(TRADES) if trade["t"] * 1000 < timestamp]
+        return [{"id": trade["id"], "price": trade["p"], "qty": trade["q"], "dir": trade["sd"], "time": trade["t"] * 1000} for trade in older[:limit]]
+
+    def get_candlesticks(self, market, from_s, to_s, resolution):
+        self.gate.wait(5)
+        self.calls.append(("candlesticks", from_s, to_s))
+        return [{"time": c["t"], "open": c["o"], "high": c["h"], "low": c["l"], "close": c["c"], "volume": c["v"]} for c in CANDLES if from_s <= c["t"] <= to_s]
+
+# let the stream handle everything sent so far
+async def settle(subscription):
+    while not subscription.messages.empty():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)
+
+async def finish(stream, subscription, rest):
+    rest.gate.set()
+    await subscription.close()
+    return [event async for event in stream]
+
+class gap_free_stream_test(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reconnect_and_skipped_sequence_are_backfilled(self):
+        subscription, rest = fake_subscription("trades"), fake_rest()
+        stream = nicehash.gap_free_stream(subscription, rest, "BTCUSDT").start()
+        subscription.send({"m": "m.s", "s": 1, "t": live(1, 2, 3)})
+        subscription.send({"m": "m.u", "s": 2, "t": live(4, 5)})
+        subscription.send({"m": "reconnect"})
+        await settle(subscription)
+        self.assertIsNotNone(stream.backfill)
+        # while the backfill waits: a fresh snapshot overlapping the history, then a skipped sequence number
+        subscription.send({"m": "m.s", "s": 1, "t": live(8, 9, 10)})
+        subscription.send({"m": "m.u", "s": 2, "t": live(11)})
+        subscription.send({"m": "m.u", "s": 4, "t": live(14)})
+        await settle(subscription)
+        events = await finish(stream, subscription, rest)
+        self.assertEqual([event["id"] for event in events], [str(i) for i in range(1, 15)])
+        self.assertEqual(events, live(*range(1, 15)))
+        self.assertEqual(stream.gaps, 2)
+        self.assertIsNone(stream.error)
+        # the second gap was fetched from where the first backfill left off
+        self.assertEqual(len(rest.calls), 2)
+
+    async def test_repeated_and_old_updates_are_dropped(self):
+        subscription, rest = fake_subscription("trades"), fake_rest()
+        stream = nicehash.gap_free_stream(subscription, rest, "BTCUSDT").start()
+        subscription.send({"m": "m.s", "s": 1, "t": live(1, 2)})
+        subscription.send({"m": "m.u", "s": 2, "t": live(3)})
+        subscription.send({"m": "m.u", "s": 2, "t": live(3)})
+        subscription.send({"m": "m.u", "s": 3, "t": live(2, 4)})
+        events = await finish(stream, subscription, rest)
+        self.assertEqual([event["id"] for event in events], ["1", "2", "3", "4"])
+        self.assertEqual(stream.gaps, 0)
+        self.assertEqual(rest.calls, [])
+
+    async def test_skipped_candle_is_backfilled(self):
+        subscription, rest = fake_subscription("candlesticks"), fake_rest()
+        stream = nicehash.gap_free_stream(subscription, rest, "BTCUSDT", resolution=1).start()
+        subscription.send({"m": "c.s", "s": 1, "c": [candle(60)]})
+        subscription.send({"m": "c.u", "s": 2, "c": candle(120, close=0.7)})
+        subscription.send({"m": "c.u", "s": 3, "c": candle(120)})
+        # out of order within a message: the earliest candle is the next one, so nothing is missing
+        subscription.send({"m": "c.u", "s": 4, "c": [candle(240), candle(180)]})
+        await settle(subscription)
+        self.assertEqual(stream.gaps, 0)
+        subscription.send({"m": "c.u", "s": 5, "c": candle(420)})
+        await settle(subscription)
+        self.assertEqual(stream.gaps, 1)
+        events = await finish(stream, subscription, rest)
+        self.assertEqual([event["t"] for event in events], [60, 120, 120, 180, 240, 300, 360, 420])
+        self.assertEqual(events[1]["c"], 0.7)
+        self.assertEqual(events[2], candle(120))
+        self.assertEqual(rest.calls, [("candlesticks", 240, NOW_MS // 1000 + 60)])
+
+    async def test_candlesticks_need_a_resolution(self):
+        with self.assertRaises(Exception):
+            nicehash.gap_free_stream(fake_subscription("candlesticks"), fake_rest(), "BTCUSDT")
+        ws = nicehash.websockets_api("ws://127.0.0.1:1", "org", "key", "secret")
+        with self.assertRaises(Exception):
+            await ws.gap_free_stream("candlesticks", fake_rest(), "BTCUSDT")
+        self.assertIsNone(ws.connection)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+# order_book: snapshots, deltas, sequence gaps and the cumulative queries: python -m pytest tests
+import random
+import unittest
+
+import nicehash
+
+SNAPSHOT = {"m": "ob.s", "s": 10, "b": [[0.010, 1], [0.009, 2], [0.008, 3]], "a": [[0.011, 1.5], [0.012, 2.5]]}
+
+def book(**options):
+    book = nicehash.order_book(tick=1e-4, **options)
+    book.apply(SNAPSHOT)
+    return book
+
+class order_book_feed_test(unittest.TestCase):
+
+    def test_snapshot(self):
+        b = book()
+        self.assertTrue(b.synced)
+        self.assertEqual(b.seq, 10)
+        self.assertEqual(b.best_bid(), (0.010, 1.0))
+        self.assertEqual(b.best_ask(), (0.011, 1.5))
+        self.assertEqual(b.levels_of("BUY", 5), [(0.010, 1.0), (0.009, 2.0), (0.008, 3.0)])
+        self.assertEqual(b.levels_of("SELL", 1), [(0.011, 1.5)])
+
+    def test_delta_sets_and_clears_levels(self):
+        b = book()
+        self.assertTrue(b.apply({"m": "ob.u", "s": 11, "b": [[0.010, 0], [0.0095, 4]], "a": [[0.011, 0.5]]}))
+        self.assertEqual(b.best_bid(), (0.0095, 4.0))
+        self.assertEqual(b.depth("BUY", 0.010), 0.0)
+        self.assertEqual(b.depth("SELL", 0.011), 0.5)
+        self.assertEqual(b.total("BUY"), 9.0)
+        self.assertEqual(b.seq, 11)
+
+    def test_repeated_update_is_ignored(self):
+        b = book()
+        b.apply({"m": "ob.u", "s": 11, "b": [[0.0105, 1]]})
+        self.assertFalse(b.apply({"m": "ob.u", "s": 11, "b": [[0.0105, 7]]}))
+        self.assertFalse(b.apply({"m": "ob.u", "s": 9, "b": [[0.0105, 7]]}))
+        self.assertEqual(b.depth("BUY", 0.0105), 1.0)
+
+    def test_gap_stops_deltas_until_the_next_snapshot(self):
+        gaps = []
+        b = book(on_gap=gaps.append)
+        self.assertFalse(b.apply({"m": "ob.u", "s": 12, "b": [[0.0105, 1]]}))
+        self.assertEqual(gaps, [b])
+        self.assertFalse(b.synced)
+        self.assertEqual(b.gaps, 1)
+        self.assertFalse(b.apply({"m": "ob.u", "s": 13, "b": [[0.0106, 1]]}))
+        self.assertEqual(b.best_bid(), (0.010, 1.0))
+        self.assertTrue(b.apply(dict(SNAPSHOT, s=20, b=[[0.02, 5]])))
+        self.assertEqual(b.best_bid(), (0.02, 5.0))
+        self.assertEqual(b.total("BUY"), 5.0)
+        self.assertTrue(b.apply({"m": "ob.u", "s": 21, "b": [[0.021, 1]]}))
+
+    def test_reconnect_waits_for_a_snapshot(self):
+        b = book()
+        b.apply({"m": "reconnect"})
+        self.assertFalse(b.apply({"m": "ob.u", "s": 11, "b": [[0.0105, 1]]}))
+        self.assertTrue(b.apply(dict(SNAPSHOT, s=3)))
+        self.assertTrue(b.apply({"m": "ob.u", "s": 4, "b": [[0.0105, 1]]}))
+
+    def test_deltas_before_any_snapshot_are_ignored(self):
+        b = nicehash.order_book(tick=1e-4)
+        self.assertFalse(b.apply({"m": "ob.u", "s": 1, "b": [[0.01, 1]]}))
+        self.assertIsNone(b.best_bid())
+
+class order_book_query_test(unittest.TestCase):
+
+    def test_cumulative_queries(self):
+        b = book()
+        self.assertEqual(b.volume_to("BUY", 0.009), 3.0)
+        self.assertEqual(b.volume_to("SELL", 0.012), 4.0)
+        self.assertEqual(b.volume_levels("BUY", 2), 3.0)
+        self.assertEqual(b.volume_levels("SELL", 5), 4.0)
+        self.assertEqual(b.volume_levels("SELL", 0), 0.0)
+        self.assertEqual(b.price_for_volume("BUY", 2.5), 0.009)
+        self.assertEqual(b.price_for_volume("SELL", 4), 0.012)
+        self.assertEqual(b.price_for_volume("SELL", 0), 0.011)
+        self.assertIsNone(b.price_for_volume("SELL", 4.00001))
+        self.assertAlmostEqual(b.spread(), 0.001)
+        self.assertAlmostEqual(b.mid(), 0.0105)
+
+    # after thousands of random updates the sums must still match the levels exactly, and the search must land on a
+    # level that exists
+    def test_queries_match_the_levels_after_many_updates(self):
+        rng = random.Random(1)
+        b = nicehash.order_book(tick=1e-4)
+        b.apply({"m": "ob.s", "s": 0, "b": [], "a": []})
+        reference = {"BUY": {}, "SELL": {}}
+        for seq in range(1, 5001):
+            side = rng.choice(["BUY", "SELL"])
+            price = round(rng.randint(1, 999) * 1e-4 + (0.1 if side == "SELL" else 0), 4)
+            volume = rng.choice([0, 0, round(rng.uniform(0.0001, 5), 4)])
+            b.apply({"m": "ob.u", "s": seq, "b" if side == "BUY" else "a": [[price, volume]]})
+            if volume:
+                reference[side][price] = volume
+            else:
+                reference[side].pop(price, None)
+
+        for side in ("BUY", "SELL"):
+            levels = sorted(reference[side].items(), reverse=side == "BUY")
+            self.assertEqual(b.levels_of(side, len(levels)), levels)
+            total = round(sum(volume for _, volume in levels), 8)
+            self.assertEqual(b.total(side), total)
+            self.assertEqual(b.price_for_volume(side, total), levels[-1][0])
+            self.assertIsNone(b.price_for_volume(side, total + 0.0001))
+            self.assertEqual(b.volume_to(side, levels[-1][0]), total)
+            running = 0
+            for n, (price, volume) in enumerate(levels, 1):
+                running = round(running + volume, 8)
+                if n % 25 == 0:
+                    self.assertEqual(b.volume_levels(side, n), running)
+                    self.assertEqual(b.volume_to(side, price), running)
+                    self.assertEqual(b.price_for_volume(side, running), price)
+
+class order_book_read_test(unittest.TestCase):
+
+    def test_error_without_an_update_is_raised(self):
+        b = book()
+        def broken():
+            return {}["missing"]
+        with self.assertRaises(KeyError):
+            b.read(broken)
+
+    def test_error_during_an_update_is_retried(self):
+        b = book()
+        calls = []
+        def racing():
+            calls.append(1)
+            if len(calls) == 1:
+                b.version += 2 # an update ran meanwhile
+                raise RuntimeError("dictionary changed size during iteration")
+            return "ok"
+        self.assertEqual(b.read(racing), "ok")
+        self.assertEqual(len(calls), 2)
+
+    def test_result_read_during_an_update_is_retried(self):
+        b = book()
+        calls = []
+        def racing():
+            calls.append(1)
+            if len(calls) == 1:
+                b.version += 2
+                return "torn"
+            return "whole"
+        self.assertEqual(b.read(racing), "whole")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# private_api requests as they go out, on a scripted transport: python -m pytest tests
+import json
+import unittest
+
+import nicehash
+
+class fake_response:
+
+    def __init__(self, payload):
+        self.status_code = 200
+        self.reason = "OK"
+        self.content = json.dumps(payload).encode()
+        self.headers = {}
+
+class fake_transport:
+
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+        self.urls = []
+
+    def request(self, method, url, headers=None, data=None, timeout=None, stream=False):
+        self.urls.append(url)
+        return fake_response(self.payloads.pop(0))
+
+    def close(self):
+        pass
+
+def workers(*names, pages=1):
+    return {"workers": [{"rigName": name} for name in names], "pagination": {"totalPageCount": pages}}
+
+class active_workers_test(unittest.TestCase):
+
+    def api(self, *payloads):
+        self.transport = fake_transport(*payloads)
+        return nicehash.private_api("http://upstream", "org", "key", "secret", rate_limit=False, clock_sync=False, transport=self.transport)
+
+    def test_own_workers_without_an_address(self):
+        api = self.api(workers("a"))
+        self.assertEqual(api.get_active_workers(size=10, page=2), workers("a"))
+        self.assertEqual(self.transport.urls, ["http://upstream/main/api/v2/mining/rigs/activeWorkers?size=10&page=2&sortParameter=RIG_NAME&sortDirection=ASC"])
+
+    def test_address_is_passed_through(self):
+        api = self.api(workers("a"))
+        api.get_active_workers("bc1address", size=10, sortDirection="DESC")
+        self.assertEqual(self.transport.urls, ["http://upstream/main/api/v2/mining/external/bc1address/rigs/activeWorkers?size=10&page=0&sortParameter=RIG_NAME&sortDirection=DESC"])
+
+    def test_iter_active_workers(self):
+        for address, path in ((None, "/main/api/v2/mining/rigs/activeWorkers"), ("bc1address", "/main/api/v2/mining/external/bc1address/rigs/activeWorkers")):
+            with self.subTest(address=address):
+                api = self.api(workers("a", "b", pages=2), workers("c", pages=2))
+                names = [worker["rigName"] for worker in api.iter_active_workers(address, size=2)]
+                self.assertEqual(names, ["a", "b", "c"])
+                self.assertEqual([url.split("?")[0] for url in self.transport.urls], ["http://upstream" + path] * 2)
+
+if __name__ == "__main__":
+    unittest.main()
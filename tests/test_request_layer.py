@@ -0,0 +1,249 @@
+# token_bucket, retries with backoff and circuit_breaker, on a fake clock and a scripted transport:
+# python -m pytest tests
+import json
+import unittest
+from unittest import mock
+
+import requests
+
+import nicehash
+
+# stands in for the time module inside nicehash: time only moves when something sleeps or the test advances it
+class fake_time:
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+    time = monotonic
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class fake_response:
+
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self.reason = "OK" if status_code == 200 else "Error"
+        self.content = json.dumps(payload if payload is not None else {}).encode()
+        self.headers = headers or {}
+
+# answers each request with the next scripted response, or raises it if it is an exception
+class fake_transport:
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, data=None, timeout=None, stream=False):
+        self.requests.append((method, url))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        pass
+
+class fake_clock_test(unittest.TestCase):
+
+    def setUp(self):
+        self.time = fake_time()
+        patcher = mock.patch.object(nicehash, "time", self.time)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+class token_bucket_test(fake_clock_test):
+
+    def test_burst_then_refill_rate(self):
+        bucket = nicehash.token_bucket(rate=2, burst=3)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+        # callers past the burst are queued half a second apart
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.5, 1.0, 1.5])
+        self.time.advance(1.5)
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_refill_stops_at_burst(self):
+        bucket = nicehash.token_bucket(rate=2, burst=3)
+        bucket.reserve()
+        self.time.advance(100)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_acquire_sleeps_for_its_turn(self):
+        bucket = nicehash.token_bucket(rate=4, burst=1)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.time.sleeps, [0.25, 0.25])
+
+class backoff_test(unittest.TestCase):
+
+    def test_retry_after_wins_up_to_the_cap(self):
+        self.assertEqual(nicehash.backoff_delay(0, 2.5), 2.5)
+        self.assertEqual(nicehash.backoff_delay(5, 0), 0)
+        self.assertEqual(nicehash.backoff_delay(0, 3600), nicehash.BACKOFF_MAX)
+
+    def test_jitter_stays_under_the_exponential_bound(self):
+        for attempt in range(10):
+            bound = min(nicehash.BACKOFF_MAX, nicehash.BACKOFF * 2 ** attempt)
+            for _ in range(50):
+                self.assertTrue(0 <= nicehash.backoff_delay(attempt) <= bound)
+
+    def test_retry_after_header(self):
+        self.assertEqual(nicehash.parse_retry_after("7"), 7.0)
+        self.assertIsNone(nicehash.parse_retry_after(None))
+        self.assertIsNone(nicehash.parse_retry_after("soon"))
+
+class retry_test(fake_clock_test):
+
+    def api(self, *responses, **options):
+        options.setdefault("breaker_failures", 0)
+        self.transport = fake_transport(*responses)
+        return nicehash.public_api("http://upstream", rate_limit=False, transport=self.transport, **options)
+
+    def test_get_retries_server_errors(self):
+        api = self.api(fake_response(503), fake_response(502), fake_response(200, {"ok": 1}))
+        self.assertEqual(api.request("GET", "/x", "", None), {"ok": 1})
+        self.assertEqual(len(self.transport.requests), 3)
+        self.assertEqual(api.counters["retries"], 2)
+
+    def test_get_retries_connection_errors(self):
+        api = self.api(requests.ConnectionError("reset"), fake_response(200, {"ok": 1}))
+        self.assertEqual(api.request("GET", "/x", "", None), {"ok": 1})
+        self.assertEqual(len(self.transport.requests), 2)
+
+    def test_get_gives_up_after_the_retries(self):
+        api = self.api(*[fake_response(503)] * 4, retries=3)
+        with self.assertRaises(nicehash.api_error) as raised:
+            api.request("GET", "/x", "", None)
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(len(self.transport.requests), 4)
+
+    def test_post_is_not_retried_after_a_server_error(self):
+        api = self.api(fake_response(503), fake_response(200))
+        with self.assertRaises(nicehash.api_error):
+            api.request("POST", "/x", "", {"a": 1})
+        self.assertEqual(len(self.transport.requests), 1)
+
+    def test_post_is_not_retried_after_a_connection_error(self):
+        api = self.api(requests.ConnectionError("reset"), fake_response(200))
+        with self.assertRaises(requests.ConnectionError):
+            api.request("POST", "/x", "", {"a": 1})
+        self.assertEqual(len(self.transport.requests), 1)
+
+    def test_client_errors_are_not_retried(self):
+        api = self.api(fake_response(400), fake_response(200))
+        with self.assertRaises(nicehash.api_error):
+            api.request("GET", "/x", "", None)
+        self.assertEqual(len(self.transport.requests), 1)
+
+    def test_429_is_retried_for_any_method_after_retry_after(self):
+        for method in ("GET", "POST", "DELETE"):
+            with self.subTest(method=method):
+                self.time.sleeps = []
+                api = self.api(fake_response(429, headers={"Retry-After": "2"}), fake_response(200, {"ok": 1}))
+                self.assertEqual(api.request(method, "/x", "", None), {"ok": 1})
+                self.assertEqual(self.time.sleeps, [2.0])
+                self.assertEqual(api.counters["throttled"], 1)
+
+    def test_long_retry_after_is_raised_not_slept(self):
+        api = self.api(fake_response(429, headers={"Retry-After": "3600"}), fake_response(200))
+        with self.assertRaises(nicehash.api_error) as raised:
+            api.request("GET", "/x", "", None)
+        self.assertEqual(raised.exception.retry_after, 3600)
+        self.assertEqual(self.time.sleeps, [])
+        self.assertEqual(len(self.transport.requests), 1)
+
+class circuit_breaker_test(fake_clock_test):
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = nicehash.circuit_breaker(failure_threshold=3, reset_timeout=10)
+        breaker.failure()
+        breaker.failure()
+        breaker.success(0.1) # a success in between starts the count again
+        breaker.failure()
+        breaker.failure()
+        breaker.before()
+        self.assertEqual(breaker.state, "closed")
+        breaker.failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(nicehash.circuit_open_error) as raised:
+            breaker.before()
+        self.assertEqual(raised.exception.retry_after, 10)
+
+    def test_half_open_lets_one_probe_through(self):
+        breaker = nicehash.circuit_breaker(failure_threshold=1, reset_timeout=10)
+        breaker.failure()
+        self.time.advance(9)
+        with self.assertRaises(nicehash.circuit_open_error):
+            breaker.before()
+        self.time.advance(1)
+        breaker.before()
+        self.assertEqual(breaker.state, "half_open")
+        with self.assertRaises(nicehash.circuit_open_error):
+            breaker.before() # only the probe goes out
+        # a failed probe opens it again for a whole reset_timeout
+        breaker.failure()
+        self.assertEqual(breaker.state, "open")
+        self.time.advance(9)
+        with self.assertRaises(nicehash.circuit_open_error):
+            breaker.before()
+        self.time.advance(1)
+        breaker.before()
+        breaker.success(0.1)
+        self.assertEqual(breaker.state, "closed")
+        breaker.before()
+
+    def test_lost_probe_is_replaced_after_reset_timeout(self):
+        breaker = nicehash.circuit_breaker(failure_threshold=1, reset_timeout=10)
+        breaker.failure()
+        self.time.advance(10)
+        breaker.before()
+        self.time.advance(10)
+        breaker.before()
+        self.assertEqual(breaker.state, "half_open")
+
+    def test_slow_success_counts_as_failure(self):
+        breaker = nicehash.circuit_breaker(failure_threshold=2, reset_timeout=10, latency_budget=1.0)
+        breaker.success(1.5)
+        breaker.success(1.5)
+        self.assertEqual(breaker.state, "open")
+
+    def test_client_error_proves_the_upstream_alive(self):
+        breaker = nicehash.circuit_breaker(failure_threshold=1, reset_timeout=10)
+        breaker.failure()
+        self.time.advance(10)
+        breaker.before()
+        breaker.alive()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_open_breaker_fails_fast_without_sending(self):
+        transport = fake_transport(*[fake_response(503)] * 2 + [fake_response(200, {"ok": 1})])
+        api = nicehash.public_api("http://upstream", rate_limit=False, retries=0, breaker_failures=2, breaker_reset=10, transport=transport)
+        for _ in range(2):
+            with self.assertRaises(nicehash.api_error):
+                api.request("GET", "/x", "", None)
+        with self.assertRaises(nicehash.circuit_open_error):
+            api.request("GET", "/x", "", None)
+        self.assertEqual(len(transport.requests), 2)
+        self.time.advance(10)
+        self.assertEqual(api.request("GET", "/x", "", None), {"ok": 1})
+        self.assertEqual(api.breaker.state, "closed")
+
+    def test_open_breaker_is_not_retried(self):
+        transport = fake_transport(*[fake_response(503)] * 3)
+        api = nicehash.public_api("http://upstream", rate_limit=False, retries=3, breaker_failures=2, breaker_reset=10, transport=transport)
+        with self.assertRaises(nicehash.circuit_open_error):
+            api.request("GET", "/x", "", None)
+        self.assertEqual(len(transport.requests), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+# response_cache expiry, eviction and copies, alone and behind public_api.request: python -m pytest tests
+import json
+import time
+import unittest
+from unittest import mock
+
+import nicehash
+
+# stands in for the time module inside nicehash, so entries only age when the test says so
+class fake_time:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+    time = monotonic
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class fake_response:
+
+    def __init__(self, payload):
+        self.status_code = 200
+        self.reason = "OK"
+        self.content = json.dumps(payload).encode()
+        self.headers = {}
+
+class fake_transport:
+
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+        self.requests = 0
+
+    def request(self, method, url, headers=None, data=None, timeout=None, stream=False):
+        self.requests += 1
+        return fake_response(self.payloads.pop(0))
+
+    def close(self):
+        pass
+
+# wait until cond() holds
+def until(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+class fake_clock_test(unittest.TestCase):
+
+    def setUp(self):
+        self.time = fake_time()
+        patcher = mock.patch.object(nicehash, "time", self.time)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+class response_cache_test(fake_clock_test):
+
+    def test_fresh_then_stale_then_gone(self):
+        cache = nicehash.response_cache()
+        cache.put("k", {"v": 1}, 10, 20)
+        self.assertEqual(cache.get("k"), ({"v": 1}, "fresh"))
+        self.time.advance(10)
+        self.assertEqual(cache.get("k"), ({"v": 1}, "stale"))
+        self.time.advance(19.9)
+        self.assertEqual(cache.get("k")[1], "stale")
+        self.time.advance(0.1)
+        self.assertEqual(cache.get("k"), (None, None))
+        self.assertEqual(cache.stats(), {"hits": 1, "stale_hits": 2, "misses": 1, "evictions": 0, "size": 1})
+
+    def test_least_recently_used_is_evicted(self):
+        cache = nicehash.response_cache(maxsize=2)
+        cache.put("a", 1, 10)
+        cache.put("b", 2, 10)
+        cache.get("a")
+        cache.put("c", 3, 10)
+        self.assertEqual(cache.get("b"), (None, None))
+        self.assertEqual(cache.get("a"), (1, "fresh"))
+        self.assertEqual(cache.get("c"), (3, "fresh"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_values_are_copied_in_and_out(self):
+        cache = nicehash.response_cache()
+        value = {"list": [{"a": 1}]}
+        cache.put("k", value, 10)
+        value["list"][0]["a"] = 2
+        got, _ = cache.get("k")
+        self.assertEqual(got, {"list": [{"a": 1}]})
+        got["list"].append("x")
+        self.assertEqual(cache.get("k")[0], {"list": [{"a": 1}]})
+
+    def test_one_refresh_per_key(self):
+        cache = nicehash.response_cache()
+        self.assertTrue(cache.begin_refresh("k"))
+        self.assertFalse(cache.begin_refresh("k"))
+        self.assertTrue(cache.begin_refresh("other"))
+        cache.end_refresh("k")
+        self.assertTrue(cache.begin_refresh("k"))
+
+class cached_request_test(fake_clock_test):
+
+    def api(self, *payloads):
+        self.transport = fake_transport(*payloads)
+        return nicehash.public_api("http://upstream", rate_limit=False, breaker_failures=0, cache_ttls={"/x": (10, 60)}, transport=self.transport)
+
+    def test_stale_while_revalidate(self):
+        api = self.api({"v": 1}, {"v": 2}, {"v": 3})
+        self.assertEqual(api.request("GET", "/x", "", None), {"v": 1})
+        self.time.advance(5)
+        self.assertEqual(api.request("GET", "/x", "", None), {"v": 1})
+        self.assertEqual(self.transport.requests, 1)
+        # stale: answered from the cache at once, refreshed in the background
+        self.time.advance(10)
+        self.assertEqual(api.request("GET", "/x", "", None), {"v": 1})
+        until(lambda: self.transport.requests == 2 and not api.cache.refreshing)
+        self.assertEqual(api.request("GET", "/x", "", None), {"v": 2})
+        # past the stale window it is a miss, fetched in line
+        self.time.advance(100)
+        self.assertEqual(api.request("GET", "/x", "", None), {"v": 3})
+        self.assertEqual(self.transport.requests, 3)
+
+    def test_callers_get_their_own_copy(self):
+        api = self.api({"rigs": [{"name": "a"}]})
+        first = api.request("GET", "/x", "", None)
+        first["rigs"].clear()
+        self.assertEqual(api.request("GET", "/x", "", None), {"rigs": [{"name": "a"}]})
+
+    def test_other_queries_are_cached_apart(self):
+        api = self.api({"v": 1}, {"v": 2})
+        self.assertEqual(api.request("GET", "/x", "a=1", None), {"v": 1})
+        self.assertEqual(api.request("GET", "/x", "a=2", None), {"v": 2})
+        self.assertEqual(api.request("GET", "/x", "a=1", None), {"v": 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# The Flask app against bench.mock_server: POST /bulk/control and the snapshot headers: python -m pytest tests
+import os
+import unittest
+from unittest import mock
+
+import nicehash
+
+from bench.signing import KEY, SECRET, ORG_ID
+from bench.mock_server import fleet, mock_server, serve_in_background
+
+server = mock_server(fleet(40), KEY, SECRET, ORG_ID)
+base, stop_server = serve_in_background(server)
+os.environ.update(NICEHASH_URL=base, KEY=KEY, SECRET=SECRET, ORG_ID=ORG_ID)
+import main
+
+def tearDownModule():
+    stop_server()
+
+# targets that would reach update_status with an empty rigId and group, i.e. every rig in the org
+ORG_WIDE = [
+    {"group": "", "action": "STOP"},
+    {"name": "x", "rigId": "", "action": "STOP"},
+    {"rigId": "", "group": "", "action": "POWER_MODE", "options": ["LOW"]},
+    {"name": "", "action": "STOP"},
+    {"group": None, "action": "STOP"},
+    {"rigId": 5, "action": "STOP"},
+]
+
+class bulk_control_test(unittest.TestCase):
+
+    def setUp(self):
+        server.fleet = fleet(40)
+        main.private_api.rate_limit = False
+        main.snapshot.refresh()
+        self.client = main.app.test_client()
+
+    def stopped(self):
+        return sum(1 for status in server.fleet.statuses if status == "STOPPED")
+
+    def test_org_wide_targets_are_rejected(self):
+        before = self.stopped()
+        for target in ORG_WIDE:
+            with self.subTest(target=target):
+                response = self.client.post("/bulk/control", json={"targets": [target]})
+                self.assertEqual(response.status_code, 400)
+        # a real name next to a bad target doesn't get the batch through either
+        name = server.fleet.name(0)
+        response = self.client.post("/bulk/control", json={"targets": [{"name": name, "action": "STOP"}, ORG_WIDE[0]]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stopped(), before)
+
+    def test_named_rig_only_affects_that_rig(self):
+        i = next(i for i, status in enumerate(server.fleet.statuses) if status != "STOPPED")
+        before = self.stopped()
+        response = self.client.post("/bulk/control", json={"targets": [{"name": server.fleet.name(i), "action": "STOP"}], "collapse": False})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()[0]["ok"])
+        self.assertEqual(server.fleet.statuses[i], "STOPPED")
+        self.assertEqual(self.stopped(), before + 1)
+
+    # the mock follows the api: no rigId and no group is the whole fleet, which is what the checks above keep out
+    def test_empty_group_is_the_whole_fleet(self):
+        main.private_api.update_status("STOP")
+        self.assertEqual(self.stopped(), server.fleet.size)
+
+class snapshot_headers_test(unittest.TestCase):
+
+    def setUp(self):
+        server.fleet = fleet(40)
+        server.failure_rate = 0.0
+        main.private_api.rate_limit = False
+        main.private_api.breaker = nicehash.circuit_breaker(main.private_api.breaker.failure_threshold, main.private_api.breaker.reset_timeout)
+        main.snapshot.refresh()
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        server.failure_rate = 0.0
+        main.private_api.retries = nicehash.RETRIES
+
+    # one pass of the background refresh loop: it stops where it would wait for the next one
+    def refresh_in_background(self):
+        with mock.patch.object(main.snapshot.stopped, "wait", lambda timeout: main.snapshot.stop()):
+            main.snapshot.run()
+        main.snapshot.stopped.clear()
+
+    def test_fresh_snapshot(self):
+        response = self.client.post("/" + server.fleet.name(0))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("X-Snapshot-Age", response.headers)
+        self.assertNotIn("X-Snapshot-Stale", response.headers)
+
+    def test_failed_refresh_serves_last_known_statuses_as_stale(self):
+        name = server.fleet.name(0)
+        known = self.client.post("/" + name).get_json()
+        server.failure_rate = 1.0
+        main.private_api.retries = 0
+        self.refresh_in_background()
+        self.assertIsNotNone(main.snapshot.error)
+        response = self.client.post("/" + name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), known)
+        self.assertEqual(response.headers["X-Snapshot-Stale"], "true")
+        response = self.client.post("/", json={"names": [name]})
+        self.assertEqual(response.headers["X-Snapshot-Stale"], "true")
+        # the next good refresh clears it
+        server.failure_rate = 0.0
+        self.refresh_in_background()
+        self.assertNotIn("X-Snapshot-Stale", self.client.post("/" + name).headers)
+
+if __name__ == "__main__":
+    unittest.main()
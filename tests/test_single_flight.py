@@ -0,0 +1,123 @@
+# single_flight coalescing: python -m pytest tests
+import json
+import threading
+import time
+import unittest
+
+import nicehash
+
+class fake_response:
+
+    def __init__(self, payload):
+        self.status_code = 200
+        self.reason = "OK"
+        self.content = json.dumps(payload).encode()
+        self.headers = {}
+
+class fake_transport:
+
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+        self.requests = 0
+
+    def request(self, method, url, headers=None, data=None, timeout=None, stream=False):
+        self.requests += 1
+        return fake_response(self.payloads.pop(0))
+
+    def close(self):
+        pass
+
+# wait until cond() holds
+def until(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+class single_flight_test(unittest.TestCase):
+
+    def run_callers(self, flights, key, fn, callers):
+        results = [None] * callers
+        def call(i):
+            try:
+                results[i] = flights.do(key, fn)
+            except Exception as e:
+                results[i] = e
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+        return threads, results
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = nicehash.single_flight()
+        release = threading.Event()
+        calls = []
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return {"rigs": []}
+        threads, results = self.run_callers(flights, "k", fn, 5)
+        threads[0].start()
+        until(lambda: "k" in flights.calls)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05) # let the others find the call in flight
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flights.calls, {})
+
+    def test_error_reaches_every_caller(self):
+        flights = nicehash.single_flight()
+        release = threading.Event()
+        def fn():
+            release.wait(5)
+            raise ValueError("upstream down")
+        threads, results = self.run_callers(flights, "k", fn, 3)
+        threads[0].start()
+        until(lambda: "k" in flights.calls)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_concurrent_gets_send_one_request(self):
+        release = threading.Event()
+        transport = fake_transport({"v": 1}, {"v": 2})
+        send = transport.request
+        def slow(*args, **kwargs):
+            release.wait(5)
+            return send(*args, **kwargs)
+        transport.request = slow
+        api = nicehash.public_api("http://upstream", rate_limit=False, breaker_failures=0, transport=transport)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(api.request("GET", "/y", "", None))) for _ in range(5)]
+        threads[0].start()
+        until(lambda: api.flights.calls)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{"v": 1}] * 5)
+        self.assertEqual(transport.requests, 1)
+        # writes are never coalesced
+        self.assertEqual(api.request("POST", "/y", "", {"a": 1}), {"v": 2})
+
+    def test_finished_calls_and_other_keys_are_not_shared(self):
+        flights = nicehash.single_flight()
+        calls = []
+        def fn():
+            calls.append(1)
+            return len(calls)
+        self.assertEqual(flights.do("a", fn), 1)
+        self.assertEqual(flights.do("a", fn), 2)
+        self.assertEqual(flights.do("b", fn), 3)
+
+if __name__ == "__main__":
+    unittest.main()
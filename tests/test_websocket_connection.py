@@ -0,0 +1,151 @@
+# websocket_connection against a local aiohttp websocket stub: multiplexing, reconnects and slow consumers:
+# python -m pytest tests
+import asyncio
+import itertools
+import unittest
+
+from aiohttp import web, WSMsgType
+
+import nicehash
+
+PREFIXES = {channel: prefix for prefix, channel in nicehash.WS_CHANNELS.items()}
+
+class stub:
+
+    def __init__(self):
+        self.sockets = []
+        self.received = [] # messages from the client, in order
+        self.headers = [] # headers of every connection
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/ws", self.websocket)
+        return app
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.headers.append(dict(request.headers))
+        self.sockets.append(ws)
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                message = message.json()
+                self.received.append(message)
+                action, _, channel = message["m"].partition(".")
+                if action == "subscribe":
+                    await ws.send_json({"m": PREFIXES[channel] + ".s", "s": len(self.headers)})
+        finally:
+            self.sockets.remove(ws)
+        return ws
+
+    async def push(self, message):
+        for ws in list(self.sockets):
+            await ws.send_json(message)
+
+    async def drop(self):
+        for ws in list(self.sockets):
+            await ws.close()
+
+nonces = itertools.count()
+
+async def headers():
+    return {"X-Nonce": str(next(nonces))}
+
+async def next_message(subscription, timeout=5):
+    return await asyncio.wait_for(subscription.__anext__(), timeout)
+
+# wait until cond() holds, checking on the loop
+async def until(cond, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if cond():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+class websocket_connection_test(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.stub = stub()
+        self.runner = web.AppRunner(self.stub.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.connection = nicehash.websocket_connection("ws://127.0.0.1:{}/ws".format(port), headers)
+
+    async def asyncTearDown(self):
+        await self.connection.close()
+        await self.runner.cleanup()
+
+    async def test_channels_share_one_connection(self):
+        trades = await self.connection.subscribe("trades", {"m": "subscribe.trades"})
+        book = await self.connection.subscribe("orderbook", {"m": "subscribe.orderbook"})
+        self.assertEqual((await next_message(trades))["m"], "m.s")
+        self.assertEqual((await next_message(book))["m"], "ob.s")
+        more = await self.connection.subscribe("trades", {"m": "subscribe.trades"})
+        await self.stub.push({"m": "ob.u", "s": 2})
+        await self.stub.push({"m": "m.u", "s": 2})
+        self.assertEqual(await next_message(book), {"m": "ob.u", "s": 2})
+        self.assertEqual(await next_message(trades), {"m": "m.u", "s": 2})
+        self.assertEqual(await next_message(more), {"m": "m.u", "s": 2})
+        self.assertEqual(len(self.stub.headers), 1)
+        self.assertEqual([message["m"] for message in self.stub.received], ["subscribe.trades", "subscribe.orderbook"])
+        # a different message for a subscribed channel is refused
+        with self.assertRaises(Exception):
+            await self.connection.subscribe("trades", {"m": "subscribe.trades", "x": 1})
+        # the channel is only unsubscribed when its last subscription closes
+        await trades.close()
+        with self.assertRaises(StopAsyncIteration):
+            await next_message(trades)
+        await more.close()
+        await until(lambda: len(self.stub.received) == 3)
+        self.assertEqual(self.stub.received[-1], {"m": "unsubscribe.trades"})
+        await self.stub.push({"m": "ob.u", "s": 3})
+        self.assertEqual(await next_message(book), {"m": "ob.u", "s": 3})
+
+    async def test_reconnect_resubscribes_every_channel(self):
+        trades = await self.connection.subscribe("trades", {"m": "subscribe.trades"}, reconnects=True)
+        book = await self.connection.subscribe("orderbook", {"m": "subscribe.orderbook"})
+        self.assertEqual(await next_message(trades), {"m": "m.s", "s": 1})
+        self.assertEqual(await next_message(book), {"m": "ob.s", "s": 1})
+        await self.stub.drop()
+        # reconnects=True subscriptions hear about it before the fresh snapshot, the others only get the snapshot
+        self.assertEqual(await next_message(trades), {"m": "reconnect"})
+        self.assertEqual(await next_message(trades), {"m": "m.s", "s": 2})
+        self.assertEqual(await next_message(book), {"m": "ob.s", "s": 2})
+        self.assertEqual(self.connection.connections, 2)
+        self.assertEqual(sorted(message["m"] for message in self.stub.received[2:]), ["subscribe.orderbook", "subscribe.trades"])
+        # every connection is signed afresh
+        self.assertNotEqual(self.stub.headers[0]["X-Nonce"], self.stub.headers[1]["X-Nonce"])
+        await self.stub.push({"m": "m.u", "s": 3})
+        self.assertEqual(await next_message(trades), {"m": "m.u", "s": 3})
+
+    async def test_full_queue_drops_by_default(self):
+        slow = await self.connection.subscribe("trades", {"m": "subscribe.trades"}, maxsize=2)
+        book = await self.connection.subscribe("orderbook", {"m": "subscribe.orderbook"})
+        await next_message(book)
+        for s in range(2, 7):
+            await self.stub.push({"m": "m.u", "s": s})
+        await self.stub.push({"m": "ob.u", "s": 2})
+        self.assertEqual(await next_message(book), {"m": "ob.u", "s": 2})
+        self.assertEqual(slow.dropped, 4)
+        self.assertEqual([(await next_message(slow))["s"] for _ in range(2)], [5, 6])
+
+    async def test_blocked_consumer_holds_up_the_connection_for_a_bounded_time(self):
+        slow = await self.connection.subscribe("trades", {"m": "subscribe.trades"}, maxsize=1, overflow="block", block_timeout=0.1)
+        book = await self.connection.subscribe("orderbook", {"m": "subscribe.orderbook"})
+        await next_message(book)
+        for s in range(2, 5):
+            await self.stub.push({"m": "m.u", "s": s})
+        await self.stub.push({"m": "ob.u", "s": 2})
+        self.assertEqual(await next_message(book, timeout=2), {"m": "ob.u", "s": 2})
+        # the snapshot stayed queued; the updates that found no room were dropped, not waited on forever
+        self.assertEqual(slow.dropped, 3)
+        self.assertEqual(await next_message(slow), {"m": "m.s", "s": 1})
+        await self.stub.push({"m": "m.u", "s": 5})
+        self.assertEqual(await next_message(slow), {"m": "m.u", "s": 5})
+
+if __name__ == "__main__":
+    unittest.main()